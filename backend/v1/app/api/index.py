@@ -221,20 +221,24 @@ try:
     import faiss  # optional: used for delete/reindex operations
 except Exception:
     faiss = None
-import pickle
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 import os
 from werkzeug.utils import secure_filename
-import time
-import threading
-from utils.text_utils import extract_text, chunk_text
-from services.embedding_service import get_embedding
-from services.faiss_service import create_or_update_index, load_faiss_index, load_metadata
-from services.llm_service import ask_llm_with_faiss
-import numpy as np
+from services.faiss_service import index_cache_stats, delete_source, get_index_and_meta_file, read_snapshot
+from services import meta_store, answer_cache, embedding_cache, job_service, ingest_service, progress_bus, telemetry_outbox, thread_store, bm25_index, tracing
+from services.llm_service import ask_llm_with_faiss, stream_llm_with_faiss, batch_answer_with_faiss, category_param, LLM_BATCH_MAX_QUESTIONS
+import json
 import requests
 
 bp = Blueprint('index', __name__)
+
+# Worker pool untuk job upload; dicek lagi per request karena thread tidak ikut ter-fork (gunicorn --preload)
+job_service.start_workers()
+
+@bp.before_app_request
+def ensure_job_workers():
+    job_service.start_workers()
+
 @bp.after_request
 def add_cors_headers(response):
     try:
@@ -261,8 +265,6 @@ def upload_options():
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'docs')
 ALLOWED_EXTENSIONS = {'pdf', 'txt'}
 import uuid
-progress_messages = {}  # key: progress_id, value: list of messages
-progress_lock = threading.Lock()
 @bp.route('/docs/<kategori>/<filename>')
 
 def serve_file(kategori, filename):
@@ -274,10 +276,7 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def send_progress(msg, progress_id):
-    with progress_lock:
-        if progress_id not in progress_messages:
-            progress_messages[progress_id] = []
-        progress_messages[progress_id].append(msg)
+    progress_bus.publish(progress_id, msg)
 
 @bp.route('/progress-stream')
 def progress_stream():
@@ -287,18 +286,26 @@ def progress_stream():
     if not progress_id:
         print("[SSE] Missing progress id", file=sys.stderr)
         return Response("Missing progress id", status=400)
+    # Setiap stream memegang satu thread gthread; batasi jumlahnya per worker
+    if not progress_bus.try_open_stream():
+        return Response("Too many progress streams", status=503, headers={'Retry-After': '5'})
+    # EventSource mengirim Last-Event-ID saat reconnect: lanjutkan dari pesan terakhir yang diterima
+    last_id = request.headers.get('Last-Event-ID', '')
+    after_seq = int(last_id) if last_id.isdigit() else 0
     def event_stream():
-        last_index = 0
-        while True:
-            with progress_lock:
-                msgs = progress_messages.get(progress_id, [])
-                new_msgs = msgs[last_index:]
-                last_index = len(msgs)
-            for msg in new_msgs:
-                print(f"[SSE] Sending progress: {msg}", file=sys.stderr)
-                yield f"data: {msg}\n\n"
-            time.sleep(0.5)
-    return Response(event_stream(), mimetype="text/event-stream")
+        for kind, seq, value in progress_bus.subscribe(progress_id, after_seq):
+            if kind == 'message':
+                print(f"[SSE] Sending progress: {value}", file=sys.stderr)
+                yield f"id: {seq}\ndata: {value}\n\n"
+            elif kind == 'heartbeat':
+                yield "event: heartbeat\ndata: {}\n\n"
+            else:
+                yield f"event: end\ndata: {json.dumps({'status': value})}\n\n"
+    response = Response(event_stream(), mimetype="text/event-stream",
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Slot dilepas saat server menutup response (selesai atau client putus)
+    response.call_on_close(progress_bus.close_stream)
+    return response
 
 @bp.route('/progress-stream', methods=['OPTIONS'])
 def progress_stream_options():
@@ -313,10 +320,29 @@ def health():
             'ok': True,
             'OPENAI_API_KEY_present': key_present,
             'cwd': os.getcwd(),
+            'index_cache': index_cache_stats(),
+            'answer_cache': answer_cache.stats(),
+            'embedding_cache': embedding_cache.stats(),
+            'jobs': job_service.stats(),
+            'progress': progress_bus.stats(),
+            'telemetry': telemetry_outbox.stats(),
+            'threads': thread_store.stats(),
+            'bm25': bm25_index.stats(),
         })
     except Exception as e:
         return jsonify({'ok': False, 'error': str(e)}), 500
 
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus: latency histogram per stage, token OpenAI dan hit rate cache (per proses/worker)."""
+    caches = {'index': index_cache_stats(), 'answer': answer_cache.stats(), 'embedding': embedding_cache.stats()}
+    return Response(tracing.render_metrics(caches), mimetype='text/plain; version=0.0.4')
+
+def _debug_flag(data=None):
+    # debug=1 (body JSON, form atau query string): sertakan timing per tahap di response
+    value = (data or {}).get('debug') or request.form.get('debug') or request.args.get('debug')
+    return str(value).lower() in ('1', 'true', 'yes')
+
 @bp.route('/upload', methods=['POST'])
 def upload_file():
     progress_id = request.form.get('progress_id') or str(uuid.uuid4())
@@ -331,78 +357,58 @@ def upload_file():
     if file and allowed_file(file.filename):
         print(f"[UPLOAD] Mulai upload file: {file.filename}, kategori: {kategori}, progress_id: {progress_id}", file=sys.stderr)
         filename = secure_filename(file.filename)
-        kategori_dir = os.path.join(UPLOAD_FOLDER, kategori)
-        os.makedirs(kategori_dir, exist_ok=True)
-        file_path = os.path.join(kategori_dir, filename)
-        file.save(file_path)
-        send_progress("Upload started", progress_id)
-        text = extract_text(file_path)
-        if not text.strip():
-            print("[UPLOAD] File tidak berisi teks.", file=sys.stderr)
-            return jsonify({'ok': False, 'error': 'File tidak berisi teks.'}), 400
-        send_progress("Text extracted", progress_id)
-        chunks = chunk_text(text, 500)
-        if not chunks:
-            print("[UPLOAD] Tidak ada chunk yang dihasilkan.", file=sys.stderr)
-            return jsonify({'ok': False, 'error': 'Tidak ada chunk yang dihasilkan.'}), 400
-        send_progress(f"Text chunked: {len(chunks)} chunks", progress_id)
-        vectors = []
-        metadatas = []
-        for i, chunk in enumerate(chunks):
-            print(f"[UPLOAD] Mulai embedding chunk {i+1}/{len(chunks)}", file=sys.stderr)
-            emb = get_embedding(chunk)
-            print(f"[UPLOAD] Selesai embedding chunk {i+1}/{len(chunks)}", file=sys.stderr)
-            if not emb:
-                print(f"[UPLOAD] Gagal membuat embedding untuk chunk {i+1}.", file=sys.stderr)
-                return jsonify({'ok': False, 'error': f'Gagal membuat embedding pada chunk {i+1}'}), 400
-            vectors.append(emb)
-            metadatas.append({
-                'source': filename,
-                'chunk_index': i,
-                'text': chunk,
-                'kategori': kategori,
-                'regional': regional
-            })
-            send_progress(f"Embedding {i+1}/{len(chunks)}", progress_id)
-        if not vectors:
-            print("[UPLOAD] Tidak ada embedding yang berhasil dibuat.", file=sys.stderr)
-            return jsonify({'ok': False, 'error': 'Gagal membuat embedding.'}), 400
-        # Pastikan folder vector ada
-        vector_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../vector'))
-        os.makedirs(vector_dir, exist_ok=True)
-        index_file = os.path.join(vector_dir, f'index_{kategori}.faiss')
-        meta_file = os.path.join(vector_dir, f'meta_{kategori}.pkl')
-        send_progress("Indexing started", progress_id)
-        create_or_update_index(vectors, metadatas, index_file, meta_file)
-        send_progress("Done", progress_id)
-        # Notify portal about the document for regional aggregation (best-effort)
-        try:
-            portal_api = os.environ.get('PORTAL_API_URL')
-            if portal_api:
-                size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
-                requests.post(f"{portal_api}/documents", json={
-                    'filename': filename,
-                    'kategori': kategori,
-                    'regional': regional,
-                    'size': size,
-                    'uploaded_by': request.form.get('uploaded_by') or request.args.get('uploaded_by') or 'system'
-                }, timeout=3)
-        except Exception:
-            pass
-        print(f"[UPLOAD] Selesai upload dan indexing file: {file.filename}, progress_id: {progress_id}", file=sys.stderr)
-        # Hapus progress_messages dengan delay agar SSE client sempat menerima semua pesan
-        def delayed_cleanup(pid):
-            import time
-            time.sleep(10)
-            with progress_lock:
-                progress_messages.pop(pid, None)
-            print(f"[UPLOAD] progress_messages untuk {pid} dihapus setelah delay", file=sys.stderr)
-        threading.Thread(target=delayed_cleanup, args=(progress_id,), daemon=True).start()
-        return jsonify({'ok': True, 'message': 'File uploaded and indexing started (Python backend)', 'progress_id': progress_id}), 200
+        # Timing request ini ada di response (debug=1); timing job-nya di /jobs/<id> -> result.timings
+        with tracing.trace('upload_request', job_id=progress_id, filename=filename, category=kategori) as trace:
+            kategori_dir = os.path.join(UPLOAD_FOLDER, kategori)
+            os.makedirs(kategori_dir, exist_ok=True)
+            file_path = os.path.join(kategori_dir, filename)
+            with tracing.span('file_save'):
+                file.save(file_path)
+            # Ekstraksi, chunking, embedding dan indexing berjalan di worker pool (services/job_service),
+            # request ini langsung selesai; progress lewat /progress-stream?id=<progress_id> atau /jobs/<progress_id>
+            try:
+                with tracing.span('job_enqueue'):
+                    job_service.enqueue(ingest_service.JOB_KIND, {
+                        'file_path': os.path.abspath(file_path),
+                        'filename': filename,
+                        'kategori': kategori,
+                        'regional': regional,
+                        'uploaded_by': request.form.get('uploaded_by') or request.args.get('uploaded_by') or 'system',
+                        'trace_id': trace.id
+                    }, progress_id)
+            except ValueError as e:
+                trace.annotate(status='rejected', error=str(e))
+                return jsonify({'ok': False, 'error': str(e), 'trace_id': trace.id}), 409
+        body = {'ok': True, 'message': 'File uploaded, indexing queued', 'progress_id': progress_id,
+                'job_id': progress_id, 'status_url': f'/jobs/{progress_id}', 'trace_id': trace.id}
+        if _debug_flag():
+            body['debug'] = trace.summary()
+        return jsonify(body), 202
     else:
         print(f"[UPLOAD] File type not allowed: {file.filename}", file=sys.stderr)
         return jsonify({'ok': False, 'error': 'File type not allowed'}), 400
 
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_service.get(job_id)
+    if job is None:
+        return jsonify({'ok': False, 'error': 'Job tidak ditemukan'}), 404
+    return jsonify({
+        'ok': True,
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'result': job['result'],
+        'error': job['error'],
+        'attempts': job['attempts'],
+        'filename': job['payload'].get('filename'),
+        'kategori': job['payload'].get('kategori'),
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+    })
+
 @bp.route('/docs', methods=['GET'])
 def list_docs():
     try:
@@ -427,13 +433,9 @@ def vector_list():
         kategori = (request.args.get('kategori') or '').strip()
         if not kategori:
             return jsonify({"ok": False, "error": "kategori wajib"}), 400
-        vector_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../vector'))
-        meta_file = os.path.join(vector_dir, f'meta_{kategori}.pkl')
-        if not os.path.exists(meta_file):
-            return jsonify({"ok": True, "kategori": kategori, "sources": []})
-        with open(meta_file, 'rb') as f:
-            metas = pickle.load(f)
-        sources = sorted(list({(m.get('source') or '') for m in (metas or []) if isinstance(m, dict)}))
+        _, meta_file = get_index_and_meta_file(kategori)
+        # Daftar source dibaca dari header metadata kolumnar, tanpa memuat baris
+        sources = meta_store.sources(meta_file)
         return jsonify({"ok": True, "kategori": kategori, "sources": sources})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -442,27 +444,97 @@ def vector_list():
 def answer():
     data = request.get_json()
     question = data.get('question')
-    kategori = data.get('kategori')
+    # kategori boleh list (["hukum", "sdm"]): dicari di semua kategori itu sekaligus
+    kategori = category_param(data.get('kategori'))
     regional = data.get('regional')
     user_id = data.get('user_id', 'default')
     thread_id = data.get('thread_id', 'default')
     top_k = data.get('top_k', 5)
     # Terima baik security_key maupun security_api_key dari frontend
     security_api_key = data.get('security_api_key') or data.get('security_key')
+    # bypass_cache: paksa pencarian dan jawaban baru (abaikan semantic answer cache)
+    use_cache = not data.get('bypass_cache')
     if not question or not kategori:
         return jsonify({'ok': False, 'error': 'Pertanyaan dan kategori wajib diisi'}), 400
-    result = ask_llm_with_faiss(question, kategori, user_id=user_id, thread_id=thread_id, top_k=top_k, security_api_key=security_api_key, regional=regional)
+    result = ask_llm_with_faiss(question, kategori, user_id=user_id, thread_id=thread_id, top_k=top_k, security_api_key=security_api_key, regional=regional, use_cache=use_cache)
     if not result:
         return jsonify({'ok': False, 'error': 'Internal error: no result from LLM'}), 500
+    trace = result.get('trace') or {}
     if result.get('error'):
-        return jsonify({'ok': False, 'error': result.get('error')}), 200
-    return jsonify({
-        'ok': True,
-        'answer': result.get('llm_answer'),
-        'results': result.get('results'),
-        'error': result.get('error'),
-        'prompt': result.get('prompt')
-    })
+        body = {'ok': False, 'error': result.get('error')}
+    else:
+        body = {
+            'ok': True,
+            'answer': result.get('llm_answer'),
+            'results': result.get('results'),
+            'error': result.get('error'),
+            'prompt': result.get('prompt'),
+            'cached': result.get('cached', False)
+        }
+    if _debug_flag(data):
+        body['debug'] = trace
+    resp = jsonify(body)
+    if trace.get('trace_id'):
+        resp.headers['X-Trace-Id'] = trace['trace_id']
+    return resp
+
+@bp.route('/answer/stream', methods=['POST'])
+def answer_stream():
+    """Sama seperti /answer, tetapi dikirim sebagai SSE: sources, delta (potongan jawaban), done/error."""
+    data = request.get_json() or {}
+    question = data.get('question')
+    kategori = category_param(data.get('kategori'))
+    if not question or not kategori:
+        return jsonify({'ok': False, 'error': 'Pertanyaan dan kategori wajib diisi'}), 400
+    events = stream_llm_with_faiss(
+        question, kategori,
+        user_id=data.get('user_id', 'default'),
+        thread_id=data.get('thread_id', 'default'),
+        top_k=data.get('top_k', 5),
+        security_api_key=data.get('security_api_key') or data.get('security_key'),
+        regional=data.get('regional'),
+        use_cache=not data.get('bypass_cache'))
+    def event_stream():
+        for event, payload in events:
+            yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    # X-Accel-Buffering: supaya nginx meneruskan tiap event tanpa menunggu buffer penuh
+    return Response(stream_with_context(event_stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/answer/stream', methods=['OPTIONS'])
+def answer_stream_options():
+    return Response(status=204)
+
+@bp.route('/answer/batch', methods=['POST'])
+def answer_batch():
+    """Banyak pertanyaan lepas sekaligus (evaluasi regresi), dikirim sebagai NDJSON.
+
+    Satu baris JSON per pertanyaan saat jawabannya selesai ({"type": "result", "index", ...}),
+    lalu satu baris {"type": "summary", ...} dengan timing total. Tanpa memory thread.
+    """
+    data = request.get_json() or {}
+    questions = data.get('questions')
+    kategori = category_param(data.get('kategori'))
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions) or not kategori:
+        return jsonify({'ok': False, 'error': 'questions (list pertanyaan) dan kategori wajib diisi'}), 400
+    if len(questions) > LLM_BATCH_MAX_QUESTIONS:
+        return jsonify({'ok': False, 'error': f'Maksimal {LLM_BATCH_MAX_QUESTIONS} pertanyaan per batch'}), 413
+    records = batch_answer_with_faiss(
+        questions, kategori,
+        user_id=data.get('user_id', 'default'),
+        top_k=data.get('top_k', 5),
+        regional=data.get('regional'),
+        use_cache=not data.get('bypass_cache'),
+        concurrency=data.get('concurrency'))
+    def ndjson():
+        for record in records:
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+    return Response(stream_with_context(ndjson()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/answer/batch', methods=['OPTIONS'])
+def answer_batch_options():
+    return Response(status=204)
 
 # Endpoint hapus file dan reindex
 @bp.route('/delete', methods=['POST'])
@@ -480,35 +552,18 @@ def delete_file():
     try:
         os.remove(file_path)
         print(f"[DELETE] File dihapus: {file_path}", file=sys.stderr)
-        # Update metadata dan reindex (tanpa re-embedding, hanya filter & reconstruct)
-        vector_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../vector'))
-        index_file = os.path.join(vector_dir, f'index_{kategori}.faiss')
-        meta_file = os.path.join(vector_dir, f'meta_{kategori}.pkl')
-        if not os.path.exists(index_file) or not os.path.exists(meta_file):
+        # Hapus vector source ini dari index (remove_ids) dan tandai metadatanya (tombstone), tanpa re-embedding
+        index_file, meta_file = get_index_and_meta_file(kategori)
+        if read_snapshot(index_file, meta_file) is None:
             print('[DELETE] Index atau metadata tidak ditemukan', file=sys.stderr)
             return jsonify({'ok': True, 'message': 'File dihapus, index/metadata tidak ditemukan'}), 200
-        with open(meta_file, 'rb') as f:
-            metadatas = pickle.load(f)
         if faiss is None:
             return jsonify({'ok': False, 'error': 'FAISS tidak tersedia di server'}), 500
-        index = faiss.read_index(index_file)
-        keep_indices = [i for i, m in enumerate(metadatas) if m.get('source') != filename]
-        if not keep_indices:
-            # Jika semua data dihapus, buat index kosong
-            index = faiss.IndexFlatL2(1)
-            faiss.write_index(index, index_file)
-            with open(meta_file, 'wb') as f:
-                pickle.dump([], f)
+        # Baris tombstone dibuang oleh compaction di background (FAISS_COMPACT_RATIO)
+        removed, remaining = delete_source(filename, index_file, meta_file)
+        if not remaining:
             print('[DELETE] Index kosong disimpan', file=sys.stderr)
             return jsonify({'ok': True, 'message': 'File dihapus, index dikosongkan'}), 200
-        dim = index.d
-        vectors = [index.reconstruct(i) for i in keep_indices]
-        new_index = faiss.IndexFlatL2(dim)
-        new_index.add(np.array(vectors).astype('float32'))
-        faiss.write_index(new_index, index_file)
-        new_metadatas = [metadatas[i] for i in keep_indices]
-        with open(meta_file, 'wb') as f:
-            pickle.dump(new_metadatas, f)
         print(f'[DELETE] Index dan metadata untuk {filename} dihapus', file=sys.stderr)
         return jsonify({'ok': True, 'message': f'File dihapus dan index diupdate (tanpa re-embedding)'}), 200
     except Exception as e:
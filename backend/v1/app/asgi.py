@@ -0,0 +1,120 @@
+"""ASGI entry point: POST /answer is served by the async path, everything else by the Flask app.
+
+    uvicorn asgi:app --host 127.0.0.1 --port 5001 --workers 2
+
+/answer waits on OpenAI without holding a thread (services.llm_async, one
+pooled keep-alive/HTTP/2 client per worker). Other routes run the unchanged
+Flask app through a2wsgi's WSGIMiddleware on a bounded thread pool
+(ASGI_WSGI_THREADS); long-lived streams such as /progress-stream each hold
+one of those threads, like a gthread worker would. There are no websocket
+routes: websocket connections are refused. main:app under gunicorn keeps
+working as before.
+
+Needs the packages in requirements-asgi.txt.
+"""
+import os
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+from main import app as flask_app, cors_headers
+from services import llm_async, llm_service
+
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '64'))
+wsgi = WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)
+
+
+async def _read_body(receive):
+    body = SpooledTemporaryFile(max_size=1024 * 1024)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin1')
+    return None
+
+
+# --- /answer (async) ---
+
+async def _send_json(send, status, payload, origin):
+    data = (flask_app.json.dumps(payload) + '\n').encode('utf-8')
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]
+    headers += [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in cors_headers(origin).items()]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': data})
+
+async def answer(scope, receive, send):
+    """Sama dengan route /answer di api/index.py, memakai ask_llm_with_faiss_async."""
+    origin = _header(scope, b'origin')
+    with await _read_body(receive) as body:
+        raw = body.read()
+    try:
+        data = flask_app.json.loads(raw) if raw else None
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return await _send_json(send, 400, {'ok': False, 'error': 'Body harus JSON'}, origin)
+    question = data.get('question')
+    kategori = llm_service.category_param(data.get('kategori'))
+    if not question or not kategori:
+        return await _send_json(send, 400, {'ok': False, 'error': 'Pertanyaan dan kategori wajib diisi'}, origin)
+    result = await llm_async.ask_llm_with_faiss_async(
+        question, kategori,
+        user_id=data.get('user_id', 'default'),
+        thread_id=data.get('thread_id', 'default'),
+        top_k=data.get('top_k', 5),
+        security_api_key=data.get('security_api_key') or data.get('security_key'),
+        regional=data.get('regional'),
+        use_cache=not data.get('bypass_cache'))
+    if not result:
+        return await _send_json(send, 500, {'ok': False, 'error': 'Internal error: no result from LLM'}, origin)
+    if result.get('error'):
+        payload = {'ok': False, 'error': result.get('error')}
+    else:
+        payload = {
+            'ok': True,
+            'answer': result.get('llm_answer'),
+            'results': result.get('results'),
+            'error': result.get('error'),
+            'prompt': result.get('prompt'),
+            'cached': result.get('cached', False)
+        }
+    # debug=1 di body atau query string: timing per tahap, sama seperti /answer di Flask
+    query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+    if str(data.get('debug') or query.get('debug', [''])[0]).lower() in ('1', 'true', 'yes'):
+        payload['debug'] = result.get('trace')
+    await _send_json(send, 200, payload, origin)
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await llm_async.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+    if scope['type'] == 'websocket':
+        # Tidak ada route websocket: close sebelum accept = handshake ditolak (403)
+        await receive()  # websocket.connect
+        return await send({'type': 'websocket.close', 'code': 1000})
+    if scope['type'] != 'http':
+        raise ValueError(f"Scope ASGI tidak didukung: {scope['type']}")
+    if scope['method'] == 'POST' and scope['path'] == '/answer':
+        return await answer(scope, receive, send)
+    await wsgi(scope, receive, send)
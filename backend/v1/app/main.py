@@ -13,34 +13,39 @@ except Exception:
     # If loading fails, continue; missing keys will be reported by services
     pass
 
+# Local frontend origins (juga dipakai asgi.py untuk route async)
+ALLOWED_ORIGINS = {
+    "http://localhost:5002", "http://127.0.0.1:5002",
+    "http://localhost:8000", "http://127.0.0.1:8000",
+    "http://localhost:8001", "http://127.0.0.1:8001"
+}
+
+def cors_headers(origin):
+    """Header CORS untuk origin yang diizinkan (kosong jika tidak)."""
+    if origin not in ALLOWED_ORIGINS:
+        return {}
+    return {
+        "Access-Control-Allow-Origin": origin,
+        "Vary": "Origin",
+        "Access-Control-Allow-Credentials": "true",
+        "Access-Control-Allow-Headers": "Content-Type, Authorization",
+        "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    }
+
 def create_app():
     app = Flask(__name__)
     # Allow local frontend origins during dev
     CORS(
         app,
-        resources={r"/*": {"origins": [
-            "http://localhost:5002", "http://127.0.0.1:5002",
-            "http://localhost:8000", "http://127.0.0.1:8000",
-            "http://localhost:8001", "http://127.0.0.1:8001"
-        ]}},
+        resources={r"/*": {"origins": sorted(ALLOWED_ORIGINS)}},
         supports_credentials=True,
         allow_headers=["Content-Type", "Authorization"],
     )
 
     @app.after_request
     def add_cors_headers(response):
-        allowed = {
-            "http://localhost:5002", "http://127.0.0.1:5002",
-            "http://localhost:8000", "http://127.0.0.1:8000",
-            "http://localhost:8001", "http://127.0.0.1:8001"
-        }
-        origin = request.headers.get("Origin")
-        if origin in allowed:
-            response.headers["Access-Control-Allow-Origin"] = origin
-            response.headers["Vary"] = "Origin"
-            response.headers["Access-Control-Allow-Credentials"] = "true"
-            response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
-            response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        for name, value in cors_headers(request.headers.get("Origin")).items():
+            response.headers[name] = value
         return response
 
     app.register_blueprint(index.bp)
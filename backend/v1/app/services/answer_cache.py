@@ -0,0 +1,118 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Semantic cache for /answer: a (rephrased) question whose embedding is within
+# ANSWER_CACHE_THRESHOLD cosine similarity of an earlier question with the same
+# scope() reuses that answer instead of searching and calling GPT-4. The scope
+# holds everything that changes the prompt (kategori, regional, top_k, hybrid
+# search on/off) and the numbers in the question: questions that differ only
+# by pasal or regulation number embed almost identically but need another answer.
+# Entries expire after ANSWER_CACHE_TTL seconds, and as soon as the kategori's
+# index version changes (upload/delete), and the cache holds at most
+# ANSWER_CACHE_MAX entries across all kategori (least recently used dropped first).
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE', '1') == '1'
+ANSWER_CACHE_MAX = int(os.getenv('ANSWER_CACHE_MAX', '512'))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '3600'))
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.98'))
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key: entry id, value: entry dict (LRU order across all scopes)
+_scopes = {}              # key: scope(), value: {entry id: unit vector}
+_next_id = 0
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0, 'bypassed': 0}
+
+
+_NUMBER = re.compile(r'\d+(?:[./-]\d+)*')
+
+def scope(category, regional, question, top_k, hybrid):
+    """Cache key of a question; only entries with the same scope are compared by similarity."""
+    if isinstance(category, (list, tuple)):
+        # Search lintas kategori: urutan kategori tidak mengubah hasilnya
+        category = ','.join(sorted(str(c) for c in category))
+    numbers = tuple(sorted(set(_NUMBER.findall(question or ''))))
+    return (str(category), str(regional or '').strip().lower(), int(top_k), bool(hybrid), numbers)
+
+def _unit(vector):
+    v = np.asarray(vector, dtype='float32')
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+def _drop(entry_id):
+    entry = _entries.pop(entry_id, None)
+    if entry is not None:
+        scope = _scopes.get(entry['scope'])
+        if scope is not None:
+            scope.pop(entry_id, None)
+            if not scope:
+                _scopes.pop(entry['scope'], None)
+
+def lookup(key, vector, version):
+    """Return the cached payload for the closest earlier question with scope key, or None.
+
+    version is the kategori's current index version; entries stored under
+    another version are treated as stale and removed.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    q = _unit(vector)
+    now = time.time()
+    with _lock:
+        entries = _scopes.get(key) or {}
+        for entry_id in list(entries):
+            entry = _entries[entry_id]
+            if entry['version'] != version or now - entry['created'] > ANSWER_CACHE_TTL:
+                _drop(entry_id)
+                _stats['expired'] += 1
+        entries = _scopes.get(key) or {}
+        if entries:
+            ids = list(entries)
+            sims = np.stack([entries[i] for i in ids]) @ q
+            best = int(np.argmax(sims))
+            if sims[best] >= ANSWER_CACHE_THRESHOLD:
+                entry_id = ids[best]
+                _entries.move_to_end(entry_id)
+                _stats['hits'] += 1
+                return dict(_entries[entry_id]['payload'], similarity=float(sims[best]))
+        _stats['misses'] += 1
+    return None
+
+def store(key, vector, version, payload):
+    """Remember payload (answer, results, prompt) for this question embedding under scope key."""
+    global _next_id
+    if not ANSWER_CACHE_ENABLED:
+        return
+    with _lock:
+        entry_id = _next_id
+        _next_id += 1
+        _entries[entry_id] = {'scope': key, 'version': version, 'created': time.time(), 'payload': payload}
+        _scopes.setdefault(key, {})[entry_id] = _unit(vector)
+        _stats['stores'] += 1
+        while len(_entries) > max(ANSWER_CACHE_MAX, 1):
+            _drop(next(iter(_entries)))
+            _stats['evictions'] += 1
+
+def record_bypass():
+    with _lock:
+        _stats['bypassed'] += 1
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _scopes.clear()
+
+def stats():
+    """Hit/miss counters and current size."""
+    with _lock:
+        out = dict(_stats)
+        out['size'] = len(_entries)
+    lookups = out['hits'] + out['misses']
+    out['hit_rate'] = round(out['hits'] / lookups, 4) if lookups else 0.0
+    out['enabled'] = ANSWER_CACHE_ENABLED
+    out['max_entries'] = ANSWER_CACHE_MAX
+    out['threshold'] = ANSWER_CACHE_THRESHOLD
+    return out
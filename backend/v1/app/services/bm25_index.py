@@ -0,0 +1,316 @@
+"""BM25 inverted index per kategori, for hybrid (keyword + vector) retrieval.
+
+Dense embeddings retrieve article numbers, regulation codes and names
+poorly; BM25 over the chunk text catches them. The index is a list of
+immutable segments next to the FAISS index:
+
+    bm25_<kategori>.<n>.terms.json    sorted vocabulary of the segment
+    bm25_<kategori>.<n>.<array>.npy   offsets, docs, tfs, ids, doc_len
+
+Postings of term t are docs[offsets[t]:offsets[t+1]] (segment-local doc
+numbers, delta-encoded: first value absolute, then gaps, in the smallest
+unsigned dtype that fits) with the matching term frequencies in tfs. ids
+maps a local doc number to the row id (meta_store id column). Arrays are
+memory-mapped, so a query only touches the postings of its own terms.
+
+Every upload adds one segment (faiss_service.create_or_update_index, in the
+same snapshot as the vectors); when there are more than BM25_MAX_SEGMENTS
+the two smallest are merged. The segment list lives in the metadata header
+under 'bm25'. Deleted rows stay in the postings until a merge or compaction
+drops them; searches skip them through the `allowed` mask.
+
+Build the index of a kategori written before BM25 existed with:
+
+    python -m services.bm25_index <kategori> [...]
+"""
+import os
+import re
+import sys
+import json
+import glob
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+BM25_K1 = float(os.getenv('BM25_K1', '1.2'))
+BM25_B = float(os.getenv('BM25_B', '0.75'))
+BM25_MAX_SEGMENTS = int(os.getenv('BM25_MAX_SEGMENTS', '8'))
+BM25_SEGMENT_CACHE = int(os.getenv('BM25_SEGMENT_CACHE', '64'))
+
+# Kata + kode: "12/2023", "pp-45", "no.5" tetap satu token (bagian-bagiannya juga diindeks)
+_TOKEN_RE = re.compile(r'[^\W_]+(?:[./-][^\W_]+)*')
+_PART_RE = re.compile(r'[./-]')
+STOPWORDS = frozenset('''
+    yang dan di ke dari ini itu untuk dengan pada adalah dalam tidak akan atau juga ada oleh sebagai
+    karena bahwa saat bisa dapat sudah telah para agar serta tersebut hal secara antara kami kita
+    mereka ia dia anda saya kepada maka jika kalau namun tetapi hanya lebih sangat masih harus
+    apa siapa bagaimana mengapa kapan dimana berapa the of and to in for on is are
+'''.split())
+ARRAYS = ('offsets', 'docs', 'tfs', 'ids', 'doc_len')
+
+_segments = OrderedDict()  # key: segment path prefix, value: loaded segment
+_segments_lock = threading.Lock()
+
+
+def tokenize(text):
+    """Lowercase terms of text without stopwords; codes like 12/2023 also yield their parts."""
+    tokens = []
+    for token in _TOKEN_RE.findall(str(text or '').lower()):
+        if _PART_RE.search(token):
+            tokens.extend(p for p in _PART_RE.split(token) if p and p not in STOPWORDS)
+        if token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+# --- Writing segments ---
+
+def _write_segment(prefix, terms, term_idx, doc_idx, tfs, ids, doc_len):
+    """Write postings given as parallel (term index into terms, local doc, tf) arrays."""
+    order = np.lexsort((doc_idx, term_idx))
+    term_idx, doc_idx, tfs = term_idx[order], doc_idx[order], tfs[order]
+    offsets = np.zeros(len(terms) + 1, dtype='int64')
+    offsets[1:] = np.cumsum(np.bincount(term_idx, minlength=len(terms)))
+    deltas = doc_idx.astype('int64')
+    deltas[1:] -= doc_idx[:-1]
+    starts = offsets[:-1][offsets[:-1] < offsets[1:]]
+    deltas[starts] = doc_idx[starts]
+    arrays = {
+        'offsets': offsets,
+        'docs': deltas.astype(np.min_scalar_type(int(deltas.max()) if len(deltas) else 0)),
+        'tfs': tfs.astype(np.min_scalar_type(int(tfs.max()) if len(tfs) else 0)),
+        'ids': np.asarray(ids, dtype='int64'),
+        'doc_len': np.asarray(doc_len, dtype='uint32'),
+    }
+    for name, arr in arrays.items():
+        with open(f'{prefix}.{name}.npy', 'wb') as f:
+            np.save(f, arr)
+    with open(f'{prefix}.terms.json', 'w', encoding='utf-8') as f:
+        json.dump(list(terms), f, ensure_ascii=False)
+    return {'name': os.path.basename(prefix), 'n_docs': int(len(ids)), 'total_len': int(np.sum(doc_len, dtype='int64'))}
+
+def write_segment(prefix, ids, texts):
+    """Tokenize texts (row ids ids) into a new segment at prefix; returns its info dict."""
+    vocab = {}
+    term_idx, doc_idx, tfs, doc_len = [], [], [], []
+    for i, text in enumerate(texts):
+        tokens = tokenize(text)
+        doc_len.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            term_idx.append(vocab.setdefault(term, len(vocab)))
+            doc_idx.append(i)
+            tfs.append(tf)
+    terms = sorted(vocab)
+    rank = np.zeros(len(vocab), dtype='int64')
+    rank[[vocab[t] for t in terms]] = np.arange(len(terms))
+    return _write_segment(prefix, terms, rank[np.asarray(term_idx, dtype='int64')],
+                          np.asarray(doc_idx, dtype='int64'), np.asarray(tfs, dtype='int64'), ids, doc_len)
+
+def _expand(seg):
+    """(term index, local doc, tf) arrays of every posting in a loaded segment."""
+    offsets = np.asarray(seg['offsets'])
+    lengths = np.diff(offsets)
+    cs = np.cumsum(np.asarray(seg['docs'], dtype='int64'))
+    starts = offsets[:-1]
+    # Setiap list dimulai dengan nilai absolut: kurangi jumlah kumulatif sebelum list itu
+    base = np.where(starts > 0, cs[np.maximum(starts - 1, 0)], 0) if len(cs) else np.zeros(len(starts), dtype='int64')
+    docs = cs - np.repeat(base, lengths)
+    return np.repeat(np.arange(len(lengths)), lengths), docs, np.asarray(seg['tfs'], dtype='int64')
+
+def merge_segments(directory, prefix, names, keep_id=None):
+    """Merge segments into a new one at prefix, dropping rows whose id fails keep_id(ids) (bool mask)."""
+    segs = [open_segment(directory, name) for name in names]
+    terms = sorted(set().union(*(seg['terms'] for seg in segs)))
+    lookup = {t: i for i, t in enumerate(terms)}
+    parts, ids, doc_len, doc_base = [], [], [], 0
+    for seg in segs:
+        t, d, tf = _expand(seg)
+        remap = np.fromiter((lookup[x] for x in seg['terms']), dtype='int64', count=len(seg['terms']))
+        parts.append((remap[t], d + doc_base, tf))
+        ids.append(np.asarray(seg['ids']))
+        doc_len.append(np.asarray(seg['doc_len']))
+        doc_base += seg['n_docs']
+    ids = np.concatenate(ids) if ids else np.zeros(0, dtype='int64')
+    doc_len = np.concatenate(doc_len) if doc_len else np.zeros(0, dtype='uint32')
+    term_idx, doc_idx, tfs = (np.concatenate([p[i] for p in parts]) if parts else np.zeros(0, dtype='int64') for i in range(3))
+    keep = keep_id(ids) if keep_id is not None else np.ones(len(ids), dtype=bool)
+    if not keep.all():
+        new_doc = np.cumsum(keep) - 1
+        live = keep[doc_idx]
+        term_idx, doc_idx, tfs = term_idx[live], new_doc[doc_idx[live]], tfs[live]
+        ids, doc_len = ids[keep], doc_len[keep]
+        # Term yang tidak lagi punya posting dibuang dari vocabulary
+        used = np.unique(term_idx)
+        terms = [terms[i] for i in used]
+        term_idx = np.searchsorted(used, term_idx)
+    return _write_segment(prefix, terms, term_idx, doc_idx, tfs, ids, doc_len)
+
+def _segment_prefix(directory, base, n):
+    return os.path.join(directory, f'{base}.{n}')
+
+def add_segment(directory, base, bm25, ids, texts, keep_id=None):
+    """Return the new bm25 header entry after adding a segment for (ids, texts).
+
+    bm25 is the current entry ({'segments', 'next_seg'}, or None). When the
+    segment count passes BM25_MAX_SEGMENTS the two smallest are merged.
+    """
+    bm25 = json.loads(json.dumps(bm25)) if bm25 else {'segments': [], 'next_seg': 0}
+    if len(ids):
+        bm25['segments'].append(write_segment(_segment_prefix(directory, base, bm25['next_seg']), ids, texts))
+        bm25['next_seg'] += 1
+    while len(bm25['segments']) > max(BM25_MAX_SEGMENTS, 1):
+        small = sorted(bm25['segments'], key=lambda s: s['n_docs'])[:2]
+        merged = merge_segments(directory, _segment_prefix(directory, base, bm25['next_seg']),
+                                [s['name'] for s in small], keep_id)
+        bm25['next_seg'] += 1
+        bm25['segments'] = [s for s in bm25['segments'] if s not in small] + [merged]
+    return bm25
+
+def compact(directory, base, bm25, keep_id):
+    """Merge every segment into one holding only rows that pass keep_id; returns the new entry."""
+    bm25 = json.loads(json.dumps(bm25)) if bm25 else {'segments': [], 'next_seg': 0}
+    if bm25['segments']:
+        merged = merge_segments(directory, _segment_prefix(directory, base, bm25['next_seg']),
+                                [s['name'] for s in bm25['segments']], keep_id)
+        bm25['next_seg'] += 1
+        bm25['segments'] = [merged] if merged['n_docs'] else []
+    return bm25
+
+def remove_unreferenced(directory, base, keep_names):
+    """Delete segment files of base that no header in keep_names refers to."""
+    for path in glob.glob(os.path.join(glob.escape(directory), f'{glob.escape(base)}.*.*')):
+        name = os.path.basename(path)
+        n = name[len(base) + 1:].split('.', 1)[0]
+        if n.isdigit() and f'{base}.{n}' not in keep_names:
+            with _segments_lock:
+                _segments.pop(os.path.join(directory, f'{base}.{n}'), None)
+            try:
+                os.remove(path)
+            except OSError:
+                # Windows: segment masih di-mmap oleh pembaca; dibersihkan pada tulis berikutnya
+                pass
+
+
+# --- Searching ---
+
+def open_segment(directory, name):
+    """Load (memory-mapped) a segment; segments are immutable, so they are cached by name."""
+    prefix = os.path.join(directory, name)
+    with _segments_lock:
+        seg = _segments.get(prefix)
+        if seg is not None:
+            _segments.move_to_end(prefix)
+            return seg
+    seg = {name: np.load(f'{prefix}.{name}.npy', mmap_mode='r') for name in ARRAYS}
+    with open(f'{prefix}.terms.json', 'r', encoding='utf-8') as f:
+        seg['terms'] = json.load(f)
+    seg['lookup'] = {t: i for i, t in enumerate(seg['terms'])}
+    seg['n_docs'] = len(seg['ids'])
+    with _segments_lock:
+        _segments[prefix] = seg
+        while len(_segments) > max(BM25_SEGMENT_CACHE, 1):
+            _segments.popitem(last=False)
+    return seg
+
+def _norms(seg, avgdl):
+    """k1 * (1 - b + b * doc_len / avgdl) per local doc, cached on the segment until avgdl changes."""
+    cached = seg.get('norms')
+    if cached is None or cached[0] != avgdl:
+        doc_len = np.asarray(seg['doc_len'], dtype='float32')
+        cached = seg['norms'] = (avgdl, BM25_K1 * (1 - BM25_B + BM25_B * doc_len / np.float32(avgdl)))
+    return cached[1]
+
+def _candidates(scores, touched):
+    """Sorted local docs holding at least one of the scored terms."""
+    if len(touched) == 1:
+        return touched[0]
+    if sum(len(d) for d in touched) * 16 < len(scores):
+        return np.unique(np.concatenate(touched))
+    # Skor BM25 selalu > 0 untuk doc yang memuat term query
+    return np.flatnonzero(scores)
+
+def _allowed_docs(seg, docs, allowed):
+    if allowed is None:
+        return docs
+    ids = np.asarray(seg['ids'][docs])
+    ok = ids < len(allowed)
+    ok[ok] = allowed[ids[ok]]
+    return docs[ok]
+
+def search(directory, bm25, query, n, allowed=None):
+    """Top n (ids, scores) for query over the segments of a bm25 header entry.
+
+    allowed is an optional boolean array indexed by row id (False: skip the
+    row, e.g. deleted or outside the regional filter).
+    """
+    segments = [open_segment(directory, s['name']) for s in (bm25 or {}).get('segments', [])]
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not segments or not terms or n <= 0:
+        return np.zeros(0, dtype='int64'), np.zeros(0, dtype='float32')
+    n_docs = sum(s['n_docs'] for s in (bm25 or {})['segments'])
+    avgdl = max(sum(s['total_len'] for s in bm25['segments']) / max(n_docs, 1), 1.0)
+    postings = []
+    df = Counter()
+    for seg in segments:
+        found = [(t, seg['lookup'][t]) for t in terms if t in seg['lookup']]
+        postings.append(found)
+        for t, tid in found:
+            df[t] += int(seg['offsets'][tid + 1] - seg['offsets'][tid])
+    idf = {t: np.log(1 + (n_docs - df[t] + 0.5) / (df[t] + 0.5)) for t in df}
+    top_ids, top_scores = [], []
+    for seg, found in zip(segments, postings):
+        if not found:
+            continue
+        scores = np.zeros(seg['n_docs'], dtype='float32')
+        norms = _norms(seg, avgdl)
+        # MaxScore: term langka dulu. Kontribusi satu term < idf * (k1 + 1); begitu sisa batas
+        # term umum tidak bisa lagi mengangkat doc baru ke top n, term itu hanya menilai kandidat.
+        found.sort(key=lambda f: int(seg['offsets'][f[1] + 1] - seg['offsets'][f[1]]))
+        rest = sum(idf[t] for t, _ in found) * (BM25_K1 + 1)
+        touched, cand = [], None
+        for t, tid in found:
+            rest -= idf[t] * (BM25_K1 + 1)
+            a, b = int(seg['offsets'][tid]), int(seg['offsets'][tid + 1])
+            docs = np.cumsum(seg['docs'][a:b], dtype='int64')
+            tfs = seg['tfs'][a:b]
+            if cand is not None:
+                pos = np.minimum(np.searchsorted(docs, cand), len(docs) - 1)
+                hit = docs[pos] == cand
+                docs, tfs = cand[hit], tfs[pos[hit]]
+            tf = np.asarray(tfs, dtype='float32')
+            # Satu term tidak punya doc ganda dalam postings-nya, jadi += aman tanpa np.add.at
+            scores[docs] += idf[t] * tf * (BM25_K1 + 1) / (tf + norms[docs])
+            if cand is not None:
+                continue
+            touched.append(docs)
+            if rest > 0:
+                live = _allowed_docs(seg, _candidates(scores, touched), allowed)
+                if len(live) > n:
+                    theta = np.partition(scores[live], len(live) - n)[len(live) - n]
+                    if rest < theta:
+                        cand = live[scores[live] + rest >= theta]
+        if cand is None:
+            cand = _allowed_docs(seg, _candidates(scores, touched), allowed)
+        ids = np.asarray(seg['ids'][cand])
+        sc = scores[cand]
+        if len(sc) > n:
+            pick = np.argpartition(-sc, n - 1)[:n]
+            ids, sc = ids[pick], sc[pick]
+        top_ids.append(ids)
+        top_scores.append(sc)
+    if not top_ids:
+        return np.zeros(0, dtype='int64'), np.zeros(0, dtype='float32')
+    ids, sc = np.concatenate(top_ids), np.concatenate(top_scores)
+    order = np.argsort(-sc, kind='stable')[:n]
+    return ids[order], sc[order]
+
+def stats():
+    with _segments_lock:
+        return {'segments_cached': len(_segments)}
+
+
+if __name__ == '__main__':
+    from services import faiss_service
+    for kategori in sys.argv[1:]:
+        print(f"{kategori}: {faiss_service.build_bm25(kategori)} baris diindeks")
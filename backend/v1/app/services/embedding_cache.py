@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Exact-match embedding cache shared by the ingest (/upload) and query (/answer)
+# paths. Keys are sha256(model + text); values are float32 vectors. Lookups go
+# to an in-process LRU first and then to an SQLite file under backend/v1/vector,
+# which every gunicorn worker shares and which survives restarts. The SQLite
+# tier keeps at most EMBED_CACHE_DISK_MAX rows: every row records when it was
+# last stored or read from disk, and the least recently used rows are pruned
+# (down to EMBED_CACHE_PRUNE_TO of the cap) once it is exceeded.
+V1_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+EMBED_CACHE_ENABLED = os.getenv('EMBED_CACHE', '1') == '1'
+EMBED_CACHE_MEMORY_MAX = int(os.getenv('EMBED_CACHE_MEMORY_MAX', '20000'))
+EMBED_CACHE_DISK_MAX = int(os.getenv('EMBED_CACHE_DISK_MAX', '500000'))
+EMBED_CACHE_PRUNE_TO = float(os.getenv('EMBED_CACHE_PRUNE_TO', '0.9'))
+# Jumlah baris dihitung ulang (COUNT) paling cepat setiap sekian store
+EMBED_CACHE_PRUNE_INTERVAL = int(os.getenv('EMBED_CACHE_PRUNE_INTERVAL', '1000'))
+EMBED_CACHE_DB = os.getenv('EMBED_CACHE_DB') or os.path.join(
+    os.getenv('RAG_VECTOR_DIR') or os.path.join(V1_DIR, 'vector'), 'embedding_cache.sqlite')
+_SQL_BATCH = 500
+
+_memory = OrderedDict()  # key: sha256 digest, value: float32 vector
+_memory_lock = threading.Lock()
+_local = threading.local()
+_prune = {'pid': None, 'pending': 0}
+_stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'disk_errors': 0, 'pruned': 0}
+
+
+def cache_key(text, model):
+    return hashlib.sha256(f"{model}\0{text}".encode('utf-8')).digest()
+
+def _db():
+    # Per thread dan per proses: koneksi SQLite tidak boleh dipakai lagi di worker hasil fork
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        os.makedirs(os.path.dirname(EMBED_CACHE_DB), exist_ok=True)
+        conn = sqlite3.connect(EMBED_CACHE_DB, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS embeddings ('
+                     'key BLOB PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, vec BLOB NOT NULL,'
+                     ' used INTEGER NOT NULL DEFAULT 0'
+                     ') WITHOUT ROWID')
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(embeddings)')}
+        if 'used' not in columns:
+            # Cache dari versi sebelum pruning: baris lama dianggap paling lama tidak dipakai
+            with conn:
+                conn.execute('ALTER TABLE embeddings ADD COLUMN used INTEGER NOT NULL DEFAULT 0')
+        conn.execute('CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)')
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+def _prune_disk(conn, stored):
+    """Drop least recently used rows once the table is over EMBED_CACHE_DISK_MAX."""
+    with _memory_lock:
+        if _prune['pid'] != os.getpid():
+            # Proses baru (atau fork): hitung jumlah baris pada store pertama
+            _prune.update(pid=os.getpid(), pending=EMBED_CACHE_PRUNE_INTERVAL)
+        _prune['pending'] += stored
+        if EMBED_CACHE_DISK_MAX <= 0 or _prune['pending'] < EMBED_CACHE_PRUNE_INTERVAL:
+            return
+        _prune['pending'] = 0
+    rows = conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+    if rows <= EMBED_CACHE_DISK_MAX:
+        return
+    excess = rows - int(EMBED_CACHE_DISK_MAX * min(max(EMBED_CACHE_PRUNE_TO, 0.0), 1.0))
+    with conn:
+        conn.execute('DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used LIMIT ?)', (excess,))
+    with _memory_lock:
+        _stats['pruned'] += excess
+    print(f"[EMBED_CACHE] {excess} embedding lama dihapus dari cache disk ({rows} > {EMBED_CACHE_DISK_MAX})", file=sys.stderr)
+
+def _remember(key, vec):
+    # Caller holds _memory_lock
+    _memory[key] = vec
+    _memory.move_to_end(key)
+    while len(_memory) > max(EMBED_CACHE_MEMORY_MAX, 1):
+        _memory.popitem(last=False)
+
+def get_many(texts, model):
+    """Return a list aligned with texts: a float32 vector for cached texts, None otherwise."""
+    if not EMBED_CACHE_ENABLED:
+        return [None] * len(texts)
+    keys = [cache_key(t, model) for t in texts]
+    found = {}
+    with _memory_lock:
+        for key in keys:
+            vec = _memory.get(key)
+            if vec is not None:
+                _memory.move_to_end(key)
+                found[key] = vec
+        _stats['memory_hits'] += sum(1 for k in keys if k in found)
+    missing = list({k for k in keys if k not in found})
+    if missing:
+        try:
+            conn = _db()
+            for start in range(0, len(missing), _SQL_BATCH):
+                part = missing[start:start + _SQL_BATCH]
+                rows = conn.execute(f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part)
+                hits = []
+                for key, blob in rows:
+                    found[bytes(key)] = np.frombuffer(blob, dtype='float32')
+                    hits.append(key)
+                if hits:
+                    # Waktu pakai terakhir untuk pruning LRU (hit dari memori tidak menyentuh disk)
+                    with conn:
+                        conn.execute(f"UPDATE embeddings SET used = ? WHERE key IN ({','.join('?' * len(hits))})",
+                                     [int(time.time())] + hits)
+        except sqlite3.Error as e:
+            _stats['disk_errors'] += 1
+            print(f"[EMBED_CACHE] Gagal membaca cache: {e}", file=sys.stderr)
+        with _memory_lock:
+            for key in missing:
+                if key in found:
+                    _remember(key, found[key])
+                    _stats['disk_hits'] += 1
+    result = [found.get(k) for k in keys]
+    with _memory_lock:
+        _stats['misses'] += sum(1 for v in result if v is None)
+    return result
+
+def put_many(texts, model, vectors):
+    """Store freshly computed embeddings in both tiers."""
+    if not EMBED_CACHE_ENABLED or not texts:
+        return
+    rows = []
+    with _memory_lock:
+        for text, vector in zip(texts, vectors):
+            key = cache_key(text, model)
+            vec = np.asarray(vector, dtype='float32')
+            _remember(key, vec)
+            rows.append((key, model, int(vec.shape[0]), vec.tobytes(), int(time.time())))
+        _stats['stores'] += len(rows)
+    try:
+        conn = _db()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO embeddings (key, model, dim, vec, used) VALUES (?, ?, ?, ?, ?)', rows)
+        _prune_disk(conn, len(rows))
+    except sqlite3.Error as e:
+        _stats['disk_errors'] += 1
+        print(f"[EMBED_CACHE] Gagal menyimpan cache: {e}", file=sys.stderr)
+
+def stats():
+    with _memory_lock:
+        out = dict(_stats)
+        out['memory_entries'] = len(_memory)
+    lookups = out['memory_hits'] + out['disk_hits'] + out['misses']
+    out['hit_rate'] = round((out['memory_hits'] + out['disk_hits']) / lookups, 4) if lookups else 0.0
+    out['enabled'] = EMBED_CACHE_ENABLED
+    out['disk_max_rows'] = EMBED_CACHE_DISK_MAX
+    return out
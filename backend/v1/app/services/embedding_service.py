@@ -1,24 +1,138 @@
 import os
+import sys
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from . import embedding_cache, tracing
 
-# Fungsi untuk mendapatkan embedding dari OpenAI tanpa SDK (pakai HTTP langsung)
-def get_embedding(text, model="text-embedding-3-small"):
+# Batch ingestion settings (overridable via environment)
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '64'))
+EMBED_CONCURRENCY = int(os.getenv('EMBED_CONCURRENCY', '4'))
+EMBED_MAX_RETRIES = int(os.getenv('EMBED_MAX_RETRIES', '5'))
+EMBED_RETRY_BACKOFF = float(os.getenv('EMBED_RETRY_BACKOFF', '0.5'))
+EMBED_TIMEOUT = float(os.getenv('EMBED_TIMEOUT', '60'))
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Shared keep-alive session: one TLS handshake per pooled connection instead of per chunk
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(EMBED_CONCURRENCY, 1) * 2)
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
+
+def _embedding_request():
     # Ambil API key dari environment untuk menghindari kebocoran rahasia di repo
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY belum diset di environment.")
-
     base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com")
     headers = {
         'Authorization': f'Bearer {api_key}',
         'Content-Type': 'application/json'
     }
-    payload = {
-        'model': model,
-        'input': text
-    }
-    resp = requests.post(f'{base_url}/v1/embeddings', headers=headers, json=payload, timeout=15)
-    if resp.status_code != 200:
-        raise RuntimeError(f"OpenAI Embedding API error: {resp.text}")
-    data = resp.json()
-    return data['data'][0]['embedding']
+    return f'{base_url}/v1/embeddings', headers
+
+# Fungsi untuk mendapatkan embedding dari OpenAI tanpa SDK (pakai HTTP langsung)
+def get_embedding(text, model="text-embedding-3-small"):
+    with tracing.span('embedding') as span:
+        cached = embedding_cache.get_many([text], model)[0]
+        span['cached'] = cached is not None
+        if cached is not None:
+            return cached.tolist()
+        url, headers = _embedding_request()
+        payload = {
+            'model': model,
+            'input': text
+        }
+        resp = _session.post(url, headers=headers, json=payload, timeout=15)
+        if resp.status_code != 200:
+            raise RuntimeError(f"OpenAI Embedding API error: {resp.text}")
+        data = resp.json()
+    tracing.record_tokens('embedding', data.get('usage'))
+    embedding = data['data'][0]['embedding']
+    embedding_cache.put_many([text], model, [embedding])
+    return embedding
+
+def _retry_delay(resp, attempt):
+    retry_after = resp.headers.get('Retry-After') if resp is not None else None
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), 30.0)
+    except ValueError:
+        pass
+    return min(EMBED_RETRY_BACKOFF * (2 ** attempt), 30.0)
+
+def _embed_batch(texts, model):
+    """POST one list of inputs to /v1/embeddings, retrying 429/5xx with exponential backoff."""
+    url, headers = _embedding_request()
+    payload = {'model': model, 'input': texts}
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        resp = None
+        try:
+            resp = _session.post(url, headers=headers, json=payload, timeout=EMBED_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= EMBED_MAX_RETRIES:
+                raise RuntimeError(f"OpenAI Embedding API error: {e}")
+        else:
+            if resp.status_code == 200:
+                body = resp.json()
+                tracing.record_tokens('embedding', body.get('usage'))
+                data = sorted(body['data'], key=lambda d: d['index'])
+                if len(data) != len(texts):
+                    raise RuntimeError(f"OpenAI Embedding API error: expected {len(texts)} embeddings, got {len(data)}")
+                return [d['embedding'] for d in data]
+            if resp.status_code not in _RETRY_STATUS or attempt >= EMBED_MAX_RETRIES:
+                raise RuntimeError(f"OpenAI Embedding API error: {resp.text}")
+        delay = _retry_delay(resp, attempt)
+        print(f"[EMBEDDING] Batch gagal (status {resp.status_code if resp is not None else 'network'}), retry {attempt + 1} dalam {delay:.1f}s", file=sys.stderr)
+        time.sleep(delay)
+
+def get_embeddings(texts, model="text-embedding-3-small", batch_size=None, concurrency=None, progress_cb=None):
+    """Embed a list of texts in batches, several batches in flight at once.
+
+    Returns the embeddings in the same order as texts. Texts already in the
+    embedding cache (and repeated texts) are not sent to the API.
+    progress_cb(done, total) is called from the calling thread each time a
+    batch finishes, with the number of texts embedded so far.
+    """
+    texts = list(texts or [])
+    if not texts:
+        return []
+    with tracing.span('embedding', texts=len(texts)) as span:
+        return _get_embeddings(texts, model, batch_size, concurrency, progress_cb, span)
+
+def _get_embeddings(texts, model, batch_size, concurrency, progress_cb, span):
+    batch_size = max(int(batch_size or EMBED_BATCH_SIZE), 1)
+    concurrency = max(int(concurrency or EMBED_CONCURRENCY), 1)
+    results = [None if v is None else v.tolist() for v in embedding_cache.get_many(texts, model)]
+    # Unique texts still to embed, and every position each one fills
+    pending = {}
+    for i, (text, vec) in enumerate(zip(texts, results)):
+        if vec is None:
+            pending.setdefault(text, []).append(i)
+    todo = list(pending)
+    done = len(texts) - sum(len(v) for v in pending.values())
+    span['cached'] = done
+    if progress_cb and done:
+        progress_cb(done, len(texts))
+    if not todo:
+        return results
+    batches = [todo[start:start + batch_size] for start in range(0, len(todo), batch_size)]
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as pool:
+        futures = {pool.submit(tracing.wrap(_embed_batch), batch, model): batch for batch in batches}
+        try:
+            for fut in as_completed(futures):
+                batch = futures[fut]
+                embeddings = fut.result()
+                embedding_cache.put_many(batch, model, embeddings)
+                for text, embedding in zip(batch, embeddings):
+                    for i in pending[text]:
+                        results[i] = embedding
+                        done += 1
+                if progress_cb:
+                    progress_cb(done, len(texts))
+        except Exception:
+            for fut in futures:
+                fut.cancel()
+            raise
+    return results
@@ -63,73 +63,846 @@ def search(vector, top_k=3, category=None):
 import os
 import sys
 import json
+import time
 import pickle
 import faiss
 import numpy as np
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from . import meta_store, bm25_index, tracing
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 
 
 
 # Absolute path for backend/v1 root
 V1_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
-VECTOR_DIR = os.path.join(V1_DIR, 'vector')
-THREADS_DIR = os.path.join(V1_DIR, 'threads')
+VECTOR_DIR = os.getenv('RAG_VECTOR_DIR') or os.path.join(V1_DIR, 'vector')
+THREADS_DIR = os.getenv('RAG_THREADS_DIR') or os.path.join(V1_DIR, 'threads')
 os.makedirs(VECTOR_DIR, exist_ok=True)
 os.makedirs(THREADS_DIR, exist_ok=True)
 
 
 
 def get_index_and_meta_file(category: str = 'teknologi'):
-    """Return absolute paths for index and metadata files for a given category."""
+    """Return absolute paths for index and metadata files for a given category.
+
+    The metadata path is the columnar store header (meta_<category>.json); a
+    legacy meta_<category>.pkl is migrated to it the first time it is needed.
+    """
     index_file = os.path.join(VECTOR_DIR, f'index_{category}.faiss')
-    meta_file = os.path.join(VECTOR_DIR, f'meta_{category}.pkl')
+    meta_file = os.path.join(VECTOR_DIR, f'meta_{category}.json')
+    meta_store.ensure_migrated(meta_file, meta_write_lock)
     return index_file, meta_file
 
-def search(vector, top_k=3, category='teknologi'):
-    """Search the FAISS index for the top_k most similar vectors in the given category."""
+
+# --- Snapshots and the per-kategori writer lock ---
+# Every write (upload, delete) publishes a new snapshot: the index goes to a
+# new versioned file (index_<kategori>.<version>.faiss), the metadata columns
+# are staged without touching the live header, and then snapshot_<kategori>.json
+# -- naming that index file and holding the matching metadata header -- is
+# replaced in one rename. Readers only ever open what a snapshot names, so they
+# always get an index and metadata that belong together. Files of the previous
+# snapshot are kept until the next write, for readers that just read it.
+# Writers serialize on an flock()ed <index_file>.lock, across threads and
+# gunicorn workers alike. Version 0 is the pre-snapshot index_<kategori>.faiss.
+SNAPSHOT_FORMAT = 'rag-snapshot'
+_write_locks = {}  # key: index_file, value: threading.Lock (in-process part of the writer lock)
+_write_locks_guard = threading.Lock()
+_parsed_snapshots = {}  # key: snapshot file, value: last parsed snapshot (read-only, replaced when its stamp changes)
+
+def snapshot_file(index_file):
+    base = os.path.basename(index_file)[:-len('.faiss')]
+    name = base[len('index_'):] if base.startswith('index_') else base
+    return os.path.join(os.path.dirname(index_file), f'snapshot_{name}.json')
+
+def versioned_index_file(index_file, version):
+    return index_file if version == 0 else f"{index_file[:-len('.faiss')]}.{version}.faiss"
+
+@contextmanager
+def write_lock(index_file):
+    """Hold the exclusive writer lock of a kategori (not reentrant)."""
+    with _write_locks_guard:
+        local = _write_locks.setdefault(index_file, threading.Lock())
+    waiting = time.perf_counter()
+    with local:
+        if fcntl is None:
+            # Windows: only writers inside this process are serialized
+            tracing.record('index_lock_wait', waiting)
+            yield
+            return
+        with open(f'{index_file}.lock', 'a+') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            tracing.record('index_lock_wait', waiting)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def snapshot_stamp(index_file, meta_file):
+    """Stamp of the current snapshot from stat() alone, or None when the kategori is empty.
+
+    Equal to read_snapshot(...)['stamp'], without opening or parsing the snapshot.
+    """
+    try:
+        return _file_stamp(snapshot_file(index_file))
+    except FileNotFoundError:
+        pass
+    try:
+        return (_file_stamp(index_file), _file_stamp(meta_file))
+    except FileNotFoundError:
+        return None
+
+def meta_write_lock(meta_file):
+    """write_lock of the kategori whose metadata header is meta_file (meta_<kategori>.json)."""
+    directory, name = os.path.split(meta_file)
+    return write_lock(os.path.join(directory, f"index_{name[len('meta_'):-len('.json')]}.faiss"))
+
+def read_snapshot(index_file, meta_file):
+    """Return the current snapshot {'version', 'index', 'meta', 'stamp'}, or None when the kategori is empty.
+
+    Falls back to the pre-snapshot index_<kategori>.faiss + meta header pair
+    (version 0) for categories not written since snapshots were introduced.
+    The snapshot file is parsed again only when its stamp changed.
+    """
+    path = snapshot_file(index_file)
+    try:
+        stamp = _file_stamp(path)
+        cached = _parsed_snapshots.get(path)
+        if cached is not None and cached['stamp'] == stamp:
+            return cached
+        with open(path, 'r', encoding='utf-8') as f:
+            snap = json.load(f)
+        snap = {'version': snap['version'], 'index': os.path.join(os.path.dirname(index_file), snap['index']),
+                'meta': snap['meta'], 'stamp': stamp}
+        _parsed_snapshots[path] = snap
+        return snap
+    except FileNotFoundError:
+        pass
+    if not os.path.exists(index_file) or not meta_store.exists(meta_file):
+        return None
+    return {'version': 0, 'index': index_file, 'meta': meta_store.read_header(meta_file),
+            'stamp': (_file_stamp(index_file), _file_stamp(meta_file))}
+
+def _write_json_synced(path, obj):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"[FAISS] Gagal menghapus {path}: {e}", file=sys.stderr)
+
+def _index_file_version(index_file, path):
+    """Version number in the name of one of index_file's versioned files (0 for index_file itself)."""
+    name = os.path.basename(path)
+    prefix = os.path.basename(index_file)[:-len('.faiss')] + '.'
+    v = name[len(prefix):-len('.faiss')] if name.startswith(prefix) and name.endswith('.faiss') else ''
+    return int(v) if v.isdigit() else 0
+
+def _publish_snapshot(index_file, meta_file, index, header, previous):
+    """Write index as the next version and commit it together with header; caller holds write_lock.
+
+    index=None keeps the previous snapshot's index file (only the metadata changed).
+    """
+    version = (previous['version'] if previous else 0) + 1
+    if index is None:
+        new_index_file = previous['index']
+    else:
+        new_index_file = versioned_index_file(index_file, version)
+        write_index_atomic(index, new_index_file)
+    _replace_file(snapshot_file(index_file), lambda tmp: _write_json_synced(tmp, {
+        'format': SNAPSHOT_FORMAT,
+        'version': version,
+        'index': os.path.basename(new_index_file),
+        'meta': header,
+    }))
+    # Header file too, for readers of the metadata alone (meta_store.sources)
+    meta_store.commit(meta_file, header)
+    # Keep this snapshot's and the previous one's files; older ones are unreachable
+    keep_versions = {_index_file_version(index_file, new_index_file),
+                     _index_file_version(index_file, previous['index'] if previous else new_index_file)}
+    directory = os.path.dirname(index_file) or '.'
+    prefix = os.path.basename(index_file)[:-len('.faiss')] + '.'
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith('.faiss'):
+            v = name[len(prefix):-len('.faiss')]
+            if v.isdigit() and int(v) not in keep_versions:
+                _remove_quietly(os.path.join(directory, name))
+    if 0 not in keep_versions:
+        _remove_quietly(index_file)
+    meta_store.remove_generations(meta_file, {header['generation'], (previous or {'meta': header})['meta']['generation']})
+    keep_segments = {seg['name'] for h in (header, (previous or {'meta': header})['meta'])
+                     for seg in (h.get('bm25') or {}).get('segments', [])}
+    bm25_index.remove_unreferenced(directory, _bm25_base(index_file), keep_segments)
+    return version
+
+def _bm25_base(index_file):
+    return 'bm25_' + (_category_from_index_file(index_file) or os.path.basename(index_file)[:-len('.faiss')])
+
+def _bm25_backfill(index_file, meta_file, header):
+    """bm25 header entry holding every live row of header (for categories written before BM25)."""
+    metas = meta_store.open_meta(meta_file, header)
+    live = np.flatnonzero(meta_store.live_mask(metas))
+    ids = np.asarray(metas['columns'][meta_store.ID_COLUMN])[live]
+    texts = [row['text'] for row in meta_store.read_rows(metas, live)]
+    return bm25_index.add_segment(os.path.dirname(index_file) or '.', _bm25_base(index_file), None, ids, texts)
+
+
+# --- Process-wide index/metadata cache ---
+# Each worker keeps the most recently used categories resident so /answer does
+# not re-read the index and metadata from disk on every question. Entries are
+# keyed by the stamp of the snapshot file, so a new snapshot from any process
+# (upload, delete, another gunicorn worker) is picked up on the next lookup.
+INDEX_CACHE_MAX = int(os.getenv('FAISS_CACHE_MAX_CATEGORIES', '8'))
+# Open search indexes memory-mapped and read-only, so every gunicorn worker
+# serves the vectors from the shared page cache instead of a private copy.
+# Index files are only ever replaced via rename, never rewritten in place,
+# so an existing mapping stays valid after an upload or delete.
+FAISS_MMAP = os.getenv('FAISS_MMAP', '0' if os.name == 'nt' else '1') == '1'
+# IO_FLAG_MMAP_IFC (faiss >= 1.8) also maps Flat/HNSW vector storage; plain
+# IO_FLAG_MMAP only maps IVF inverted lists.
+MMAP_IO_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+_index_cache = OrderedDict()  # key: index_file, value: (stamp, index, meta handle, snapshot)
+_index_cache_lock = threading.Lock()
+_index_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+def read_index_for_search(index_file):
+    """Read an index for searching only (memory-mapped when FAISS_MMAP is on)."""
+    if FAISS_MMAP:
+        try:
+            return faiss.read_index(index_file, MMAP_IO_FLAGS)
+        except RuntimeError as e:
+            print(f"[FAISS] mmap tidak didukung untuk {index_file}, baca biasa: {e}", file=sys.stderr)
+    return faiss.read_index(index_file)
+
+def load_index_and_meta(index_file, meta_file):
+    """Return (index, meta handle) of the kategori's current snapshot, from the in-memory cache when fresh.
+
+    The meta handle is a memory-mapped meta_store reader; rows are decoded on
+    demand. Raises FileNotFoundError when the kategori has no index yet.
+    """
+    with tracing.span('index_load', category=_category_from_index_file(index_file)) as span:
+        index, metas, span['cached'] = _load_index_and_meta(index_file, meta_file)
+    return index, metas
+
+def _load_index_and_meta(index_file, meta_file):
+    for attempt in range(3):
+        # Hit path: one stat() of the snapshot file, no open/parse
+        stamp = snapshot_stamp(index_file, meta_file)
+        if stamp is None:
+            raise FileNotFoundError(index_file)
+        with _index_cache_lock:
+            entry = _index_cache.get(index_file)
+            if entry is not None and entry[0] == stamp:
+                _index_cache.move_to_end(index_file)
+                _index_cache_stats['hits'] += 1
+                return entry[1], entry[2], True
+            _index_cache_stats['misses'] += 1
+        snap = read_snapshot(index_file, meta_file)
+        if snap is None:
+            raise FileNotFoundError(index_file)
+        stamp = snap['stamp']
+        # Read outside the lock so a slow load does not block other categories
+        try:
+            index = read_index_for_search(snap['index'])
+            metas = meta_store.open_meta(meta_file, snap['meta'])
+            break
+        except (FileNotFoundError, RuntimeError):
+            # Two newer snapshots were published since this one was read and its files are gone
+            if attempt == 2:
+                raise
+    with _index_cache_lock:
+        _index_cache[index_file] = (stamp, index, metas, snap)
+        _index_cache.move_to_end(index_file)
+        while len(_index_cache) > max(INDEX_CACHE_MAX, 1):
+            _index_cache.popitem(last=False)
+            _index_cache_stats['evictions'] += 1
+    return index, metas, False
+
+def index_version(category):
+    """Opaque version of a kategori's index+metadata; changes with every new snapshot.
+
+    For a list of kategori (search_multi) it is the tuple of their versions.
+    """
+    if isinstance(category, (list, tuple)):
+        return tuple(index_version(c) for c in sorted(category))
     index_file, meta_file = get_index_and_meta_file(category)
     try:
-        if not os.path.exists(index_file):
-            #raise FileNotFoundError(f"Index file not found: {index_file}")
-            raise FileNotFoundError(f"Data tidak ditemukan!.")
-        if not os.path.exists(meta_file):
-            # raise FileNotFoundError(f"Meta file not found: {meta_file}")
-            raise FileNotFoundError(f"Data tidak ditemukan!.")
-        index = faiss.read_index(index_file)
-        with open(meta_file, 'rb') as f:
-            metas = pickle.load(f)
-        print(f"VECTOR DIM: {len(vector)} INDEX DIM: {index.d}", file=sys.stderr)
-        print(f"index_file: {index_file}, meta_file: {meta_file}", file=sys.stderr)
-        if len(vector) != index.d:
-            #raise ValueError(f"Dimensi vector ({len(vector)}) tidak cocok dengan index ({index.d})")
-            raise ValueError(f"Kesalahan pada data, silakan coba lagi atau hubungi admin.")
-        D, I = index.search(np.array([vector]).astype('float32'), top_k)
-        res = [metas[idx] for idx in I[0] if idx < len(metas)]
-        return res
+        return snapshot_stamp(index_file, meta_file)
+    except OSError:
+        return None
+
+def invalidate_index_cache(index_file=None):
+    """Drop the cached entry for index_file (or every entry when None)."""
+    with _index_cache_lock:
+        if index_file is None:
+            dropped = len(_index_cache)
+            _index_cache.clear()
+        else:
+            dropped = 1 if _index_cache.pop(index_file, None) is not None else 0
+        _index_cache_stats['invalidations'] += dropped
+
+def index_cache_stats():
+    """Return hit/miss counters and the categories currently resident in the cache."""
+    with _index_cache_lock:
+        stats = dict(_index_cache_stats)
+        stats['resident'] = [os.path.basename(p) for p in _index_cache]
+    stats['max_categories'] = INDEX_CACHE_MAX
+    return stats
+
+# --- Index types per kategori ---
+# vector/index_specs.json maps a kategori to its index spec, for example
+#   {"hukum": {"type": "hnsw", "m": 32, "ef_search": 128},
+#    "arsip": {"type": "ivfpq", "nlist": 1024, "pq_m": 96, "nprobe": 32}}
+# Supported types: flat, ivfflat, ivfpq, hnsw and auto. "auto" (the default)
+# keeps an exact Flat index until the kategori reaches FAISS_ANN_THRESHOLD
+# vectors and then migrates it to FAISS_AUTO_INDEX_TYPE on the next upload.
+# It only goes back to Flat once deletes bring the kategori under
+# FAISS_ANN_DOWNGRADE_RATIO x the threshold, so a kategori hovering around
+# the threshold is not rebuilt on every upload.
+INDEX_SPECS_FILE = os.path.join(VECTOR_DIR, 'index_specs.json')
+INDEX_TYPES = ('flat', 'ivfflat', 'ivfpq', 'hnsw')
+DEFAULT_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'auto')
+AUTO_INDEX_TYPE = os.getenv('FAISS_AUTO_INDEX_TYPE', 'ivfflat')
+ANN_THRESHOLD = int(os.getenv('FAISS_ANN_THRESHOLD', '100000'))
+ANN_DOWNGRADE_RATIO = float(os.getenv('FAISS_ANN_DOWNGRADE_RATIO', '0.5'))
+TRAIN_SAMPLE = int(os.getenv('FAISS_TRAIN_SAMPLE', '100000'))
+DEFAULT_NPROBE = int(os.getenv('FAISS_NPROBE', '16'))
+DEFAULT_EF_SEARCH = int(os.getenv('FAISS_EF_SEARCH', '64'))
+
+def _category_from_index_file(index_file):
+    name = os.path.basename(index_file)
+    if name.startswith('index_') and name.endswith('.faiss'):
+        return name[len('index_'):-len('.faiss')]
+    return None
+
+def get_index_spec(category):
+    """Return the configured index spec for a kategori ({'type': 'auto'} when none is set)."""
+    spec = {'type': DEFAULT_INDEX_TYPE}
+    if category and os.path.exists(INDEX_SPECS_FILE):
+        try:
+            with open(INDEX_SPECS_FILE, 'r', encoding='utf-8') as f:
+                spec.update(json.load(f).get(category) or {})
+        except Exception as e:
+            print(f"[FAISS] Gagal membaca {INDEX_SPECS_FILE}: {e}", file=sys.stderr)
+    return spec
+
+def resolve_index_spec(spec, ntotal, dim, current=None):
+    """Turn a configured spec into a concrete one for ntotal vectors of size dim.
+
+    Resolves "auto", fills in nlist/pq_m defaults and falls back to Flat when
+    there are too few vectors to train the requested quantizer. current is
+    the type of the index being updated: "auto" keeps an ANN index down to
+    ANN_DOWNGRADE_RATIO x ANN_THRESHOLD vectors instead of the threshold itself.
+    """
+    spec = dict(spec or {})
+    kind = (spec.get('type') or 'auto').lower()
+    if kind == 'auto':
+        threshold = ANN_THRESHOLD * ANN_DOWNGRADE_RATIO if current not in (None, 'flat') else ANN_THRESHOLD
+        kind = AUTO_INDEX_TYPE if ntotal >= threshold else 'flat'
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Tipe index tidak dikenal: {kind}")
+    if kind in ('ivfflat', 'ivfpq'):
+        # FAISS wants ~39 training points per centroid; 4*sqrt(n) lists is the usual starting point
+        nlist = int(spec.get('nlist') or max(1, int(4 * np.sqrt(max(ntotal, 1)))))
+        nlist = min(nlist, ntotal // 39)
+        if nlist < 1:
+            kind = 'flat'
+        else:
+            spec['nlist'] = nlist
+    if kind == 'ivfpq':
+        pq_m = int(spec.get('pq_m') or next(m for m in range(max(dim // 16, 1), 0, -1) if dim % m == 0))
+        pq_nbits = int(spec.get('pq_nbits') or 8)
+        if dim % pq_m != 0:
+            raise ValueError(f"pq_m ({pq_m}) harus membagi dimensi vector ({dim})")
+        if ntotal < 39 * (1 << pq_nbits):
+            kind = 'ivfflat'
+        else:
+            spec['pq_m'], spec['pq_nbits'] = pq_m, pq_nbits
+    spec['type'] = kind
+    return spec
+
+def _base_index(index):
+    """The index inside an IndexIDMap2 wrapper (the index itself when it has none)."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+def index_type_of(index):
+    """Return the spec type name ('flat', 'ivfflat', 'ivfpq', 'hnsw') of a loaded index."""
+    index = _base_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivfpq'
+    if isinstance(index, faiss.IndexIVFFlat):
+        return 'ivfflat'
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return 'hnsw'
+    return 'flat'
+
+def build_index(vectors, spec, ids=None):
+    """Create an index for a resolved spec, train it on vectors (sampled) and add them.
+
+    Searches return the stable row ids (meta_store id column) given in ids
+    (default 0..n-1): IVF indexes store them in their inverted lists (with a
+    hashtable direct map for reconstruct), the other types are wrapped in
+    IndexIDMap2. See with_id_map.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    dim = vectors.shape[1]
+    kind = spec['type']
+    if kind == 'ivfflat':
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, spec['nlist'])
+    elif kind == 'ivfpq':
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, spec['nlist'], spec['pq_m'], spec['pq_nbits'])
+    elif kind == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, int(spec.get('m') or 32))
+        index.hnsw.efConstruction = int(spec.get('ef_construction') or 80)
+    else:
+        index = faiss.IndexFlatL2(dim)
+    if not index.is_trained:
+        train = vectors
+        if len(vectors) > TRAIN_SAMPLE:
+            pick = np.random.default_rng(0).choice(len(vectors), TRAIN_SAMPLE, replace=False)
+            train = vectors[np.sort(pick)]
+        index.train(train)
+    if kind in ('ivfflat', 'ivfpq'):
+        index.nprobe = int(spec.get('nprobe') or DEFAULT_NPROBE)
+    if kind == 'hnsw':
+        index.hnsw.efSearch = int(spec.get('ef_search') or DEFAULT_EF_SEARCH)
+    if kind in ('ivfflat', 'ivfpq'):
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    else:
+        index = faiss.IndexIDMap2(index)
+    if len(vectors):
+        index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64') if ids is None else np.asarray(ids, dtype='int64'))
+    return index
+
+def _ivf_ids(ivf):
+    """Ids stored in an IVF's inverted lists, list by list."""
+    invlists = ivf.invlists
+    parts = []
+    for list_no in range(ivf.nlist):
+        n = invlists.list_size(list_no)
+        if n:
+            ptr = invlists.get_ids(list_no)
+            parts.append(faiss.rev_swig_ptr(ptr, n).astype('int64'))
+            invlists.release_ids(list_no, ptr)
+    return np.concatenate(parts) if parts else np.zeros(0, dtype='int64')
+
+def _native_ivf(index):
+    """index as a bare IVF holding the stable ids itself, with a hashtable direct map.
+
+    IndexIDMap2 must not wrap an IVF: the IVF does not renumber on
+    remove_ids, so the wrapper's positions go stale and searches return
+    wrong ids. An IDMap2-over-IVF written by an earlier version is unwrapped
+    by writing the mapped ids into the inverted lists; one that already had
+    ids removed cannot be recovered and raises ValueError.
+    """
+    top = faiss.downcast_index(index)
+    if isinstance(top, faiss.IndexIDMap):
+        ivf = faiss.downcast_index(top.index)
+        id_map = faiss.vector_to_array(top.id_map).astype('int64')
+        positions = _ivf_ids(ivf)
+        if len(positions) != len(id_map) or (len(positions) and positions.max() >= len(id_map)):
+            raise ValueError("Index IVF tidak sinkron dengan id-nya (delete versi lama); upload ulang dokumen kategori ini")
+        invlists = ivf.invlists
+        for list_no in range(ivf.nlist):
+            n = invlists.list_size(list_no)
+            if n:
+                ptr = invlists.get_ids(list_no)
+                ids = np.ascontiguousarray(id_map[faiss.rev_swig_ptr(ptr, n)])
+                invlists.release_ids(list_no, ptr)
+                codes = invlists.get_codes(list_no)
+                invlists.update_entries(list_no, 0, n, faiss.swig_ptr(ids), codes)
+                invlists.release_codes(list_no, codes)
+        # The IVF outlives the wrapper: Python takes over its ownership
+        top.own_fields = False
+        ivf.this.own(True)
+        ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+    elif top is not index and index.this.own():
+        # downcast_index gives a non-owning view; hand it the ownership so
+        # the IVF survives the caller dropping the generic Index handle
+        ivf = top
+        index.this.disown()
+        ivf.this.own(True)
+    else:
+        ivf = top
+    if ivf.direct_map.type != faiss.DirectMap.Hashtable:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return ivf
+
+def with_id_map(index):
+    """Return index ready for add_with_ids/remove_ids by stable id, without copying vectors.
+
+    IVF indexes hold the ids themselves (see _native_ivf); other types are
+    wrapped in IndexIDMap2. Indexes written before stable ids get ids 0..ntotal-1.
+    """
+    if faiss.try_extract_index_ivf(index) is not None:
+        return _native_ivf(index)
+    # downcast_index gives a non-owning view; keep returning/referencing the caller's object
+    if isinstance(faiss.downcast_index(index), faiss.IndexIDMap):
+        return index
+    wrapped = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+    wrapped.index = index
+    wrapped.referenced_objects = [index]
+    wrapped.ntotal = index.ntotal
+    faiss.copy_array_to_vector(np.arange(index.ntotal, dtype='int64'), wrapped.id_map)
+    wrapped.construct_rev_map()
+    return wrapped
+
+def index_ids(index):
+    """The id of every stored vector, in storage order (the order of reconstruct_all)."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map).astype('int64')
+    if isinstance(index, faiss.IndexIVF):
+        return _ivf_ids(index)
+    return np.arange(index.ntotal, dtype='int64')
+
+def reconstruct_all(index):
+    """Return every stored vector as an (ntotal, d) float32 array in storage order (lossy for IVFPQ).
+
+    Expects an index from with_id_map: IVF vectors are looked up by their
+    ids through the hashtable direct map, which works after remove_ids.
+    """
+    top = faiss.downcast_index(index)
+    if top.ntotal == 0:
+        return np.zeros((0, top.d), dtype='float32')
+    if isinstance(top, faiss.IndexIVF):
+        if top.direct_map.type == faiss.DirectMap.NoMap:
+            top.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return top.reconstruct_batch(_ivf_ids(top))
+    base = _base_index(index)
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        # Older IDMap2-over-IVF (positions 0..ntotal-1 as long as nothing was removed)
+        ivf.make_direct_map()
+    return base.reconstruct_n(0, top.ntotal)
+
+def search_params(index, nprobe=None, ef_search=None, sel=None):
+    """Build FAISS SearchParameters carrying the nprobe / efSearch knobs and an optional ID selector."""
+    kind = index_type_of(index)
+    if kind in ('ivfflat', 'ivfpq') and (nprobe or sel is not None):
+        # SearchParametersIVF defaults to nprobe=1, so carry the index's own value over
+        nprobe = int(nprobe or faiss.extract_index_ivf(index).nprobe)
+        return faiss.SearchParametersIVF(sel=sel, nprobe=nprobe) if sel is not None else faiss.SearchParametersIVF(nprobe=nprobe)
+    if kind == 'hnsw' and (ef_search or sel is not None):
+        ef_search = int(ef_search or _base_index(index).hnsw.efSearch)
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=ef_search) if sel is not None else faiss.SearchParametersHNSW(efSearch=ef_search)
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+# --- Hybrid retrieval ---
+# search_hybrid menggabungkan vector search dengan BM25 (bm25_index) per kategori:
+# kata persis seperti nomor pasal, kode, atau nama sering terlewat oleh embedding.
+HYBRID_SEARCH = os.getenv('HYBRID_SEARCH', '1') == '1'
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '50'))
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+
+def allowed_ids(metas, regional=None, exclude_deleted=False):
+    """Return the cache entry for the ids a search may return, or None / False.
+
+    Those are the rows whose regional contains `regional` (when given),
+    minus tombstoned ids when exclude_deleted. The entry's 'member' is a
+    boolean array indexed by id. Returns None when no filtering is needed
+    and False when no row matches. Entries are cached on the meta handle,
+    which is itself replaced with every new snapshot.
+    """
+    if not regional and not exclude_deleted:
+        return None
+    key = (str(regional).lower() if regional else None, exclude_deleted)
+    cache = metas.setdefault('selectors', {})
+    if key not in cache:
+        if regional:
+            mask = meta_store.mask_contains(metas, 'regional', key[0])
+        else:
+            mask = np.ones(meta_store.num_rows(metas), dtype=bool)
+        if exclude_deleted:
+            mask &= meta_store.live_mask(metas)
+        if mask.all():
+            cache[key] = None
+        elif not mask.any():
+            cache[key] = False
+        else:
+            ids = np.asarray(metas['columns'][meta_store.ID_COLUMN])[mask]
+            member = np.zeros(int(ids.max()) + 1, dtype=bool)
+            member[ids] = True
+            cache[key] = {'member': member}
+    return cache[key]
+
+def search_selector(index, metas, regional=None):
+    """Return an IDSelectorBitmap over the ids a search may return (see allowed_ids).
+
+    Tombstoned ids are only excluded while the index still holds them
+    (HNSW cannot remove_ids).
+    """
+    entry = allowed_ids(metas, regional, index.ntotal > meta_store.num_live(metas))
+    if not entry:
+        return entry
+    if 'selector' not in entry:
+        # Keep the bitmap alive alongside the selector that points into it
+        entry['bits'] = np.packbits(entry['member'], bitorder='little')
+        entry['selector'] = faiss.IDSelectorBitmap(len(entry['bits']), faiss.swig_ptr(entry['bits']))
+    return entry['selector']
+
+def _open_for_search(category, vector):
+    index_file, meta_file = get_index_and_meta_file(category)
+    try:
+        index, metas = load_index_and_meta(index_file, meta_file)
+    except FileNotFoundError:
+        #raise FileNotFoundError(f"Index file not found: {index_file}")
+        raise FileNotFoundError(f"Data tidak ditemukan!.")
+    print(f"VECTOR DIM: {len(vector)} INDEX DIM: {index.d}", file=sys.stderr)
+    print(f"index_file: {index_file}, meta_file: {meta_file}", file=sys.stderr)
+    if len(vector) != index.d:
+        #raise ValueError(f"Dimensi vector ({len(vector)}) tidak cocok dengan index ({index.d})")
+        raise ValueError(f"Kesalahan pada data, silakan coba lagi atau hubungi admin.")
+    return index_file, index, metas
+
+def _vector_hits_batch(index, metas, vectors, top_k, nprobe=None, ef_search=None, regional=None):
+    """[(distances, ids), ...] of the top_k vectors for every row of vectors, in one FAISS search."""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    sel = search_selector(index, metas, regional)
+    if sel is False:
+        return [([], []) for _ in range(len(vectors))]
+    params = search_params(index, nprobe=nprobe, ef_search=ef_search, sel=sel)
+    D, I = index.search(vectors, top_k, params=params)
+    # FAISS pads with -1 when the index holds fewer than top_k vectors
+    return [([float(d) for d in dists[ids >= 0]], [int(idx) for idx in ids[ids >= 0]]) for dists, ids in zip(D, I)]
+
+def _vector_hits(index, metas, vector, top_k, nprobe=None, ef_search=None, regional=None):
+    """(distances, ids) of the top_k vectors, nearest first."""
+    return _vector_hits_batch(index, metas, np.array([vector]), top_k, nprobe, ef_search, regional)[0]
+
+def _vector_ids(index, metas, vector, top_k, nprobe=None, ef_search=None, regional=None):
+    return _vector_hits(index, metas, vector, top_k, nprobe, ef_search, regional)[1]
+
+def search(vector, top_k=3, category='teknologi', nprobe=None, ef_search=None, regional=None):
+    """Search the FAISS index for the top_k most similar vectors in the given category.
+
+    nprobe (IVF) and ef_search (HNSW) override the values stored with the index;
+    they are ignored for exact Flat indexes. When regional is given, only
+    chunks whose regional contains it (case-insensitive) are considered, so
+    the result is the true top_k among the matching chunks.
+    """
+    try:
+        _, index, metas = _open_for_search(category, vector)
+        ids = _vector_ids(index, metas, vector, top_k, nprobe, ef_search, regional)
+        return meta_store.read_rows(metas, meta_store.ids_to_rows(metas, ids))
     except Exception as e:
         print(f"[FAISS SEARCH ERROR] {e}", file=sys.stderr)
         raise
 
-def load_thread(user_id, thread_id):
-    """Load a user's thread memory from file."""
-    path = os.path.join(THREADS_DIR, f'{user_id}_{thread_id}.json')
-    if os.path.exists(path):
+def rrf_fuse(rankings, k=None):
+    """Reciprocal-rank fusion: ids ordered by sum(1 / (k + rank)) over the rankings they appear in."""
+    k = HYBRID_RRF_K if k is None else k
+    scores = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking, start=1):
+            scores[idx] = scores.get(idx, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda idx: -scores[idx])
+
+def _bm25_ids(index_file, metas, query, n, regional=None):
+    """Ids of the n best BM25 matches for query, under the same filter as the vector search."""
+    # Postings BM25 masih memuat id yang di-tombstone sampai compact()
+    entry = allowed_ids(metas, regional, meta_store.num_live(metas) < meta_store.num_rows(metas))
+    if entry is False:
+        return []
+    text_ids, _ = bm25_index.search(os.path.dirname(index_file) or '.', metas['header']['bm25'], query,
+                                    n, entry['member'] if entry else None)
+    return [int(i) for i in text_ids]
+
+def search_hybrid(vector, query, top_k=3, category='teknologi', nprobe=None, ef_search=None, regional=None, timings=None):
+    """Vector search plus BM25 over the chunk text, fused with reciprocal-rank fusion.
+
+    Each path returns up to HYBRID_CANDIDATES ids (same regional filter),
+    rrf_fuse merges them and the top_k rows are returned. timings, when
+    given, receives vector_ms, bm25_ms and fusion_ms. Categories without a
+    BM25 index (see build_bm25) fall back to the vector results.
+    """
+    timings = {} if timings is None else timings
+    try:
+        index_file, index, metas = _open_for_search(category, vector)
+        bm25 = metas['header'].get('bm25')
+        hybrid = bool(bm25 and bm25['segments'] and query)
+        start = time.perf_counter()
+        vec_ids = _vector_ids(index, metas, vector, max(HYBRID_CANDIDATES, top_k) if hybrid else top_k,
+                              nprobe, ef_search, regional)
+        timings['vector_ms'] = (time.perf_counter() - start) * 1000
+        if not hybrid:
+            ids = vec_ids[:top_k]
+        else:
+            start = time.perf_counter()
+            text_ids = _bm25_ids(index_file, metas, query, max(HYBRID_CANDIDATES, top_k), regional)
+            timings['bm25_ms'] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            ids = rrf_fuse([vec_ids, text_ids])[:top_k]
+            timings['fusion_ms'] = (time.perf_counter() - start) * 1000
+        print(f"[HYBRID] {category}: " + ", ".join(f"{k}={v:.1f}" for k, v in timings.items()), file=sys.stderr)
+        return meta_store.read_rows(metas, meta_store.ids_to_rows(metas, ids))
+    except Exception as e:
+        print(f"[FAISS SEARCH ERROR] {e}", file=sys.stderr)
+        raise
+
+def search_batch(vectors, top_k=3, category='teknologi', nprobe=None, ef_search=None, regional=None, queries=None, timings=None):
+    """search (search_hybrid when queries are given) for many query vectors with one FAISS search call.
+
+    Returns one list of rows per vector, in order. The index is opened once
+    and searched with the stacked query matrix; BM25 still runs per query.
+    timings, when given, receives vector_ms and bm25_ms/fusion_ms for the
+    whole batch.
+    """
+    timings = {} if timings is None else timings
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    if not len(vectors):
+        return []
+    try:
+        index_file, index, metas = _open_for_search(category, vectors[0])
+        bm25 = metas['header'].get('bm25')
+        hybrid = bool(bm25 and bm25['segments'] and queries)
+        n = max(HYBRID_CANDIDATES, top_k) if hybrid else top_k
+        start = time.perf_counter()
+        hits = _vector_hits_batch(index, metas, vectors, n, nprobe, ef_search, regional)
+        timings['vector_ms'] = (time.perf_counter() - start) * 1000
+        if not hybrid:
+            id_lists = [ids[:top_k] for _, ids in hits]
+        else:
+            start = time.perf_counter()
+            text_lists = [_bm25_ids(index_file, metas, query, n, regional) if query else [] for query in queries]
+            timings['bm25_ms'] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            id_lists = [rrf_fuse([ids, text_ids])[:top_k] for (_, ids), text_ids in zip(hits, text_lists)]
+            timings['fusion_ms'] = (time.perf_counter() - start) * 1000
+        print(f"[BATCH] {category}: {len(vectors)} query, " + ", ".join(f"{k}={v:.1f}" for k, v in timings.items()), file=sys.stderr)
+        return [meta_store.read_rows(metas, meta_store.ids_to_rows(metas, ids)) for ids in id_lists]
+    except Exception as e:
+        print(f"[FAISS SEARCH ERROR] {e}", file=sys.stderr)
+        raise
+
+# --- Federated search over several kategori ---
+# search_multi mengirim vector query ke index beberapa kategori sekaligus di
+# thread pool (FAISS melepas GIL selama search) dan menggabungkan top_k tiap
+# kategori berdasarkan jarak L2. Setiap kategori punya tenggat sendiri
+# ("deadline" di index_specs.json, default FEDERATED_DEADLINE detik); kategori
+# yang melewatinya dilewati, jadi satu kategori yang lambat atau besar tidak
+# menahan jawaban.
+FEDERATED_CONCURRENCY = int(os.getenv('FEDERATED_CONCURRENCY', '8'))
+FEDERATED_DEADLINE = float(os.getenv('FEDERATED_DEADLINE', '2.0'))
+_federated_pool = ThreadPoolExecutor(max_workers=max(FEDERATED_CONCURRENCY, 1), thread_name_prefix='faiss-fanout')
+
+def category_deadline(category, deadline=None):
+    """Seconds search_multi waits for a kategori: deadline (a number, or a dict per kategori), its spec's "deadline", or FEDERATED_DEADLINE."""
+    if isinstance(deadline, dict):
+        deadline = deadline.get(category)
+    if deadline is None:
+        deadline = get_index_spec(category).get('deadline')
+    return float(FEDERATED_DEADLINE if deadline is None else deadline)
+
+def _search_category(category, vectors, top_k, nprobe, ef_search, regional):
+    """One kategori's part of search_multi_batch: one FAISS search over the query matrix.
+
+    Returns ([[(distance, row), ...] nearest first, per query], elapsed ms).
+    """
+    start = time.perf_counter()
+    _, index, metas = _open_for_search(category, vectors[0])
+    id_column = np.asarray(metas['columns'][meta_store.ID_COLUMN])
+    out = []
+    for dists, ids in _vector_hits_batch(index, metas, vectors, top_k, nprobe, ef_search, regional):
+        positions = meta_store.ids_to_rows(metas, ids)
+        # ids_to_rows melewati id yang tidak ada; jarak dipasangkan lewat id baris yang ditemukan
+        dist_of = dict(zip(ids, dists))
+        rows = meta_store.read_rows(metas, positions)
+        for row in rows:
+            row['kategori'] = row.get('kategori') or category
+        out.append([(dist_of[int(i)], row) for i, row in zip(id_column[positions], rows)])
+    return out, (time.perf_counter() - start) * 1000
+
+def search_multi(vector, categories, top_k=3, nprobe=None, ef_search=None, regional=None, deadline=None, timings=None):
+    """Search several kategori in parallel and return the top_k rows across all of them.
+
+    Every kategori is searched on the fan-out pool for its own top_k (same
+    regional filter as search) and the lists are merged by L2 distance, so
+    the kategori must share one embedding model. A kategori that misses its
+    deadline (see category_deadline), has no index or fails is left out;
+    timings, when given, receives per-category ms, the skipped kategori with
+    the reason, and total_ms. Raises only when no kategori answered.
+    """
+    return search_multi_batch(np.array([vector]), categories, top_k, nprobe, ef_search, regional, deadline, timings)[0]
+
+def search_multi_batch(vectors, categories, top_k=3, nprobe=None, ef_search=None, regional=None, deadline=None, timings=None):
+    """search_multi for many query vectors: one fan-out, each kategori searched once with the stacked matrix.
+
+    Returns one list of rows per vector, in order; deadlines, skipping and
+    timings work as in search_multi (for the whole batch).
+    """
+    timings = {} if timings is None else timings
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    if not len(vectors):
+        return []
+    categories = list(dict.fromkeys(c for c in categories if c))
+    start = time.perf_counter()
+    futures = {c: _federated_pool.submit(tracing.wrap(_search_category), c, vectors, top_k, nprobe, ef_search, regional)
+               for c in categories}
+    limits = {c: category_deadline(c, deadline) for c in categories}
+    hits, per_category, skipped, errors = [], {}, {}, []
+    for c in sorted(categories, key=limits.get):
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if not content:
-                    return []
-                return json.loads(content)
+            category_hits, elapsed_ms = futures[c].result(timeout=max(start + limits[c] - time.perf_counter(), 0))
+        except FuturesTimeout:
+            # Search yang sudah jalan tidak bisa dihentikan; hasilnya dibuang saat selesai
+            futures[c].cancel()
+            skipped[c] = f'deadline {limits[c]:.2f}s'
+            continue
         except Exception as e:
-            print(f"[THREAD] Gagal mengingat percapakapan. {path}: {e}", file=sys.stderr)
-            return []
-    return []
+            skipped[c] = str(e)
+            errors.append(e)
+            continue
+        per_category[c] = elapsed_ms
+        hits.append(category_hits)
+    timings['per_category_ms'] = per_category
+    timings['skipped'] = skipped
+    timings['total_ms'] = (time.perf_counter() - start) * 1000
+    print(f"[FEDERATED] {len(vectors)} query, {len(per_category)}/{len(categories)} kategori, total_ms={timings['total_ms']:.1f}"
+          + "".join(f", {c}_ms={ms:.1f}" for c, ms in per_category.items())
+          + "".join(f", skip {c}: {why}" for c, why in skipped.items()), file=sys.stderr)
+    if not hits and categories:
+        if errors:
+            raise errors[0]
+        raise TimeoutError("Pencarian melebihi batas waktu untuk semua kategori.")
+    if not hits:
+        return [[] for _ in vectors]
+    # Tiap daftar sudah urut jarak; heap merge cukup mengambil top_k teratas per query
+    return [[row for _, row in itertools.islice(heapq.merge(*lists, key=lambda hit: hit[0]), top_k)]
+            for lists in zip(*hits)]
+
+def load_thread(user_id, thread_id):
+    """Load a user's thread memory (lihat thread_store)."""
+    from . import thread_store
+    return thread_store.load_all(user_id, thread_id)
 
 def save_thread(user_id, thread_id, memory):
-    """Save a user's thread memory to file."""
-    path = os.path.join(THREADS_DIR, f'{user_id}_{thread_id}.json')
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(memory, f, ensure_ascii=False, indent=2)
+    """Replace a user's thread memory; untuk menambah satu giliran pakai thread_store.append_turn."""
+    from . import thread_store
+    thread_store.replace(user_id, thread_id, memory)
 
 
 # def save_faiss_index(index, file_path):
@@ -141,70 +914,232 @@ def load_faiss_index(file_path):
     return faiss.read_index(file_path)
 
 def save_metadata(meta, file_path):
-    """Save metadata to file using pickle."""
+    """Save metadata to file using pickle (legacy format, see meta_store)."""
     with open(file_path, 'wb') as f:
         pickle.dump(meta, f)
 
 def load_metadata(file_path):
-    """Load metadata from file using pickle."""
+    """Load metadata from file using pickle (legacy format, see meta_store)."""
     with open(file_path, 'rb') as f:
         return pickle.load(f)
 
 
 
-def create_or_update_index(vectors, metadatas, index_file, meta_file):
-    """Create a new FAISS index or update an existing one with new vectors and metadata."""
-    try:
-        index = None
-        old_vectors = []
-        old_metadatas = []
-        # Backup sebelum overwrite
-        if os.path.exists(index_file):
-            os.rename(index_file, index_file + ".bak")
-        if os.path.exists(meta_file):
-            os.rename(meta_file, meta_file + ".bak")
-
-        # Load data lama
-        if os.path.exists(index_file + ".bak") and os.path.exists(meta_file + ".bak"):
-            try:
-                index = faiss.read_index(index_file + ".bak")
-                old_metadatas = load_metadata(meta_file + ".bak")
-                old_vectors = index.reconstruct_n(0, index.ntotal).tolist() if index.ntotal > 0 else []
-            except Exception as e:
-                print(f"[BACKUP LOAD ERROR] {e}")
-                old_vectors = []
-                old_metadatas = []
-        all_vectors = old_vectors + vectors
-        all_metadatas = old_metadatas + metadatas
-        if not all_vectors:
-            index = faiss.IndexFlatL2(1)
-            faiss.write_index(index, index_file)
-            with open(meta_file, 'wb') as f:
-                pickle.dump([], f)
-            print("Index kosong disimpan")
-            return
-        dim = len(all_vectors[0])
-        total = len(all_vectors)
-        index = faiss.IndexFlatL2(dim)
-        last_percent = -1
-        for i in range(total):
-            index.add(np.array([all_vectors[i]]).astype('float32'))
-            percent = int(((i + 1) / total) * 100)
-            if percent != last_percent:
-                print(f"Progress: {percent}% ({i + 1}/{total})", flush=True)
-                last_percent = percent
-        faiss.write_index(index, index_file)
-        with open(meta_file, 'wb') as f:
-            pickle.dump(all_metadatas, f)
-        # Hapus backup jika sukses
-        if os.path.exists(index_file + ".bak"):
-            os.remove(index_file + ".bak")
-        if os.path.exists(meta_file + ".bak"):
-            os.remove(meta_file + ".bak")
+def _replace_file(path, write):
+    """Write to a temporary file next to path, then atomically swap it in."""
+    tmp = f"{path}.tmp{os.getpid()}"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def write_index_atomic(index, index_file):
+    """Persist a FAISS index without ever exposing a half-written file to readers."""
+    _replace_file(index_file, lambda tmp: faiss.write_index(index, tmp))
+
+def create_or_update_index(vectors, metadatas, index_file, meta_file, job_id=None):
+    """Append new vectors and metadata to a category index, creating it if needed.
+
+    Only the new vectors are added, as one contiguous float32 block; existing
+    vectors are never reconstructed. New metadata rows are appended to the
+    columnar store and published together with the index as a new snapshot,
+    so searches keep using the previous snapshot until the swap. Runs under
+    the kategori's writer lock. With job_id the rows can later be removed by
+    delete_job.
+    """
+    try:
+        with write_lock(index_file):
+            new_vectors = np.ascontiguousarray(np.asarray(vectors if vectors is not None else [], dtype='float32'))
+            snap = read_snapshot(index_file, meta_file)
+            index = None
+            if snap is not None:
+                index = with_id_map(faiss.read_index(snap['index']))
+                n_rows = snap['meta']['n_rows']
+                # Baris tombstone boleh masih ada di index (HNSW) atau sudah dihapus (remove_ids)
+                if not n_rows - snap['meta'].get('n_deleted', 0) <= index.ntotal <= n_rows:
+                    raise ValueError(f"Index ({index.ntotal}) dan metadata ({n_rows}) tidak sinkron: {index_file}")
+            if len(new_vectors) == 0:
+                if index is None:
+                    # Belum ada data sama sekali: simpan index kosong
+                    _publish_snapshot(index_file, meta_file, faiss.IndexFlatL2(1), meta_store.stage_rows(meta_file, None, []), None)
+                    print("Index kosong disimpan")
+                return
+            if new_vectors.ndim != 2 or len(new_vectors) != len(metadatas):
+                raise ValueError(f"Jumlah vector ({len(new_vectors)}) dan metadata ({len(metadatas)}) tidak sama")
+            dim = new_vectors.shape[1]
+            if index is not None and index.ntotal > 0 and index.d != dim:
+                raise ValueError(f"Dimensi vector ({dim}) tidak cocok dengan index ({index.d})")
+            if index is not None and index.ntotal == 0:
+                # Index kosong (misal hasil delete, dimensi placeholder 1): bangun ulang dari nol
+                index = None
+            existing = index.ntotal if index is not None else 0
+            with tracing.span('meta_append'):
+                header = meta_store.stage_append(meta_file, snap['meta'] if snap else None, list(metadatas), job_id=job_id)
+            new_ids = np.arange(header['next_id'] - len(new_vectors), header['next_id'], dtype='int64')
+            # Postings BM25 chunk baru: satu segmen per upload, dalam snapshot yang sama dengan vector-nya
+            with tracing.span('bm25_segment'):
+                bm25 = header.get('bm25')
+                if bm25 is None and snap is not None and snap['meta']['n_rows']:
+                    bm25 = _bm25_backfill(index_file, meta_file, snap['meta'])
+                header['bm25'] = bm25_index.add_segment(
+                    os.path.dirname(index_file) or '.', _bm25_base(index_file), bm25, new_ids,
+                    [m.get('text') for m in metadatas], keep_id=lambda ids: ~meta_store.is_tombstoned(header, ids))
+            spec = resolve_index_spec(get_index_spec(_category_from_index_file(index_file)), existing + len(new_vectors), dim,
+                                      current=index_type_of(index) if index is not None else None)
+            with tracing.span('index_add', type=spec['type']):
+                if index is not None and index_type_of(index) == spec['type']:
+                    index.add_with_ids(new_vectors, new_ids)
+                else:
+                    ids = new_ids
+                    if index is not None:
+                        print(f"[FAISS] Migrasi index {index_file}: {index_type_of(index)} -> {spec['type']} ({existing + len(new_vectors)} vector)", file=sys.stderr)
+                        new_vectors = np.vstack([reconstruct_all(index), new_vectors])
+                        ids = np.concatenate([index_ids(index), new_ids])
+                    index = build_index(new_vectors, spec, ids)
+            with tracing.span('snapshot_publish'):
+                version = _publish_snapshot(index_file, meta_file, index, header, snap)
+            print(f"Index diupdate: +{len(metadatas)} vector, total {index.ntotal} ({spec['type']}, snapshot {version})", flush=True)
     except Exception as e:
         print(f"Gagal update index: {e}")
-        # Restore backup jika gagal
-        if os.path.exists(index_file + ".bak"):
-            os.rename(index_file + ".bak", index_file)
-        if os.path.exists(meta_file + ".bak"):
-            os.rename(meta_file + ".bak", meta_file)
+        raise
+    finally:
+        # Drop the resident copy so the next search re-reads the new snapshot
+        invalidate_index_cache(index_file)
+
+def delete_source(filename, index_file, meta_file):
+    """Remove every vector/metadata entry whose source is filename; returns (removed, remaining).
+
+    The source's ids come from the id_ranges in the metadata header. Their
+    vectors are dropped with remove_ids and their metadata rows are only
+    tombstoned, so nothing is reconstructed or re-indexed. HNSW cannot
+    remove_ids; its vectors stay and searches skip them. Once tombstones reach
+    FAISS_COMPACT_RATIO of the rows, a background compaction rewrites the
+    metadata without them. Runs under the kategori's writer lock and
+    publishes a new snapshot.
+    """
+    return _delete_rows(index_file, meta_file, lambda header: meta_store.stage_tombstone(meta_file, header, filename))
+
+def delete_job(job_id, index_file, meta_file):
+    """Remove only the rows create_or_update_index appended for job_id; returns (removed, remaining).
+
+    Used when an ingest job is retried: an earlier upload of the same file
+    keeps its rows. Works like delete_source otherwise.
+    """
+    return _delete_rows(index_file, meta_file, lambda header: meta_store.stage_tombstone_job(meta_file, header, job_id))
+
+def _delete_rows(index_file, meta_file, stage):
+    """Tombstone the rows stage(header) returns and remove their vectors; see delete_source."""
+    try:
+        with write_lock(index_file):
+            snap = read_snapshot(index_file, meta_file)
+            if snap is None:
+                return 0, 0
+            header, ids = stage(snap['meta'])
+            remaining = header['n_rows'] - header['n_deleted']
+            if not len(ids):
+                return 0, remaining
+            if not remaining:
+                empty = meta_store.stage_rows(meta_file, header, [])
+                if header.get('bm25'):
+                    empty['bm25'] = {'segments': [], 'next_seg': header['bm25']['next_seg']}
+                _publish_snapshot(index_file, meta_file, faiss.IndexFlatL2(1), empty, snap)
+                return len(ids), 0
+            index = faiss.read_index(snap['index'])
+            if index_type_of(index) == 'hnsw':
+                index = None
+            else:
+                index = with_id_map(index)
+                ids = np.ascontiguousarray(ids, dtype='int64')
+                if isinstance(index, faiss.IndexIVF):
+                    # A hashtable direct map only removes by IDSelectorArray
+                    index.remove_ids(faiss.IDSelectorArray(len(ids), faiss.swig_ptr(ids)))
+                else:
+                    index.remove_ids(faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids)))
+            _publish_snapshot(index_file, meta_file, index, header, snap)
+    finally:
+        invalidate_index_cache(index_file)
+    if header['n_deleted'] >= COMPACT_RATIO * header['n_rows']:
+        schedule_compaction(index_file, meta_file)
+    return len(ids), remaining
+
+
+# --- Compaction of tombstoned rows ---
+# delete_source leaves the deleted rows in the metadata columns (and, for
+# HNSW, the vectors in the index). When they reach FAISS_COMPACT_RATIO of a
+# kategori's rows, a background thread per process rewrites the metadata as
+# a new generation holding only live rows (same ids) and rebuilds the index
+# if it still holds deleted vectors.
+COMPACT_RATIO = float(os.getenv('FAISS_COMPACT_RATIO', '0.2'))
+_compact_queue = set()  # (index_file, meta_file)
+_compact_event = threading.Event()
+_compactor = {'pid': None}
+_compactor_lock = threading.Lock()
+
+def compact(index_file, meta_file):
+    """Drop tombstoned rows for good; returns the number of rows dropped."""
+    try:
+        with write_lock(index_file):
+            snap = read_snapshot(index_file, meta_file)
+            if snap is None or not snap['meta'].get('n_deleted'):
+                return 0
+            metas = meta_store.open_meta(meta_file, snap['meta'])
+            keep = np.flatnonzero(meta_store.live_mask(metas))
+            live_ids = np.asarray(metas['columns'][meta_store.ID_COLUMN])[keep]
+            del metas
+            header = meta_store.stage_select(meta_file, snap['meta'], keep)
+            if snap['meta'].get('bm25'):
+                header['bm25'] = bm25_index.compact(os.path.dirname(index_file) or '.', _bm25_base(index_file),
+                                                    snap['meta']['bm25'], lambda ids: np.isin(ids, live_ids))
+            index = with_id_map(faiss.read_index(snap['index']))
+            if index.ntotal > len(keep):
+                # Index masih memuat vector yang dihapus (HNSW): bangun ulang dari vector yang tersisa
+                live = np.isin(index_ids(index), live_ids)
+                spec = resolve_index_spec(get_index_spec(_category_from_index_file(index_file)), int(live.sum()), index.d,
+                                          current=index_type_of(index))
+                index = build_index(reconstruct_all(index)[live], spec, index_ids(index)[live])
+            else:
+                index = None
+            _publish_snapshot(index_file, meta_file, index, header, snap)
+            return snap['meta']['n_rows'] - len(keep)
+    finally:
+        invalidate_index_cache(index_file)
+
+def build_bm25(category):
+    """Build the BM25 index of a kategori written before BM25 existed; returns the rows indexed."""
+    index_file, meta_file = get_index_and_meta_file(category)
+    try:
+        with write_lock(index_file):
+            snap = read_snapshot(index_file, meta_file)
+            if snap is None or snap['meta'].get('bm25') is not None:
+                return 0
+            header = meta_store.with_ids(meta_file, snap['meta'])
+            header['bm25'] = _bm25_backfill(index_file, meta_file, header)
+            _publish_snapshot(index_file, meta_file, None, header, snap)
+            return sum(seg['n_docs'] for seg in header['bm25']['segments'])
+    finally:
+        invalidate_index_cache(index_file)
+
+def _compact_loop():
+    while True:
+        _compact_event.wait()
+        with _compactor_lock:
+            pending = list(_compact_queue)
+            _compact_queue.clear()
+            _compact_event.clear()
+        for index_file, meta_file in pending:
+            try:
+                dropped = compact(index_file, meta_file)
+                print(f"[FAISS] Compaction {os.path.basename(index_file)}: {dropped} baris tombstone dibuang", file=sys.stderr)
+            except Exception as e:
+                print(f"[FAISS] Compaction gagal {index_file}: {e}", file=sys.stderr)
+
+def schedule_compaction(index_file, meta_file):
+    """Run compact(index_file, meta_file) on this process's background compactor thread."""
+    with _compactor_lock:
+        if _compactor['pid'] != os.getpid():
+            _compactor['pid'] = os.getpid()
+            threading.Thread(target=_compact_loop, name='faiss-compactor', daemon=True).start()
+        _compact_queue.add((index_file, meta_file))
+        _compact_event.set()
@@ -0,0 +1,88 @@
+import os
+import sys
+
+from utils.text_utils import iter_text_pages, iter_token_chunks
+from . import faiss_service, job_service, telemetry_outbox, tracing
+from .embedding_service import get_embeddings
+
+JOB_KIND = 'ingest'
+
+
+def ingest_file(job, progress):
+    """Job handler: extract, chunk, embed and index one uploaded file.
+
+    payload: file_path, filename, kategori, regional, uploaded_by.
+    progress(msg) is called with the same messages /progress-stream always sent.
+    The stage timings of the job are returned under 'timings'.
+    """
+    payload = job['payload']
+    with tracing.trace('upload', job_id=job['id'], filename=payload['filename'], category=payload['kategori'],
+                       attempt=job.get('attempts'), request_trace_id=payload.get('trace_id')) as trace:
+        result = _ingest_file(job, payload, progress)
+    result['timings'] = trace.summary()
+    return result
+
+def _ingest_file(job, payload, progress):
+    file_path = payload['file_path']
+    filename = payload['filename']
+    kategori = payload['kategori']
+    regional = payload['regional']
+    index_file, meta_file = faiss_service.get_index_and_meta_file(kategori)
+    if job.get('attempts', 1) > 1:
+        # Percobaan ulang setelah worker mati: buang chunk job ini yang mungkin sudah sempat terindeks
+        # (hanya baris job ini; upload lain dari file yang sama tetap ada)
+        with tracing.span('retry_cleanup') as span:
+            removed, _ = faiss_service.delete_job(job['id'], index_file, meta_file)
+            span['removed'] = removed
+        if removed:
+            print(f"[UPLOAD] Retry {filename}: {removed} chunk lama dihapus", file=sys.stderr)
+
+    progress("Upload started")
+    # Halaman PDF diekstrak paralel; chunking (per token, lihat CHUNK_TOKENS) berjalan sambil halaman berikutnya diekstrak
+    with tracing.span('extract_chunk') as span:
+        chunks = list(iter_token_chunks(iter_text_pages(file_path)))
+        span['chunks'] = len(chunks)
+    if not chunks:
+        raise ValueError('File tidak berisi teks.')
+    progress("Text extracted")
+    progress(f"Text chunked: {len(chunks)} chunks")
+
+    # Embedding dikirim per batch (beberapa batch paralel), progress dilaporkan per batch
+    def on_embedding_batch(done, total):
+        print(f"[UPLOAD] Selesai embedding chunk {done}/{total}", file=sys.stderr)
+        progress(f"Embedding {done}/{total}")
+    try:
+        vectors = get_embeddings([chunk['text'] for chunk in chunks], progress_cb=on_embedding_batch)
+    except Exception as e:
+        raise RuntimeError(f'Gagal membuat embedding: {e}')
+    if not vectors:
+        raise RuntimeError('Gagal membuat embedding.')
+    metadatas = [{
+        'source': filename,
+        'chunk_index': i,
+        'page': chunk['page'],
+        'text': chunk['text'],
+        'kategori': kategori,
+        'regional': regional
+    } for i, chunk in enumerate(chunks)]
+
+    progress("Indexing started")
+    with tracing.span('index_write'):
+        faiss_service.create_or_update_index(vectors, metadatas, index_file, meta_file, job_id=job['id'])
+    progress("Done")
+
+    # Notify portal about the document for regional aggregation (best-effort, lewat telemetry outbox)
+    size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+    with tracing.span('portal_enqueue'):
+        telemetry_outbox.enqueue('/documents', {
+            'filename': filename,
+            'kategori': kategori,
+            'regional': regional,
+            'size': size,
+            'uploaded_by': payload.get('uploaded_by') or 'system'
+        })
+    print(f"[UPLOAD] Selesai indexing file: {filename}, job: {job['id']}", file=sys.stderr)
+    return {'filename': filename, 'kategori': kategori, 'chunks': len(chunks)}
+
+
+job_service.register(JOB_KIND, ingest_file)
@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import threading
+import traceback
+
+# Antrian job yang tahan restart (SQLite, dipakai bersama oleh semua worker gunicorn).
+# Setiap proses menjalankan JOB_WORKERS thread yang mengambil job 'queued' secara atomik
+# (BEGIN IMMEDIATE). Job 'running' milik proses yang sudah mati dikembalikan ke antrian
+# sampai JOB_MAX_ATTEMPTS, setelah itu ditandai 'failed'.
+V1_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+JOBS_DB = os.getenv('JOBS_DB') or os.path.join(
+    os.getenv('RAG_VECTOR_DIR') or os.path.join(V1_DIR, 'vector'), 'jobs.sqlite')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1.0'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETENTION_DAYS = float(os.getenv('JOB_RETENTION_DAYS', '7'))
+_RECOVER_INTERVAL = 30.0
+
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+_handlers = {}  # key: kind, value: fn(job, progress) -> result dict
+_listeners = []  # fn(job_id), dipanggil setelah event baru atau job selesai (lihat progress_bus)
+_local = threading.local()
+_wakeup = threading.Event()
+_workers_lock = threading.Lock()
+_workers = {'pid': None, 'threads': []}
+_HOST = socket.gethostname()
+
+
+def _db():
+    # Koneksi per thread (dan per pid, karena koneksi SQLite tidak boleh dibawa melewati fork)
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'pid', None) != os.getpid():
+        os.makedirs(os.path.dirname(JOBS_DB), exist_ok=True)
+        conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                progress TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+            CREATE TABLE IF NOT EXISTS job_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, seq);
+        ''')
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+def register(kind, fn):
+    """Daftarkan handler untuk satu jenis job."""
+    _handlers[kind] = fn
+
+def add_listener(fn):
+    """Panggil fn(job_id) setiap kali job mendapat event progress baru atau selesai."""
+    _listeners.append(fn)
+
+def _notify(job_id):
+    for fn in _listeners:
+        try:
+            fn(job_id)
+        except Exception as e:
+            print(f"[JOBS] Listener error: {e}", file=sys.stderr)
+
+def enqueue(kind, payload, job_id):
+    """Simpan job baru dengan status 'queued'. Raise ValueError jika job_id sudah dipakai."""
+    try:
+        _db().execute('INSERT INTO jobs (id, kind, status, payload, created_at) VALUES (?, ?, ?, ?, ?)',
+                      (job_id, kind, 'queued', json.dumps(payload), time.time()))
+    except sqlite3.IntegrityError:
+        raise ValueError(f'job {job_id} sudah ada')
+    _wakeup.set()
+    _notify(job_id)
+    return job_id
+
+def add_event(job_id, message):
+    """Catat pesan progress job (juga menjadi kolom progress = pesan terakhir)."""
+    conn = _db()
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('INSERT INTO job_events (job_id, message, created_at) VALUES (?, ?, ?)',
+                     (job_id, message, time.time()))
+        conn.execute('UPDATE jobs SET progress = ? WHERE id = ?', (message, job_id))
+    _notify(job_id)
+
+def events_since(job_id, after_seq=0):
+    """Pesan progress dengan seq > after_seq, urut: list of (seq, message)."""
+    rows = _db().execute('SELECT seq, message FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq',
+                         (job_id, after_seq)).fetchall()
+    return [(r['seq'], r['message']) for r in rows]
+
+def get(job_id):
+    row = _db().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+def _claim(owner):
+    conn = _db()
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE jobs SET status = 'running', owner = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                     (owner, time.time(), row['id']))
+    return get(row['id'])
+
+def _finish(job_id, status, result=None, error=None):
+    _db().execute('UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?',
+                  (status, json.dumps(result) if result is not None else None, error, time.time(), job_id))
+    _notify(job_id)
+
+def _proc_start(pid):
+    # Waktu start proses (Linux), supaya pid yang dipakai ulang setelah restart tidak dianggap pemilik lama
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return ''
+
+def _owner_id():
+    return f'{_HOST}:{os.getpid()}:{_proc_start(os.getpid())}'
+
+def _owner_alive(owner):
+    host, pid, start = ((owner or '').split(':') + ['', '', ''])[:3]
+    if host != _HOST:
+        # Proses di host lain tidak bisa dicek; anggap masih hidup
+        return True
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return _proc_start(pid) == start
+
+def recover_orphans():
+    """Kembalikan job 'running' milik proses yang sudah mati ke antrian (atau 'failed')."""
+    conn = _db()
+    requeued = failed = 0
+    orphans = []
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        rows = conn.execute("SELECT id, owner, attempts FROM jobs WHERE status = 'running'").fetchall()
+        for row in rows:
+            if _owner_alive(row['owner']):
+                continue
+            if row['attempts'] >= JOB_MAX_ATTEMPTS:
+                conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                             ('worker berhenti saat job berjalan', time.time(), row['id']))
+                failed += 1
+            else:
+                conn.execute("UPDATE jobs SET status = 'queued', owner = NULL WHERE id = ?", (row['id'],))
+                requeued += 1
+            orphans.append(row['id'])
+        # Bersihkan job lama yang sudah selesai beserta event-nya
+        cutoff = time.time() - JOB_RETENTION_DAYS * 86400
+        conn.execute("DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?)", (cutoff,))
+        conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,))
+    if requeued or failed:
+        print(f"[JOBS] Job yatim: {requeued} diantrikan ulang, {failed} gagal", file=sys.stderr)
+        _wakeup.set()
+        for job_id in orphans:
+            _notify(job_id)
+    return requeued, failed
+
+def _run(job):
+    job_id = job['id']
+    handler = _handlers.get(job['kind'])
+    if handler is None:
+        _finish(job_id, 'failed', error=f"tidak ada handler untuk job '{job['kind']}'")
+        return
+    print(f"[JOBS] Mulai job {job_id} ({job['kind']}, percobaan {job['attempts']})", file=sys.stderr)
+    try:
+        result = handler(job, lambda msg: add_event(job_id, msg))
+    except Exception as e:
+        print(f"[JOBS] Job {job_id} gagal: {e}\n{traceback.format_exc()}", file=sys.stderr)
+        add_event(job_id, f"Error: {e}")
+        _finish(job_id, 'failed', error=str(e))
+        return
+    _finish(job_id, 'done', result=result)
+    print(f"[JOBS] Job {job_id} selesai", file=sys.stderr)
+
+def _worker_loop():
+    owner = _owner_id()
+    last_recover = time.time()
+    while True:
+        try:
+            if time.time() - last_recover > _RECOVER_INTERVAL:
+                last_recover = time.time()
+                recover_orphans()
+            job = _claim(owner)
+            if job is None:
+                # Job dari proses lain baru terlihat setelah poll berikutnya
+                _wakeup.wait(JOB_POLL_INTERVAL)
+                _wakeup.clear()
+                continue
+            _run(job)
+        except Exception as e:
+            print(f"[JOBS] Worker error: {e}", file=sys.stderr)
+            time.sleep(JOB_POLL_INTERVAL)
+
+def start_workers(n=None):
+    """Jalankan worker pool di proses ini (sekali per pid, aman dipanggil berulang)."""
+    n = JOB_WORKERS if n is None else n
+    with _workers_lock:
+        if _workers['pid'] == os.getpid() or n <= 0:
+            return
+        _workers['pid'] = os.getpid()
+        try:
+            recover_orphans()
+        except sqlite3.Error as e:
+            print(f"[JOBS] Gagal memulihkan job: {e}", file=sys.stderr)
+        _workers['threads'] = []
+        for i in range(n):
+            t = threading.Thread(target=_worker_loop, name=f'job-worker-{i}', daemon=True)
+            t.start()
+            _workers['threads'].append(t)
+
+def stats():
+    rows = _db().execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+    out = {s: 0 for s in STATUSES}
+    out.update({r['status']: r['n'] for r in rows})
+    out['workers'] = len(_workers['threads']) if _workers['pid'] == os.getpid() else 0
+    return out
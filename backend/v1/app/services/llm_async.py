@@ -0,0 +1,169 @@
+import os
+import sys
+import asyncio
+
+try:
+    import httpx
+except ImportError:  # opsional: hanya dibutuhkan oleh asgi.py
+    httpx = None
+try:
+    import h2  # noqa: F401  (dipakai httpx untuk HTTP/2)
+    _HAS_H2 = True
+except ImportError:
+    _HAS_H2 = False
+
+from . import llm_service, embedding_cache, tracing
+
+# Versi async dari llm_service.ask_llm_with_faiss untuk asgi.py.
+# Semua panggilan OpenAI lewat satu httpx.AsyncClient per event loop
+# (keep-alive, HTTP/2 jika paket h2 terpasang), jadi request yang menunggu
+# GPT-4 tidak memegang thread. Langkah lokal (thread memory, answer cache,
+# FAISS search) tetap kode sync yang sama, dijalankan lewat asyncio.to_thread;
+# laporan token ke portal lewat telemetry_outbox seperti versi sync.
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', '100'))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv('LLM_HTTP_MAX_KEEPALIVE', '20'))
+LLM_HTTP2 = os.getenv('LLM_HTTP2', '1') == '1'
+LLM_HTTP_TIMEOUT = float(os.getenv('LLM_HTTP_TIMEOUT', '60'))
+
+_clients = {}  # key: event loop, value: httpx.AsyncClient
+
+
+def client():
+    """httpx.AsyncClient bersama untuk event loop yang sedang berjalan."""
+    if httpx is None:
+        raise RuntimeError("httpx belum terpasang (pip install 'httpx[http2]')")
+    loop = asyncio.get_running_loop()
+    c = _clients.get(loop)
+    if c is None or c.is_closed:
+        c = httpx.AsyncClient(
+            http2=LLM_HTTP2 and _HAS_H2,
+            limits=httpx.Limits(max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE),
+            timeout=httpx.Timeout(LLM_HTTP_TIMEOUT, connect=10),
+        )
+        _clients[loop] = c
+    return c
+
+async def aclose():
+    """Tutup client milik event loop ini (dipanggil saat ASGI lifespan shutdown)."""
+    c = _clients.pop(asyncio.get_running_loop(), None)
+    if c is not None:
+        await c.aclose()
+
+def stats():
+    return {'http2': LLM_HTTP2 and _HAS_H2, 'max_connections': LLM_HTTP_MAX_CONNECTIONS, 'clients': len(_clients)}
+
+async def get_embedding(text, model="text-embedding-3-small"):
+    """Sama dengan embedding_service.get_embedding (termasuk cache), lewat client async."""
+    from .embedding_service import _embedding_request
+    with tracing.span('embedding') as span:
+        cached = (await asyncio.to_thread(embedding_cache.get_many, [text], model))[0]
+        span['cached'] = cached is not None
+        if cached is not None:
+            return cached.tolist()
+        url, headers = _embedding_request()
+        resp = await client().post(url, headers=headers, json={'model': model, 'input': text}, timeout=15)
+        if resp.status_code != 200:
+            raise RuntimeError(f"OpenAI Embedding API error: {resp.text}")
+        data = resp.json()
+    tracing.record_tokens('embedding', data.get('usage'))
+    embedding = data['data'][0]['embedding']
+    await asyncio.to_thread(embedding_cache.put_many, [text], model, [embedding])
+    return embedding
+
+async def _rephrase(question, prev_llm_answer, headers, user_id, thread_id):
+    with tracing.span('rephrase') as span:
+        try:
+            resp = await client().post(llm_service._chat_url(), headers=headers,
+                                       json=llm_service._rephrase_payload(question, prev_llm_answer))
+        except httpx.HTTPError as e:
+            # Sama seperti llm_service._rephrase: lanjut dengan pertanyaan asli
+            print(f"[LLM_ASYNC] Rephrase gagal, pakai pertanyaan asli: {e}", file=sys.stderr)
+            span['error'] = type(e).__name__
+            return question, False
+    data = resp.json() if resp.status_code == 200 else None
+    if data:
+        llm_service._report_usage(data.get('usage'), data.get('model'), user_id, thread_id, {'type': 'rephrase-detection'})
+    return llm_service._rephrase_outcome(question, resp.status_code, data)
+
+async def _embed_and_search(question, top_k, category, regional):
+    try:
+        vector = await get_embedding(question)
+    except Exception as e:
+        print(f"[LLM_ASYNC] Embedding spekulatif gagal: {e}", file=sys.stderr)
+        return {}
+    results, error = await asyncio.to_thread(llm_service._search, vector, top_k, category, regional, question)
+    return {'vector': vector} if error else {'vector': vector, 'results': results}
+
+async def _prepare_answer(question, category, user_id, thread_id, top_k, regional, use_cache):
+    memory, prev_llm_answer, is_followup = await asyncio.to_thread(llm_service._load_memory, question, user_id, thread_id)
+    headers = llm_service._openai_headers()
+    if not headers:
+        return {'error': 'OPENAI_API_KEY is not set in environment'}
+
+    rephrased_question = question
+    speculative = None
+    if is_followup and prev_llm_answer:
+        if llm_service.LLM_SPECULATIVE_RETRIEVAL:
+            (rephrased_question, is_followup), speculative = await asyncio.gather(
+                _rephrase(question, prev_llm_answer, headers, user_id, thread_id),
+                _embed_and_search(question, top_k, category, regional))
+        else:
+            rephrased_question, is_followup = await _rephrase(question, prev_llm_answer, headers, user_id, thread_id)
+
+    if speculative and not is_followup and 'vector' in speculative:
+        vector = speculative['vector']
+    else:
+        try:
+            vector = await get_embedding(rephrased_question)
+        except Exception as e:
+            return {'error': f'OpenAI API error: {e}'}
+
+    return await asyncio.to_thread(llm_service._retrieve, question, rephrased_question, is_followup, vector,
+                                   speculative, memory, headers, category, top_k, regional, use_cache)
+
+async def ask_llm_with_faiss_async(question, category, user_id="default", thread_id="default", top_k=3, security_api_key=None, regional=None, use_cache=True):
+    """Sama dengan llm_service.ask_llm_with_faiss (input dan dict hasil), tanpa memblokir event loop."""
+    with tracing.trace('answer_async', category=category, user_id=user_id, thread_id=thread_id) as trace:
+        result = await _ask_llm_with_faiss_async(question, category, user_id, thread_id, top_k, security_api_key, regional, use_cache)
+        if result.get('error'):
+            trace.annotate(status='error', error=result['error'])
+        trace.annotate(cached=result.get('cached'))
+    result['trace'] = trace.summary()
+    return result
+
+async def _ask_llm_with_faiss_async(question, category, user_id, thread_id, top_k, security_api_key, regional, use_cache):
+    try:
+        state = await _prepare_answer(question, category, user_id, thread_id, top_k, regional, use_cache)
+        if 'memory' not in state:
+            return state
+        cached = state['cached']
+
+        llm_answer = None
+        if cached:
+            llm_answer = cached['llm_answer']
+        elif state['prompt']:
+            with tracing.span('chat_completion'):
+                resp = await client().post(llm_service._chat_url(), headers=state['headers'],
+                                           json=llm_service._answer_payload(state['prompt']))
+            if resp.status_code == 200:
+                data = resp.json()
+                llm_answer = data['choices'][0]['message']['content'].strip()
+                llm_service._report_usage(data.get('usage'), data.get('model'), user_id, thread_id,
+                                          {'type': 'answer', 'top_k': top_k, 'category': category})
+                llm_service._store_answer(state, category, regional, use_cache, llm_answer)
+            else:
+                llm_answer = f"[OpenAI API error: {resp.text}]"
+        await asyncio.to_thread(llm_service._save_memory, state, user_id, thread_id, llm_answer)
+
+        return {
+            'llm_answer': llm_answer,
+            'results': state['results'],
+            'error': state['error'],
+            'prompt': state['prompt'],
+            'cached': bool(cached)
+        }
+    except Exception as e:
+        import traceback
+        print(f"[LLM_ASYNC][FATAL_ERROR] {e}\n{traceback.format_exc()}", file=sys.stderr)
+        return {'error': f'LLM Service Fatal Error: {e}'}
@@ -1,6 +1,13 @@
 import os
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from . import tracing
 
 # Ensure .env is loaded from app directory to make OPENAI_API_KEY available
 try:
@@ -9,168 +16,600 @@ try:
 except Exception:
     pass
 
-def ask_llm_with_faiss(question, category, user_id="default", thread_id="default", top_k=3, security_api_key=None, regional=None):
-    import sys
-    try:
-        # --- SECURITY API KEY CHECK (opsional) ---
-        # SECURITY_API_KEY =1245
-        # if SECURITY_API_KEY and security_api_key != SECURITY_API_KEY:
-        #     return {'error': 'Unauthorized: Invalid security_api_key' }
+# Batas waktu menunggu potongan berikutnya dari stream chat completions
+LLM_STREAM_TIMEOUT = float(os.getenv('LLM_STREAM_TIMEOUT', '60'))
+# Follow-up: embedding + FAISS search pertanyaan asli berjalan paralel dengan panggilan rephrase
+LLM_SPECULATIVE_RETRIEVAL = os.getenv('LLM_SPECULATIVE_RETRIEVAL', '1') == '1'
+_rephrase_pool = ThreadPoolExecutor(max_workers=int(os.getenv('LLM_REPHRASE_CONCURRENCY', '8')),
+                                    thread_name_prefix='rephrase')
+# /answer/batch: jumlah chat completions yang berjalan bersamaan, dan batas pertanyaan per request
+LLM_BATCH_CONCURRENCY = int(os.getenv('LLM_BATCH_CONCURRENCY', '8'))
+LLM_BATCH_MAX_QUESTIONS = int(os.getenv('LLM_BATCH_MAX_QUESTIONS', '1000'))
+# Satu session keep-alive untuk semua panggilan OpenAI (bukan koneksi TLS baru per request)
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_maxsize=max(LLM_BATCH_CONCURRENCY, 10))
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
 
-        from . import faiss_service
-
-        # Load memory thread
-        memory = faiss_service.load_thread(user_id, thread_id)
-        is_followup = False
-        prev_llm_answer = None
-        if question and len(memory) > 0:
-            prev_entry = memory[-1]
-            prev_llm_answer = prev_entry.get('a')
-            is_followup = True
-
-        # --- REPHRASE ---
-        rephrased_question = question
-        if is_followup and prev_llm_answer:
-            openai_api_key = os.environ.get('OPENAI_API_KEY')
-            if not openai_api_key:
-                return {'error': 'OPENAI_API_KEY is not set in environment'}
-            headers = {
-                'Authorization': f'Bearer {openai_api_key}',
-                'Content-Type': 'application/json'
-            }
-            rephrase_prompt = (
-                "Tentukan apakah pertanyaan berikut ini merupakan lanjutan (follow-up) dari pertanyaan sebelumnya atau merupakan pertanyaan baru yang tidak berkaitan. "
-                "Jika follow-up, buat ulang pertanyaan agar lebih spesifik berdasarkan jawaban sebelumnya. "
-                "Jika pertanyaan baru, jawab dengan: 'PERTANYAAN BARU'.\n\n"
-                f"Jawaban sebelumnya: {prev_llm_answer}\n\nPertanyaan baru: {question}\n\nOutput:"
-            )
-            chat_payload = {
-                'model': 'gpt-4',
-                'messages': [
-                    {"role": "system", "content": "Anda adalah asisten AI yang membantu membuat ulang pertanyaan agar lebih spesifik berdasarkan jawaban sebelumnya."},
-                    {"role": "user", "content": rephrase_prompt}
-                ],
-                'max_tokens': 128,
-                'temperature': 0.2
-            }
-
-            resp = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=chat_payload)
-            if resp.status_code == 200:
-                rephrase_result = resp.json()['choices'][0]['message']['content'].strip()
-                # capture usage for rephrase call (small)
-                try:
-                    usage = resp.json().get('usage') or {}
-                    total_tokens = usage.get('total_tokens') or 0
-                    model = resp.json().get('model') or 'gpt-4'
-                    portal_url = os.environ.get('PORTAL_API_URL')  # e.g. http://127.0.0.1:8000/api
-                    if portal_url and total_tokens:
-                        requests.post(f"{portal_url}/tokens/usage", json={
-                            'model': model,
-                            'tokens': int(total_tokens),
-                            'user_id': user_id,
-                            'thread_id': thread_id,
-                            'meta': {'type': 'rephrase-detection'}
-                        }, timeout=3)
-                except Exception:
-                    pass
-                if rephrase_result.strip().upper() == 'PERTANYAAN BARU':
-                    is_followup = False
-                    rephrased_question = question
-                else:
-                    is_followup = True
-                    rephrased_question = rephrase_result
-            else:
-                rephrased_question = question + " (catatan: gagal rephrase)"
-
-        # --- EMBEDDING ---
-        openai_api_key = os.environ.get('OPENAI_API_KEY')
-        if not openai_api_key:
-            return {'error': 'OPENAI_API_KEY is not set in environment'}
-        headers = {
-            'Authorization': f'Bearer {openai_api_key}',
-            'Content-Type': 'application/json'
-        }
-        embed_payload = {
-            'input': rephrased_question,
-            'model': 'text-embedding-3-small'
-        }
-        resp = requests.post('https://api.openai.com/v1/embeddings', headers=headers, json=embed_payload)
-        if resp.status_code != 200:
-            return {'error': f'OpenAI API error: {resp.text}'}
-        vector = resp.json()['data'][0]['embedding']
+def _chat_url():
+    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com")
+    return f'{base_url}/v1/chat/completions'
 
-        # Simpan pertanyaan ke memory
-        if question:
-            mem_entry = {'q': question}
-            if is_followup:
-                mem_entry['rephrased'] = rephrased_question
-            memory.append(mem_entry)
+def _openai_headers():
+    openai_api_key = os.environ.get('OPENAI_API_KEY')
+    if not openai_api_key:
+        return None
+    return {
+        'Authorization': f'Bearer {openai_api_key}',
+        'Content-Type': 'application/json'
+    }
 
-        # --- FAISS SEARCH ---
+def _report_usage(usage, model, user_id, thread_id, meta):
+    """Laporkan pemakaian token ke portal (PORTAL_API_URL) lewat telemetry outbox, tanpa menunggu."""
+    from . import telemetry_outbox
+    tracing.record_tokens((meta or {}).get('type') or 'answer', usage)
+    total_tokens = (usage or {}).get('total_tokens') or 0
+    if total_tokens:
+        with tracing.span('portal_enqueue'):
+            telemetry_outbox.enqueue('/tokens/usage', {
+                'model': model or 'gpt-4',
+                'tokens': int(total_tokens),
+                'user_id': user_id,
+                'thread_id': thread_id,
+                'meta': meta
+            })
+
+def _rephrase_payload(question, prev_llm_answer):
+    rephrase_prompt = (
+        "Tentukan apakah pertanyaan berikut ini merupakan lanjutan (follow-up) dari pertanyaan sebelumnya atau merupakan pertanyaan baru yang tidak berkaitan. "
+        "Jika follow-up, buat ulang pertanyaan agar lebih spesifik berdasarkan jawaban sebelumnya. "
+        "Jika pertanyaan baru, jawab dengan: 'PERTANYAAN BARU'.\n\n"
+        f"Jawaban sebelumnya: {prev_llm_answer}\n\nPertanyaan baru: {question}\n\nOutput:"
+    )
+    chat_payload = {
+        'model': 'gpt-4',
+        'messages': [
+            {"role": "system", "content": "Anda adalah asisten AI yang membantu membuat ulang pertanyaan agar lebih spesifik berdasarkan jawaban sebelumnya."},
+            {"role": "user", "content": rephrase_prompt}
+        ],
+        'max_tokens': 128,
+        'temperature': 0.2
+    }
+    return chat_payload
+
+def _rephrase_outcome(question, status_code, data):
+    """Hasil deteksi follow-up dari response chat: (rephrased_question, is_followup)."""
+    if status_code != 200:
+        return question + " (catatan: gagal rephrase)", True
+    rephrase_result = data['choices'][0]['message']['content'].strip()
+    if rephrase_result.strip().upper() == 'PERTANYAAN BARU':
+        return question, False
+    return rephrase_result, True
+
+def _rephrase(question, prev_llm_answer, headers, user_id, thread_id):
+    """Deteksi follow-up; return (rephrased_question, is_followup)."""
+    with tracing.span('rephrase') as span:
+        try:
+            resp = _session.post(_chat_url(), headers=headers, json=_rephrase_payload(question, prev_llm_answer),
+                                 timeout=(10, LLM_STREAM_TIMEOUT))
+        except requests.RequestException as e:
+            # Rephrase hanya penyempurnaan: kalau gagal/timeout, lanjut dengan pertanyaan asli
+            print(f"[LLM] Rephrase gagal, pakai pertanyaan asli: {e}", file=sys.stderr)
+            span['error'] = type(e).__name__
+            return question, False
+    data = resp.json() if resp.status_code == 200 else None
+    if data:
+        # capture usage for rephrase call (small)
+        _report_usage(data.get('usage'), data.get('model'), user_id, thread_id, {'type': 'rephrase-detection'})
+    return _rephrase_outcome(question, resp.status_code, data)
+
+def _answer_payload(prompt, stream=False):
+    chat_payload = {
+        'model': 'gpt-4',
+        'messages': [
+            {"role": "system", "content": "Anda adalah asisten AI yang hanya boleh menjawab berdasarkan context yang diberikan."},
+            {"role": "user", "content": prompt}
+        ],
+        'max_tokens': 512,
+        'temperature': 0.2
+    }
+    if stream:
+        chat_payload['stream'] = True
+        # Chunk terakhir membawa usage, dipakai untuk laporan token ke portal
+        chat_payload['stream_options'] = {'include_usage': True}
+    return chat_payload
+
+def category_param(value):
+    """kategori dari request: satu nama, atau list nama untuk search lintas kategori (None jika kosong)."""
+    if isinstance(value, (list, tuple)):
+        names = list(dict.fromkeys(str(v).strip() for v in value if v is not None and str(v).strip()))
+        if len(names) <= 1:
+            return names[0] if names else None
+        return names
+    return value
+
+def _search(vector, top_k, category, regional, query=None):
+    """FAISS search (hybrid dengan BM25 bila query diberikan); return (results, error).
+
+    category boleh berupa list: search_multi mencari di semua kategori itu
+    sekaligus (vector saja, tanpa BM25).
+    """
+    from . import faiss_service
+    with tracing.span('search') as span:
         try:
-            results = faiss_service.search(vector, top_k, category=category)
-            # Optional regional filter – if provided, filter results where metadata.regional matches (case-insensitive contains)
-            if regional:
-                rlow = str(regional).lower()
-                results = [r for r in (results or []) if str(r.get('regional','')).lower().find(rlow) >= 0]
-            error = ""
+            if isinstance(category, (list, tuple)):
+                return faiss_service.search_multi(vector, category, top_k, regional=regional, timings=span), ""
+            # Filter regional (case-insensitive contains) diterapkan di dalam FAISS search,
+            # sehingga hasilnya tetap top_k dari chunk regional tersebut
+            if query and faiss_service.HYBRID_SEARCH:
+                return faiss_service.search_hybrid(vector, query, top_k, category=category, regional=regional, timings=span), ""
+            return faiss_service.search(vector, top_k, category=category, regional=regional), ""
         except Exception as e:
             print(f"[LLM_SERVICE][FAISS_SEARCH_ERROR] {e}", file=sys.stderr)
-            results = []
-            error = str(e)
+            span['error'] = str(e)
+            return [], str(e)
 
-        # --- CONTEXT DARI FAISS ---
-        if results and isinstance(results, list) and len(results) > 0 and isinstance(results[0], dict) and 'text' in results[0]:
-            context = '\n\n---\n\n'.join([r['text'] for r in results if 'text' in r])
+def _hybrid(category):
+    """True if a search of category uses hybrid BM25 + vector retrieval (see _search)."""
+    from . import faiss_service
+    return faiss_service.HYBRID_SEARCH and not isinstance(category, (list, tuple))
+
+def _embed_and_search(question, top_k, category, regional):
+    """Retrieval spekulatif untuk pertanyaan asli; return {'vector', 'results'} (kosong jika gagal)."""
+    from . import embedding_service
+    try:
+        vector = embedding_service.get_embedding(question)
+    except Exception as e:
+        print(f"[LLM_SERVICE] Embedding spekulatif gagal: {e}", file=sys.stderr)
+        return {}
+    results, error = _search(vector, top_k, category, regional, question)
+    return {'vector': vector} if error else {'vector': vector, 'results': results}
+
+def _merge_results(primary, secondary, top_k):
+    """Gabung hasil search, bergantian mulai dari primary, tanpa chunk ganda; paling banyak top_k."""
+    merged, seen = [], set()
+    for i in range(max(len(primary), len(secondary))):
+        for results in (primary, secondary):
+            if i >= len(results):
+                continue
+            r = results[i]
+            key = (r.get('source'), r.get('chunk_index'), r.get('text'))
+            if key not in seen:
+                seen.add(key)
+                merged.append(r)
+    return merged[:top_k]
+
+def _build_prompt(results, question):
+    """Prompt GPT-4: context dari hasil FAISS search, lalu pertanyaannya."""
+    # --- CONTEXT DARI FAISS ---
+    if results and isinstance(results, list) and len(results) > 0 and isinstance(results[0], dict) and 'text' in results[0]:
+        context = '\n\n---\n\n'.join([r['text'] for r in results if 'text' in r])
+    else:
+        context = ''
+    return f"Jawablah pertanyaan berikut hanya berdasarkan context di bawah ini. Jika tidak ada jawaban di context, jawab 'Maaf, tidak ditemukan jawaban yang relevan.'\n\nContext:\n{context}\n\nPertanyaan:\n{question}\n\nJawaban:"
+
+def _load_memory(question, user_id, thread_id):
+    """Memory thread (THREAD_HISTORY_TURNS giliran terakhir); return (memory, prev_llm_answer, is_followup)."""
+    from . import thread_store
+    with tracing.span('thread_load'):
+        memory = thread_store.recent(user_id, thread_id)
+    is_followup = False
+    prev_llm_answer = None
+    if question and len(memory) > 0:
+        prev_entry = memory[-1]
+        prev_llm_answer = prev_entry.get('a')
+        is_followup = True
+    return memory, prev_llm_answer, is_followup
+
+def _retrieve(question, rephrased_question, is_followup, vector, speculative, memory, headers,
+              category, top_k, regional, use_cache):
+    """Langkah lokal setelah embedding: memory, answer cache, FAISS search, prompt; return dict state."""
+    from . import faiss_service, answer_cache
+
+    # Simpan pertanyaan ke memory
+    mem_entry = None
+    if question:
+        mem_entry = {'q': question}
+        if is_followup:
+            mem_entry['rephrased'] = rephrased_question
+        memory.append(mem_entry)
+
+    # --- SEMANTIC ANSWER CACHE ---
+    # Pertanyaan yang mirip (cosine >= threshold) untuk kategori/regional dan versi index yang sama
+    # langsung memakai jawaban sebelumnya, tanpa FAISS search dan GPT-4
+    cache_scope = answer_cache.scope(category, regional, rephrased_question, top_k, _hybrid(category))
+    with tracing.span('answer_cache') as span:
+        index_version = faiss_service.index_version(category)
+        cached = None
+        if use_cache:
+            cached = answer_cache.lookup(cache_scope, vector, index_version)
         else:
-            context = ''
+            answer_cache.record_bypass()
+        span['hit'] = bool(cached)
+
+    # --- FAISS SEARCH ---
+    error = ""
+    if cached:
+        results = cached['results']
+    elif speculative and not is_followup and 'results' in speculative:
+        results = speculative['results']
+    else:
+        results, error = _search(vector, top_k, category, regional, rephrased_question or question)
+        if speculative and speculative.get('results') and not error:
+            results = _merge_results(results, speculative['results'], top_k)
+
+    prompt = None
+    if cached:
+        prompt = cached['prompt']
+    elif rephrased_question:
+        prompt = _build_prompt(results, rephrased_question)
+
+    return {
+        'memory': memory,
+        'turn': mem_entry,
+        'headers': headers,
+        'vector': vector,
+        'index_version': index_version,
+        'cache_scope': cache_scope,
+        'cached': cached,
+        'results': results,
+        'error': error,
+        'prompt': prompt,
+    }
+
+def _prepare_answer(question, category, user_id, thread_id, top_k, regional, use_cache):
+    """Semua langkah sebelum GPT-4 menjawab: memory, rephrase, embedding, cache, FAISS search, prompt.
+
+    Return dict state, atau {'error': ...} jika gagal sebelum search.
+    """
+    from . import embedding_service
+
+    # Load memory thread
+    memory, prev_llm_answer, is_followup = _load_memory(question, user_id, thread_id)
+
+    headers = _openai_headers()
+    if not headers:
+        return {'error': 'OPENAI_API_KEY is not set in environment'}
+
+    # --- REPHRASE (+ retrieval spekulatif) ---
+    # Selama GPT-4 memutuskan follow-up atau bukan, pertanyaan asli sudah di-embed dan dicari.
+    # Jika jawabannya 'PERTANYAAN BARU' hasil itu langsung dipakai; jika follow-up,
+    # hasilnya digabung dengan search pertanyaan hasil rephrase.
+    rephrased_question = question
+    speculative = None
+    if is_followup and prev_llm_answer:
+        if LLM_SPECULATIVE_RETRIEVAL:
+            pending = _rephrase_pool.submit(tracing.wrap(_rephrase), question, prev_llm_answer, headers, user_id, thread_id)
+            try:
+                speculative = _embed_and_search(question, top_k, category, regional)
+            finally:
+                rephrased_question, is_followup = pending.result()
+        else:
+            rephrased_question, is_followup = _rephrase(question, prev_llm_answer, headers, user_id, thread_id)
+
+    # --- EMBEDDING ---
+    # Lewat embedding_service agar memakai cache embedding yang sama dengan proses upload
+    if speculative and not is_followup and 'vector' in speculative:
+        vector = speculative['vector']
+    else:
+        try:
+            vector = embedding_service.get_embedding(rephrased_question)
+        except Exception as e:
+            return {'error': f'OpenAI API error: {e}'}
+
+    return _retrieve(question, rephrased_question, is_followup, vector, speculative, memory, headers,
+                     category, top_k, regional, use_cache)
+
+def _store_answer(state, category, regional, use_cache, llm_answer):
+    from . import answer_cache
+    if use_cache and not state['error']:
+        answer_cache.store(state['cache_scope'], state['vector'], state['index_version'],
+                           {'llm_answer': llm_answer, 'results': state['results'], 'prompt': state['prompt']})
+
+def _save_memory(state, user_id, thread_id, llm_answer):
+    from . import thread_store
+    # Tambahkan giliran ini (pertanyaan + jawaban LLM) ke log thread
+    turn = state.get('turn')
+    if turn is not None:
+        turn['a'] = llm_answer
+        with tracing.span('thread_save'):
+            thread_store.append_turn(user_id, thread_id, turn)
+
+def ask_llm_with_faiss(question, category, user_id="default", thread_id="default", top_k=3, security_api_key=None, regional=None, use_cache=True):
+    """Jawab satu pertanyaan; dict hasil juga membawa 'trace' (timing per tahap, lihat tracing)."""
+    with tracing.trace('answer', category=category, user_id=user_id, thread_id=thread_id) as trace:
+        result = _ask_llm_with_faiss(question, category, user_id, thread_id, top_k, security_api_key, regional, use_cache)
+        if result.get('error'):
+            trace.annotate(status='error', error=result['error'])
+        trace.annotate(cached=result.get('cached'))
+    result['trace'] = trace.summary()
+    return result
+
+def _ask_llm_with_faiss(question, category, user_id, thread_id, top_k, security_api_key, regional, use_cache):
+    try:
+        # --- SECURITY API KEY CHECK (opsional) ---
+        # SECURITY_API_KEY =1245
+        # if SECURITY_API_KEY and security_api_key != SECURITY_API_KEY:
+        #     return {'error': 'Unauthorized: Invalid security_api_key' }
+
+        state = _prepare_answer(question, category, user_id, thread_id, top_k, regional, use_cache)
+        if 'memory' not in state:
+            return state
+        cached = state['cached']
 
         # --- LLM NARASI ---
         llm_answer = None
-        if rephrased_question:
-            prompt = f"Jawablah pertanyaan berikut hanya berdasarkan context di bawah ini. Jika tidak ada jawaban di context, jawab 'Maaf, tidak ditemukan jawaban yang relevan.'\n\nContext:\n{context}\n\nPertanyaan:\n{rephrased_question}\n\nJawaban:"
-            chat_payload = {
-                'model': 'gpt-4',
-                'messages': [
-                    {"role": "system", "content": "Anda adalah asisten AI yang hanya boleh menjawab berdasarkan context yang diberikan."},
-                    {"role": "user", "content": prompt}
-                ],
-                'max_tokens': 512,
-                'temperature': 0.2
-            }
-            resp = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=chat_payload)
+        if cached:
+            llm_answer = cached['llm_answer']
+        elif state['prompt']:
+            with tracing.span('chat_completion'):
+                resp = _session.post(_chat_url(), headers=state['headers'], json=_answer_payload(state['prompt']))
             if resp.status_code == 200:
-                llm_answer = resp.json()['choices'][0]['message']['content'].strip()
+                data = resp.json()
+                llm_answer = data['choices'][0]['message']['content'].strip()
                 # capture usage for main answer
-                try:
-                    usage = resp.json().get('usage') or {}
-                    total_tokens = usage.get('total_tokens') or 0
-                    model = resp.json().get('model') or 'gpt-4'
-                    portal_url = os.environ.get('PORTAL_API_URL')  # e.g. http://127.0.0.1:8000/api
-                    if portal_url and total_tokens:
-                        requests.post(f"{portal_url}/tokens/usage", json={
-                            'model': model,
-                            'tokens': int(total_tokens),
-                            'user_id': user_id,
-                            'thread_id': thread_id,
-                            'meta': {'type': 'answer', 'top_k': top_k, 'category': category}
-                        }, timeout=3)
-                except Exception:
-                    pass
+                _report_usage(data.get('usage'), data.get('model'), user_id, thread_id,
+                              {'type': 'answer', 'top_k': top_k, 'category': category})
+                _store_answer(state, category, regional, use_cache, llm_answer)
             else:
                 llm_answer = f"[OpenAI API error: {resp.text}]"
-        # Simpan jawaban LLM ke memory jika ada entry
-        if memory:
-            memory[-1]['a'] = llm_answer
-            faiss_service.save_thread(user_id, thread_id, memory)
+        _save_memory(state, user_id, thread_id, llm_answer)
 
         return {
             'llm_answer': llm_answer,
-            'results': results,
-            'error': error,
-            'prompt':prompt
+            'results': state['results'],
+            'error': state['error'],
+            'prompt': state['prompt'],
+            'cached': bool(cached)
         }
     except Exception as e:
         import traceback
         print(f"[LLM_SERVICE][FATAL_ERROR] {e}\n{traceback.format_exc()}", file=sys.stderr)
         return {'error': f'LLM Service Fatal Error: {e}'}
+
+def _iter_chat_stream(resp):
+    """Parse SSE dari chat completions (stream: true); yield dict tiap chunk."""
+    for line in resp.iter_lines(chunk_size=None):
+        if not line or not line.startswith(b'data:'):
+            continue
+        data = line[5:].strip()
+        if data == b'[DONE]':
+            break
+        yield json.loads(data)
+
+def stream_llm_with_faiss(question, category, user_id="default", thread_id="default", top_k=3, security_api_key=None, regional=None, use_cache=True):
+    """Versi streaming dari ask_llm_with_faiss.
+
+    Generator (event, data): 'sources' segera setelah FAISS search, lalu 'delta'
+    per potongan jawaban GPT-4, dan terakhir 'done' (atau 'error'). Memory thread
+    disimpan dan usage token dilaporkan saat stream selesai. 'done' membawa
+    'trace' (timing per tahap, lihat tracing).
+    """
+    # Generator: trace hanya aktif di bagian sync di antara yield, bukan selama yield
+    trace = tracing.Trace('answer_stream', category=category, user_id=user_id, thread_id=thread_id)
+    try:
+        with trace.activate():
+            state = _prepare_answer(question, category, user_id, thread_id, top_k, regional, use_cache)
+    except Exception as e:
+        import traceback
+        print(f"[LLM_SERVICE][FATAL_ERROR] {e}\n{traceback.format_exc()}", file=sys.stderr)
+        trace.finish('error', error=str(e))
+        yield 'error', {'error': f'LLM Service Fatal Error: {e}'}
+        return
+    if 'memory' not in state:
+        trace.finish('error', error=state.get('error'))
+        yield 'error', state
+        return
+    cached = state['cached']
+    yield 'sources', {'results': state['results'], 'error': state['error'], 'cached': bool(cached)}
+
+    if cached:
+        llm_answer = cached['llm_answer']
+        with trace.activate():
+            _save_memory(state, user_id, thread_id, llm_answer)
+        yield 'delta', {'content': llm_answer}
+        yield 'done', {'answer': llm_answer, 'prompt': state['prompt'], 'cached': True, 'usage': None,
+                       'trace': trace.finish(cached=True)}
+        return
+    if not state['prompt']:
+        with trace.activate():
+            _save_memory(state, user_id, thread_id, None)
+        yield 'done', {'answer': None, 'prompt': None, 'cached': False, 'usage': None, 'trace': trace.finish()}
+        return
+
+    parts = []
+    usage = None
+    model = None
+    finished = False
+    resp = None
+    chat_start = time.perf_counter()
+    first_token = None
+    try:
+        resp = _session.post(_chat_url(), headers=state['headers'], json=_answer_payload(state['prompt'], stream=True),
+                             stream=True, timeout=(10, LLM_STREAM_TIMEOUT))
+        if resp.status_code != 200:
+            llm_answer = f"[OpenAI API error: {resp.text}]"
+            with trace.activate():
+                _save_memory(state, user_id, thread_id, llm_answer)
+            finished = True
+            trace.add_span('chat_completion', chat_start, time.perf_counter(), status=resp.status_code)
+            trace.finish('error', error=llm_answer)
+            yield 'error', {'error': llm_answer}
+            return
+        for chunk in _iter_chat_stream(resp):
+            model = chunk.get('model') or model
+            if chunk.get('usage'):
+                usage = chunk['usage']
+            for choice in chunk.get('choices') or []:
+                piece = (choice.get('delta') or {}).get('content')
+                if piece:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    parts.append(piece)
+                    yield 'delta', {'content': piece}
+        trace.add_span('chat_completion', chat_start, time.perf_counter(),
+                       first_token_ms=round((first_token - chat_start) * 1000, 2) if first_token else None)
+        llm_answer = ''.join(parts).strip()
+        with trace.activate():
+            _report_usage(usage, model, user_id, thread_id, {'type': 'answer', 'top_k': top_k, 'category': category, 'stream': True})
+            _store_answer(state, category, regional, use_cache, llm_answer)
+            _save_memory(state, user_id, thread_id, llm_answer)
+        finished = True
+        yield 'done', {'answer': llm_answer, 'prompt': state['prompt'], 'cached': False, 'usage': usage,
+                       'trace': trace.finish()}
+    except Exception as e:
+        print(f"[LLM_SERVICE][STREAM_ERROR] {e}", file=sys.stderr)
+        if not finished:
+            with trace.activate():
+                _save_memory(state, user_id, thread_id, ''.join(parts).strip() or f"[OpenAI API error: {e}]")
+            finished = True
+        trace.finish('error', error=str(e))
+        yield 'error', {'error': f'OpenAI API error: {e}'}
+    finally:
+        # Client putus di tengah stream (GeneratorExit): simpan jawaban parsial dan tutup koneksi upstream
+        if not finished:
+            with trace.activate():
+                _save_memory(state, user_id, thread_id, ''.join(parts).strip())
+        if resp is not None:
+            resp.close()
+        trace.finish('aborted')
+
+def _batch_search(vectors, questions, top_k, category, regional):
+    """FAISS search untuk semua pertanyaan batch; return (list hasil per pertanyaan, error)."""
+    from . import faiss_service
+    try:
+        if isinstance(category, (list, tuple)):
+            return faiss_service.search_multi_batch(vectors, category, top_k, regional=regional), ""
+        return faiss_service.search_batch(vectors, top_k, category=category, regional=regional,
+                                          queries=questions if faiss_service.HYBRID_SEARCH else None), ""
+    except Exception as e:
+        print(f"[LLM_SERVICE][FAISS_SEARCH_ERROR] {e}", file=sys.stderr)
+        return [[] for _ in vectors], str(e)
+
+def _batch_chat(i, prompt, headers):
+    start = time.perf_counter()
+    try:
+        resp = _session.post(_chat_url(), headers=headers, json=_answer_payload(prompt), timeout=LLM_STREAM_TIMEOUT)
+    except requests.RequestException as e:
+        return i, None, None, f'OpenAI API error: {e}', (time.perf_counter() - start) * 1000
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if resp.status_code != 200:
+        return i, None, None, f'OpenAI API error: {resp.text}', elapsed_ms
+    data = resp.json()
+    return i, data['choices'][0]['message']['content'].strip(), data, '', elapsed_ms
+
+def batch_answer_with_faiss(questions, category, user_id="default", top_k=3, regional=None, use_cache=True, concurrency=None):
+    """Jawab banyak pertanyaan lepas sekaligus (evaluasi regresi), tanpa memory thread dan rephrase.
+
+    Pertanyaan di-embed per batch EMBED_BATCH_SIZE (EMBED_CONCURRENCY batch
+    paralel, seperti upload) dan dicari dengan satu FAISS search atas matriks
+    query per kategori; chat completions berjalan
+    paling banyak concurrency (LLM_BATCH_CONCURRENCY) sekaligus. Generator:
+    satu dict {'type': 'result', 'index', 'question', 'answer', ...} per
+    pertanyaan segera setelah jawabannya ada (urutan selesai, bukan urutan
+    input), lalu {'type': 'summary', ...} berisi timing total; atau satu
+    {'type': 'error', 'error'} jika gagal sebelum search.
+    """
+    from . import embedding_service, faiss_service, answer_cache
+    started = time.perf_counter()
+    questions = [str(q or '') for q in questions]
+    trace = tracing.Trace('answer_batch', category=category, questions=len(questions))
+    headers = _openai_headers()
+    if not headers:
+        trace.finish('error', error='OPENAI_API_KEY is not set in environment')
+        yield {'type': 'error', 'error': 'OPENAI_API_KEY is not set in environment'}
+        return
+
+    # --- EMBEDDING (batch paralel, lihat embedding_service.get_embeddings) ---
+    start = time.perf_counter()
+    try:
+        with trace.activate():
+            vectors = embedding_service.get_embeddings(questions)
+    except Exception as e:
+        trace.finish('error', error=str(e))
+        yield {'type': 'error', 'error': f'OpenAI API error: {e}'}
+        return
+    embed_ms = (time.perf_counter() - start) * 1000
+
+    # --- ANSWER CACHE + FAISS SEARCH (satu search untuk semua yang tidak ada di cache) ---
+    start = time.perf_counter()
+    with trace.activate():
+        index_version = faiss_service.index_version(category)
+        scopes = [answer_cache.scope(category, regional, q, top_k, _hybrid(category)) for q in questions]
+        cached = [None] * len(questions)
+        if use_cache:
+            cached = [answer_cache.lookup(scopes[i], v, index_version) for i, v in enumerate(vectors)]
+        else:
+            answer_cache.record_bypass()
+        results = [c['results'] if c else None for c in cached]
+        todo = [i for i, c in enumerate(cached) if not c]
+        search_error = ""
+        if todo:
+            found, search_error = _batch_search(np.asarray([vectors[i] for i in todo], dtype='float32'),
+                                                [questions[i] for i in todo], top_k, category, regional)
+            for i, rows in zip(todo, found):
+                results[i] = rows
+    search_ms = (time.perf_counter() - start) * 1000
+
+    def record(i, answer, error='', chat_ms=0.0):
+        return {'type': 'result', 'index': i, 'question': questions[i], 'answer': answer,
+                'results': results[i], 'error': error, 'cached': bool(cached[i]), 'chat_ms': round(chat_ms, 1)}
+
+    counts = {'answered': 0, 'cached': 0, 'errors': 0}
+    chat_latencies = []
+    tokens = 0
+    for i, c in enumerate(cached):
+        if c:
+            counts['cached'] += 1
+            yield record(i, c['llm_answer'])
+
+    # --- LLM NARASI (concurrency terbatas) ---
+    start = time.perf_counter()
+    if todo:
+        prompts = {i: _build_prompt(results[i], questions[i]) for i in todo}
+        workers = max(1, min(int(concurrency or LLM_BATCH_CONCURRENCY), len(todo)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='answer-batch') as pool:
+            futures = [pool.submit(_batch_chat, i, prompts[i], headers) for i in todo]
+            try:
+                for fut in as_completed(futures):
+                    i, answer, data, error, chat_ms = fut.result()
+                    chat_latencies.append(chat_ms)
+                    if error:
+                        counts['errors'] += 1
+                        yield record(i, None, error, chat_ms)
+                        continue
+                    usage = data.get('usage') or {}
+                    tokens += usage.get('total_tokens') or 0
+                    _report_usage(usage, data.get('model'), user_id, None,
+                                  {'type': 'answer-batch', 'top_k': top_k, 'category': category})
+                    if use_cache and not search_error:
+                        answer_cache.store(scopes[i], vectors[i], index_version,
+                                           {'llm_answer': answer, 'results': results[i], 'prompt': prompts[i]})
+                    counts['answered'] += 1
+                    yield record(i, answer, search_error, chat_ms)
+            except GeneratorExit:
+                trace.finish('aborted', **counts)
+                raise
+            finally:
+                # Client putus: jangan mulai chat completions yang belum berjalan
+                for fut in futures:
+                    fut.cancel()
+        trace.add_span('chat_completion', start, time.perf_counter(), questions=len(todo))
+    chat_ms = (time.perf_counter() - start) * 1000
+
+    lat = sorted(chat_latencies)
+    trace.finish('error' if search_error or counts['errors'] else 'ok', **counts)
+    yield {
+        'type': 'summary',
+        'trace_id': trace.id,
+        'questions': len(questions),
+        **counts,
+        'search_error': search_error,
+        'tokens': tokens,
+        'embed_ms': round(embed_ms, 1),
+        'search_ms': round(search_ms, 1),
+        'chat_ms': round(chat_ms, 1),
+        'chat_p50_ms': round(lat[len(lat) // 2], 1) if lat else None,
+        'chat_p95_ms': round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 1) if lat else None,
+        'total_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
@@ -0,0 +1,524 @@
+"""Columnar chunk metadata store (replaces the pickled list of dicts).
+
+A kategori's metadata lives next to its FAISS index as:
+
+    meta_<kategori>.json              header: row count, dictionaries, generation
+    meta_<kategori>.<gen>.<col>.bin   one fixed-width numpy column per field
+    meta_<kategori>.<gen>.text.bin    all chunk texts, UTF-8, back to back
+
+source, kategori and regional are dictionary-encoded (the header holds the
+distinct strings, the column holds uint32 codes). Chunk text is addressed
+through the text_start/text_len columns. Readers memory-map the columns and
+decode only the rows they are asked for, so opening a kategori costs the
+header and nothing else.
+
+Every row has a stable int64 id (the id column, ascending in row order; the
+FAISS index stores the same ids). The header keeps next_id, the id ranges of
+each source (id_ranges) and the id ranges deleted but not yet compacted
+away (tombstones). Deleting a source only moves its ranges from id_ranges to
+tombstones; stage_select later drops the tombstoned rows for good. Appends
+made for an ingest job also record their id range under the job id
+(job_ranges), so a retried job can drop exactly the rows it wrote before.
+
+Appends write past the committed end of the current generation's files and
+then replace the header, so a reader never sees a partially written row.
+Full rewrites (compaction) go to a new generation and switch over the same way.
+The stage_* functions do the column writes without committing a header, so
+faiss_service can commit the header together with the index in one snapshot.
+
+Migrate existing pickles once with:
+
+    python -m services.meta_store [vector_dir]
+"""
+import os
+import sys
+import json
+import glob
+import pickle
+import numpy as np
+
+FORMAT = 'rag-columnar-meta'
+DICT_COLUMNS = ('source', 'kategori', 'regional')
+INT_COLUMNS = {'chunk_index': 'int32', 'page': 'int32'}
+# Nilai untuk baris tanpa field tersebut (page: -1 = halaman tidak diketahui, misal data lama)
+INT_DEFAULTS = {'chunk_index': 0, 'page': -1}
+TEXT_COLUMNS = {'text_start': 'uint64', 'text_len': 'uint32'}
+# Generasi lama tanpa kolom id: id = nomor baris
+ID_COLUMN = 'id'
+ID_DTYPE = 'int64'
+CODE_DTYPE = 'uint32'
+
+
+def _base(meta_file):
+    return meta_file[:-len('.json')] if meta_file.endswith('.json') else meta_file
+
+def _column_path(meta_file, generation, name):
+    return f"{_base(meta_file)}.{generation}.{name}.bin"
+
+def _column_dtypes():
+    dtypes = {name: CODE_DTYPE for name in DICT_COLUMNS}
+    dtypes.update(INT_COLUMNS)
+    dtypes.update(TEXT_COLUMNS)
+    dtypes[ID_COLUMN] = ID_DTYPE
+    return dtypes
+
+def legacy_pickle_path(meta_file):
+    """Path of the pre-columnar pickle for a header path (meta_x.json -> meta_x.pkl)."""
+    return f"{_base(meta_file)}.pkl"
+
+def exists(meta_file):
+    return os.path.exists(meta_file)
+
+def read_header(meta_file):
+    with open(meta_file, 'r', encoding='utf-8') as f:
+        header = json.load(f)
+    if header.get('format') != FORMAT:
+        raise ValueError(f"Bukan file metadata kolumnar: {meta_file}")
+    return header
+
+def _write_header(meta_file, header):
+    tmp = f"{meta_file}.tmp{os.getpid()}"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(header, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, meta_file)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def _empty_header(generation=0):
+    return {
+        'format': FORMAT,
+        'version': 1,
+        'generation': generation,
+        'n_rows': 0,
+        'text_bytes': 0,
+        'dicts': {name: [] for name in DICT_COLUMNS},
+        'next_id': 0,
+        'id_ranges': {},
+        'job_ranges': {},
+        'tombstones': [],
+        'n_deleted': 0,
+    }
+
+
+# --- Reading ---
+
+def open_meta(meta_file, header=None):
+    """Open a kategori's metadata for random access.
+
+    Returns a handle dict with the header, the dictionaries and read-only
+    memory maps of every column; nothing row-sized is read into memory.
+    header (e.g. from an index snapshot) is used instead of the header file.
+    """
+    header = header or read_header(meta_file)
+    n = header['n_rows']
+    generation = header['generation']
+    columns = {}
+    for name, dtype in _column_dtypes().items():
+        path = _column_path(meta_file, generation, name)
+        if n == 0 or not os.path.exists(path):
+            # Kolom yang belum ada di generasi lama dibaca sebagai nilai default-nya
+            if name in INT_COLUMNS:
+                columns[name] = np.full(n, INT_DEFAULTS[name], dtype=dtype)
+            elif name == ID_COLUMN:
+                columns[name] = np.arange(n, dtype=dtype)
+            else:
+                columns[name] = np.zeros(0, dtype=dtype)
+            continue
+        columns[name] = np.memmap(path, dtype=dtype, mode='r', shape=(n,))
+    text = None
+    if header['text_bytes'] > 0:
+        text = np.memmap(_column_path(meta_file, generation, 'text'), dtype='uint8', mode='r',
+                         shape=(header['text_bytes'],))
+    return {'file': meta_file, 'header': header, 'n_rows': n, 'dicts': header['dicts'],
+            'columns': columns, 'text': text}
+
+def num_rows(handle):
+    return handle['n_rows']
+
+def num_live(handle):
+    """Rows not tombstoned (num_rows counts tombstoned rows until they are compacted away)."""
+    return handle['n_rows'] - handle['header'].get('n_deleted', 0)
+
+def ids_to_rows(handle, ids):
+    """Row positions of the given row ids (ids not in the store are skipped), in the same order."""
+    ids = np.asarray(ids, dtype=ID_DTYPE)
+    col = handle['columns'][ID_COLUMN]
+    if len(ids) == 0 or handle['n_rows'] == 0:
+        return np.zeros(0, dtype='int64')
+    rows = np.searchsorted(col, ids)
+    found = rows < handle['n_rows']
+    found[found] = np.asarray(col[rows[found]]) == ids[found]
+    return rows[found]
+
+def is_tombstoned(header, ids):
+    """Boolean mask over ids: True for ids inside header's tombstone ranges."""
+    ids = np.asarray(ids, dtype=ID_DTYPE)
+    ranges = np.asarray(header.get('tombstones') or [], dtype=ID_DTYPE).reshape(-1, 2)
+    if not len(ranges):
+        return np.zeros(len(ids), dtype=bool)
+    i = np.searchsorted(ranges[:, 0], ids, side='right') - 1
+    return (i >= 0) & (ids < ranges[np.maximum(i, 0), 1])
+
+def live_mask(handle):
+    """Boolean row mask, False for tombstoned rows."""
+    mask = np.ones(handle['n_rows'], dtype=bool)
+    col = handle['columns'][ID_COLUMN]
+    for start, stop in handle['header'].get('tombstones', []):
+        mask[np.searchsorted(col, start):np.searchsorted(col, stop)] = False
+    return mask
+
+def read_rows(handle, ids):
+    """Decode the rows at the given positions into metadata dicts (same keys as the old pickle entries)."""
+    cols = handle['columns']
+    dicts = handle['dicts']
+    text = handle['text']
+    rows = []
+    for i in ids:
+        i = int(i)
+        if i < 0 or i >= handle['n_rows']:
+            continue
+        row = {}
+        for name in DICT_COLUMNS:
+            row[name] = dicts[name][int(cols[name][i])]
+        for name in INT_COLUMNS:
+            row[name] = int(cols[name][i])
+        start = int(cols['text_start'][i])
+        row['text'] = bytes(text[start:start + int(cols['text_len'][i])]).decode('utf-8') if text is not None else ''
+        rows.append(row)
+    return rows
+
+def iter_rows(handle, batch=4096):
+    """Yield every live (not tombstoned) row as a dict, decoding batch rows at a time."""
+    live = np.flatnonzero(live_mask(handle))
+    for start in range(0, len(live), batch):
+        yield from read_rows(handle, live[start:start + batch])
+
+def rows_with_value(handle, column, value):
+    """Return the row positions whose dictionary column equals value."""
+    try:
+        code = handle['dicts'][column].index(value)
+    except ValueError:
+        return np.zeros(0, dtype='int64')
+    return np.flatnonzero(np.asarray(handle['columns'][column]) == code)
+
+def mask_contains(handle, column, needle):
+    """Boolean row mask: dictionary column value contains needle (case-insensitive)."""
+    needle = str(needle).lower()
+    codes = [i for i, v in enumerate(handle['dicts'][column]) if needle in str(v).lower()]
+    if not codes:
+        return np.zeros(handle['n_rows'], dtype=bool)
+    return np.isin(np.asarray(handle['columns'][column]), codes)
+
+def sources(meta_file):
+    """Distinct source filenames stored for the kategori (read from the header only)."""
+    if not exists(meta_file):
+        return []
+    header = read_header(meta_file)
+    names = header['id_ranges'] if 'id_ranges' in header else header['dicts']['source']
+    return sorted(s for s in names if s)
+
+
+# --- Row ids ---
+
+def _add_id_ranges(header, codes, ids):
+    """Record the runs of consecutive ids with the same source code in header['id_ranges']."""
+    if len(ids) == 0:
+        return
+    codes = np.asarray(codes)
+    ids = np.asarray(ids, dtype=ID_DTYPE)
+    breaks = np.flatnonzero((codes[1:] != codes[:-1]) | (ids[1:] != ids[:-1] + 1)) + 1
+    starts = np.concatenate([[0], breaks])
+    stops = np.concatenate([breaks, [len(ids)]])
+    id_ranges = header['id_ranges']
+    for a, b in zip(starts, stops):
+        source = header['dicts']['source'][int(codes[a])]
+        ranges = id_ranges.setdefault(source, [])
+        first, last = int(ids[a]), int(ids[b - 1]) + 1
+        if ranges and ranges[-1][1] == first:
+            ranges[-1][1] = last
+        else:
+            ranges.append([first, last])
+
+def with_ids(meta_file, header):
+    """Copy of header with next_id/id_ranges/tombstones, derived from the columns for older headers."""
+    header = json.loads(json.dumps(header)) if header else _empty_header()
+    if 'id_ranges' in header:
+        return header
+    handle = open_meta(meta_file, header)
+    header.update(next_id=header['n_rows'], id_ranges={}, tombstones=[], n_deleted=0)
+    _add_id_ranges(header, handle['columns']['source'], handle['columns'][ID_COLUMN])
+    return header
+
+def stage_tombstone(meta_file, header, source):
+    """Mark every row of source deleted; returns (new uncommitted header, deleted ids).
+
+    Only the header changes: the rows stay in the columns (skipped by
+    iter_rows and live_mask) until stage_select rewrites the store.
+    """
+    header = with_ids(meta_file, header)
+    ranges = header['id_ranges'].pop(source, [])
+    if not ranges:
+        return header, np.zeros(0, dtype=ID_DTYPE)
+    header['tombstones'] = sorted(header['tombstones'] + ranges)
+    ids = np.concatenate([np.arange(a, b, dtype=ID_DTYPE) for a, b in ranges])
+    header['n_deleted'] += len(ids)
+    # A job's rows all belong to one source, so its range is gone as a whole
+    jobs = header.get('job_ranges') or {}
+    header['job_ranges'] = {job: r for job, r in jobs.items() if not is_tombstoned(header, [r[0]])[0]}
+    return header, ids
+
+def stage_tombstone_job(meta_file, header, job_id):
+    """Mark the rows appended for job_id deleted; returns (new uncommitted header, deleted ids).
+
+    Other rows of the same source (an earlier upload of the file) are kept.
+    """
+    header = with_ids(meta_file, header)
+    r = (header.get('job_ranges') or {}).pop(str(job_id), None)
+    if r is None:
+        return header, np.zeros(0, dtype=ID_DTYPE)
+    start, stop = r
+    for source in list(header['id_ranges']):
+        left = []
+        for a, b in header['id_ranges'][source]:
+            if a < start:
+                left.append([a, min(b, start)])
+            if b > stop:
+                left.append([max(a, stop), b])
+        if left:
+            header['id_ranges'][source] = left
+        else:
+            del header['id_ranges'][source]
+    header['tombstones'] = sorted(header['tombstones'] + [[start, stop]])
+    ids = np.arange(start, stop, dtype=ID_DTYPE)
+    header['n_deleted'] += len(ids)
+    return header, ids
+
+
+# --- Writing ---
+
+def _encode(header, metadatas, text_offset):
+    """Encode metadata dicts into column arrays + text blob, extending header dictionaries in place.
+
+    The rows get ids from header['next_id'] on, recorded in header['id_ranges'].
+    """
+    dicts = header['dicts']
+    lookup = {name: {v: i for i, v in enumerate(dicts[name])} for name in DICT_COLUMNS}
+    n = len(metadatas)
+    arrays = {name: np.zeros(n, dtype=dtype) for name, dtype in _column_dtypes().items()}
+    blob = bytearray()
+    for r, m in enumerate(metadatas):
+        for name in DICT_COLUMNS:
+            value = str(m.get(name) or '')
+            code = lookup[name].get(value)
+            if code is None:
+                code = lookup[name][value] = len(dicts[name])
+                dicts[name].append(value)
+            arrays[name][r] = code
+        for name in INT_COLUMNS:
+            value = m.get(name)
+            arrays[name][r] = INT_DEFAULTS[name] if value in (None, '') else int(value)
+        data = str(m.get('text') or '').encode('utf-8')
+        arrays['text_start'][r] = text_offset + len(blob)
+        arrays['text_len'][r] = len(data)
+        blob += data
+    arrays[ID_COLUMN] = np.arange(header['next_id'], header['next_id'] + n, dtype=ID_DTYPE)
+    header['next_id'] += n
+    _add_id_ranges(header, arrays['source'], arrays[ID_COLUMN])
+    return arrays, bytes(blob)
+
+def _append_file(path, committed_bytes, data):
+    # Anything past the committed length is debris from an interrupted append
+    with open(path, 'ab') as f:
+        f.truncate(committed_bytes)
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def stage_append(meta_file, header, metadatas, job_id=None):
+    """Write metadatas past the committed end of header's generation; returns the new (uncommitted) header.
+
+    Single writer per kategori is assumed; readers keep seeing the previous
+    row count until the returned header is committed. With job_id, the new
+    rows' id range is recorded for stage_tombstone_job.
+    """
+    header = with_ids(meta_file, header)
+    if not metadatas:
+        return header
+    n = header['n_rows']
+    generation = header['generation']
+    first_id = header['next_id']
+    arrays, blob = _encode(header, metadatas, header['text_bytes'])
+    if job_id is not None:
+        header.setdefault('job_ranges', {})[str(job_id)] = [first_id, header['next_id']]
+    for name, arr in arrays.items():
+        path = _column_path(meta_file, generation, name)
+        if n and name in INT_COLUMNS and not os.path.exists(path):
+            # Kolom baru pada generasi lama: isi baris yang sudah ada dengan default-nya
+            _append_file(path, 0, np.full(n, INT_DEFAULTS[name], dtype=arr.dtype).tobytes())
+        elif n and name == ID_COLUMN and not os.path.exists(path):
+            _append_file(path, 0, np.arange(n, dtype=ID_DTYPE).tobytes())
+        _append_file(path, n * arr.dtype.itemsize, arr.tobytes())
+    _append_file(_column_path(meta_file, generation, 'text'), header['text_bytes'], blob)
+    header['n_rows'] = n + len(metadatas)
+    header['text_bytes'] += len(blob)
+    return header
+
+def stage_rows(meta_file, header, metadatas):
+    """Write metadatas as a fresh generation after header's; returns the new (uncommitted) header.
+
+    Ids continue after header's next_id, so ids of deleted rows are never reused.
+    """
+    generation = (header['generation'] + 1) if header else 0
+    new_header = _empty_header(generation)
+    new_header['next_id'] = header.get('next_id', header['n_rows']) if header else 0
+    arrays, blob = _encode(new_header, list(metadatas or []), 0)
+    for name, arr in arrays.items():
+        with open(_column_path(meta_file, generation, name), 'wb') as f:
+            f.write(arr.tobytes())
+    with open(_column_path(meta_file, generation, 'text'), 'wb') as f:
+        f.write(blob)
+    new_header['n_rows'] = len(arrays['text_len'])
+    new_header['text_bytes'] = len(blob)
+    return new_header
+
+def stage_select(meta_file, header, keep_ids):
+    """Write only the rows at positions keep_ids (ascending) as a fresh generation, without decoding to dicts.
+
+    Rows keep their ids; tombstones are cleared, so keep_ids should not
+    include tombstoned rows. Returns the new (uncommitted) header.
+    """
+    handle = open_meta(meta_file, header)
+    keep_ids = np.asarray(keep_ids, dtype='int64')
+    old = handle['header']
+    generation = old['generation'] + 1
+    new_header = _empty_header(generation)
+    new_header['next_id'] = old.get('next_id', old['n_rows'])
+    cols = handle['columns']
+    # Re-encode dictionaries so values that no longer occur are dropped
+    for name in DICT_COLUMNS:
+        codes = np.asarray(cols[name])[keep_ids]
+        used, remapped = np.unique(codes, return_inverse=True)
+        new_header['dicts'][name] = [handle['dicts'][name][int(c)] for c in used]
+        with open(_column_path(meta_file, generation, name), 'wb') as f:
+            f.write(remapped.astype(CODE_DTYPE).tobytes())
+    for name in INT_COLUMNS:
+        with open(_column_path(meta_file, generation, name), 'wb') as f:
+            f.write(np.asarray(cols[name])[keep_ids].tobytes())
+    ids = np.asarray(cols[ID_COLUMN])[keep_ids]
+    with open(_column_path(meta_file, generation, ID_COLUMN), 'wb') as f:
+        f.write(ids.tobytes())
+    with open(_column_path(meta_file, generation, 'source'), 'rb') as f:
+        _add_id_ranges(new_header, np.frombuffer(f.read(), dtype=CODE_DTYPE), ids)
+    # Ids are stable, so job ranges with rows left stay valid as they are
+    new_header['job_ranges'] = {job: r for job, r in (old.get('job_ranges') or {}).items()
+                                if np.searchsorted(ids, r[0]) < np.searchsorted(ids, r[1])}
+    starts = np.asarray(cols['text_start'])[keep_ids]
+    lengths = np.asarray(cols['text_len'])[keep_ids]
+    new_starts = np.zeros(len(keep_ids), dtype=TEXT_COLUMNS['text_start'])
+    if len(keep_ids):
+        new_starts[1:] = np.cumsum(lengths[:-1], dtype='uint64')
+    with open(_column_path(meta_file, generation, 'text'), 'wb') as f:
+        for start, length in zip(starts, lengths):
+            f.write(handle['text'][int(start):int(start) + int(length)].tobytes())
+    with open(_column_path(meta_file, generation, 'text_start'), 'wb') as f:
+        f.write(new_starts.tobytes())
+    with open(_column_path(meta_file, generation, 'text_len'), 'wb') as f:
+        f.write(lengths.astype(TEXT_COLUMNS['text_len']).tobytes())
+    new_header['n_rows'] = int(len(keep_ids))
+    new_header['text_bytes'] = int(lengths.sum()) if len(keep_ids) else 0
+    return new_header
+
+def commit(meta_file, header):
+    """Atomically replace the header file with header."""
+    _write_header(meta_file, header)
+
+def remove_generations(meta_file, keep):
+    """Delete column files of every generation not in keep."""
+    prefix = _base(meta_file) + '.'
+    for path in glob.glob(f"{glob.escape(_base(meta_file))}.*.*.bin"):
+        generation = path[len(prefix):].split('.', 1)[0]
+        if generation.isdigit() and int(generation) not in keep:
+            try:
+                os.remove(path)
+            except OSError:
+                # Windows: a reader still has it mapped; it will be cleaned up on the next rewrite
+                pass
+
+def append_rows(meta_file, metadatas):
+    """Append metadata dicts as new rows and commit; returns the new row count."""
+    header = stage_append(meta_file, read_header(meta_file) if exists(meta_file) else None, metadatas)
+    if metadatas or not exists(meta_file):
+        commit(meta_file, header)
+    return header['n_rows']
+
+def write_rows(meta_file, metadatas):
+    """Replace the whole store with metadatas, written as a new generation."""
+    old = read_header(meta_file) if exists(meta_file) else None
+    header = stage_rows(meta_file, old, metadatas)
+    commit(meta_file, header)
+    remove_generations(meta_file, {header['generation']})
+    return header['n_rows']
+
+def select_rows(meta_file, keep_ids):
+    """Rewrite the store keeping only keep_ids (in that order)."""
+    header = stage_select(meta_file, read_header(meta_file), keep_ids)
+    commit(meta_file, header)
+    remove_generations(meta_file, {header['generation']})
+    return header['n_rows']
+
+
+# --- Migration from meta_<kategori>.pkl ---
+
+def migrate_pickle(pkl_file, meta_file=None, remove_pickle=False):
+    """Convert a pickled list of metadata dicts into the columnar store; returns the row count."""
+    meta_file = meta_file or f"{pkl_file[:-len('.pkl')]}.json"
+    with open(pkl_file, 'rb') as f:
+        metadatas = pickle.load(f) or []
+    n = write_rows(meta_file, [m for m in metadatas if isinstance(m, dict)])
+    if remove_pickle:
+        os.remove(pkl_file)
+    return n
+
+def ensure_migrated(meta_file, lock):
+    """Create the columnar store from the legacy pickle if only the pickle exists.
+
+    lock(meta_file) is the kategori's writer lock: write_rows truncates the
+    generation-0 column files, so two workers migrating at once could cut
+    short files the other has already memory-mapped.
+    """
+    if exists(meta_file):
+        return False
+    pkl_file = legacy_pickle_path(meta_file)
+    if not os.path.exists(pkl_file):
+        return False
+    with lock(meta_file):
+        # Worker lain mungkin sudah selesai migrasi selama kita menunggu lock
+        if exists(meta_file):
+            return False
+        n = migrate_pickle(pkl_file, meta_file)
+    print(f"[META] {os.path.basename(pkl_file)} dimigrasi ke format kolumnar ({n} baris)", file=sys.stderr)
+    return True
+
+def migrate_all(vector_dir, lock, remove_pickle=False):
+    """Migrate every meta_*.pkl under vector_dir that has no columnar header yet (see ensure_migrated for lock)."""
+    migrated = {}
+    for pkl_file in sorted(glob.glob(os.path.join(vector_dir, 'meta_*.pkl'))):
+        meta_file = f"{pkl_file[:-len('.pkl')]}.json"
+        with lock(meta_file):
+            if exists(meta_file):
+                continue
+            migrated[os.path.basename(pkl_file)] = migrate_pickle(pkl_file, meta_file, remove_pickle=remove_pickle)
+    return migrated
+
+
+if __name__ == '__main__':
+    # python -m services.meta_store [vector_dir], dari folder app (memakai writer lock faiss_service)
+    from services import faiss_service
+    target = sys.argv[1] if len(sys.argv) > 1 else faiss_service.VECTOR_DIR
+    for name, count in migrate_all(target, faiss_service.meta_write_lock).items():
+        print(f"{name}: {count} baris")
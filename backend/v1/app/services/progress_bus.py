@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+import atexit
+import socket
+import hashlib
+import tempfile
+import threading
+
+from . import job_service
+
+# Progress bus untuk /progress-stream.
+# Pesan progress disimpan oleh job_service (tabel job_events di SQLite), jadi
+# worker gunicorn mana pun bisa membacanya. Yang dikirim antar proses hanya
+# "bangunkan job X": setiap proses mengikat satu Unix datagram socket di
+# PROGRESS_SOCKET_DIR dan publisher mengirim job_id ke semua socket di sana.
+# Di dalam proses, setiap job punya Condition sendiri; stream tidur sampai ada
+# event baru, heartbeat (PROGRESS_HEARTBEAT detik), atau job selesai.
+# Tanpa AF_UNIX (Windows) stream kembali ke polling setiap PROGRESS_FALLBACK_POLL detik.
+PROGRESS_HEARTBEAT = float(os.getenv('PROGRESS_HEARTBEAT', '15'))
+PROGRESS_MAX_STREAMS = int(os.getenv('PROGRESS_MAX_STREAMS', '32'))
+# Stream boleh dibuka sebelum /upload membuat job-nya; setelah ini tanpa job, stream ditutup
+PROGRESS_UNKNOWN_JOB_WAIT = float(os.getenv('PROGRESS_UNKNOWN_JOB_WAIT', '120'))
+PROGRESS_FALLBACK_POLL = float(os.getenv('PROGRESS_FALLBACK_POLL', '1.0'))
+PROGRESS_SOCKET_DIR = os.getenv('PROGRESS_SOCKET_DIR') or os.path.join(
+    tempfile.gettempdir(), 'rag-progress-' + hashlib.sha1(os.path.abspath(job_service.JOBS_DB).encode('utf-8')).hexdigest()[:10])
+FINAL_STATUSES = ('done', 'failed')
+HAS_UNIX_SOCKETS = hasattr(socket, 'AF_UNIX')
+
+_channels = {}  # key: job_id, value: {'cond': Condition, 'version': int, 'subscribers': int}
+_channels_lock = threading.Lock()
+_stream_slots = threading.BoundedSemaphore(max(PROGRESS_MAX_STREAMS, 1))
+_stats = {'active_streams': 0, 'rejected': 0, 'wakeups_local': 0, 'wakeups_remote': 0}
+_listener = {'pid': None, 'path': None}
+_listener_lock = threading.Lock()
+_send_sock = {'pid': None, 'sock': None}
+
+
+# --- Wakeups ---
+
+def _wake_local(job_id):
+    with _channels_lock:
+        channel = _channels.get(job_id)
+    if channel is None:
+        return
+    with channel['cond']:
+        channel['version'] += 1
+        channel['cond'].notify_all()
+
+def notify(job_id):
+    """Bangunkan stream job_id di proses ini dan di semua proses lain."""
+    _stats['wakeups_local'] += 1
+    _wake_local(job_id)
+    if not HAS_UNIX_SOCKETS or not os.path.isdir(PROGRESS_SOCKET_DIR):
+        return
+    if _send_sock['pid'] != os.getpid():
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        _send_sock.update(pid=os.getpid(), sock=sock)
+    data = job_id.encode('utf-8')
+    for name in os.listdir(PROGRESS_SOCKET_DIR):
+        path = os.path.join(PROGRESS_SOCKET_DIR, name)
+        if path == _listener['path'] or not name.endswith('.sock'):
+            continue
+        try:
+            _send_sock['sock'].sendto(data, path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Socket sisa proses yang sudah mati
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        except OSError:
+            # Buffer penerima penuh: stream-nya tetap bangun saat heartbeat
+            pass
+
+def _listen(sock):
+    while True:
+        try:
+            data = sock.recv(1024)
+        except OSError:
+            return
+        _stats['wakeups_remote'] += 1
+        _wake_local(data.decode('utf-8', 'replace'))
+
+def _remove_socket(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def start_listener():
+    """Ikat socket datagram proses ini (sekali per pid) supaya bisa dibangunkan proses lain."""
+    if not HAS_UNIX_SOCKETS:
+        return False
+    with _listener_lock:
+        if _listener['pid'] == os.getpid():
+            return True
+        try:
+            os.makedirs(PROGRESS_SOCKET_DIR, exist_ok=True)
+            path = os.path.join(PROGRESS_SOCKET_DIR, f'{os.getpid()}.sock')
+            if os.path.exists(path):
+                os.remove(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+        except OSError as e:
+            print(f"[PROGRESS] Socket wakeup tidak tersedia, kembali ke polling: {e}", file=sys.stderr)
+            return False
+        _listener.update(pid=os.getpid(), path=path)
+        atexit.register(_remove_socket, path)
+        threading.Thread(target=_listen, args=(sock,), name='progress-listener', daemon=True).start()
+        return True
+
+
+# --- Streams ---
+
+def publish(job_id, message):
+    """Simpan pesan progress (job_service memanggil notify)."""
+    job_service.add_event(job_id, message)
+
+def try_open_stream():
+    """Ambil slot stream; False jika sudah PROGRESS_MAX_STREAMS stream aktif di proses ini."""
+    if not _stream_slots.acquire(blocking=False):
+        with _channels_lock:
+            _stats['rejected'] += 1
+        return False
+    with _channels_lock:
+        _stats['active_streams'] += 1
+    return True
+
+def close_stream():
+    with _channels_lock:
+        _stats['active_streams'] -= 1
+    _stream_slots.release()
+
+def subscribe(job_id, after_seq=0):
+    """Generator event untuk satu job: ('message', seq, text), ('heartbeat', None, None), ('end', None, status).
+
+    Berhenti setelah semua pesan job yang sudah selesai terkirim, atau jika job
+    tidak pernah muncul dalam PROGRESS_UNKNOWN_JOB_WAIT detik.
+    """
+    polling = not start_listener()
+    with _channels_lock:
+        channel = _channels.setdefault(job_id, {'cond': threading.Condition(), 'version': 0, 'subscribers': 0})
+        channel['subscribers'] += 1
+    started = time.time()
+    last_sent = time.time()
+    try:
+        while True:
+            with channel['cond']:
+                seen = channel['version']
+            # Baca status sebelum event: event terakhir selalu ditulis sebelum job selesai
+            job = job_service.get(job_id)
+            for seq, message in job_service.events_since(job_id, after_seq):
+                after_seq = seq
+                last_sent = time.time()
+                yield 'message', seq, message
+            if job is not None and job['status'] in FINAL_STATUSES:
+                yield 'end', None, job['status']
+                return
+            if job is None and time.time() - started > PROGRESS_UNKNOWN_JOB_WAIT:
+                yield 'end', None, 'unknown'
+                return
+            wait = PROGRESS_FALLBACK_POLL if polling else PROGRESS_HEARTBEAT
+            with channel['cond']:
+                channel['cond'].wait_for(lambda: channel['version'] != seen,
+                                         timeout=max(0.0, min(wait, last_sent + PROGRESS_HEARTBEAT - time.time())))
+            if time.time() - last_sent >= PROGRESS_HEARTBEAT:
+                last_sent = time.time()
+                yield 'heartbeat', None, None
+    finally:
+        with _channels_lock:
+            channel['subscribers'] -= 1
+            if channel['subscribers'] <= 0:
+                _channels.pop(job_id, None)
+
+def stats():
+    out = dict(_stats)
+    out['max_streams'] = PROGRESS_MAX_STREAMS
+    out['socket_wakeups'] = _listener['pid'] == os.getpid()
+    return out
+
+
+job_service.add_listener(notify)
@@ -0,0 +1,268 @@
+import os
+import sys
+import glob
+import json
+import time
+import queue
+import atexit
+import threading
+
+import requests
+
+from . import tracing
+
+try:
+    import fcntl
+except ImportError:  # Windows: spill file tanpa lock antar proses
+    fcntl = None
+
+# Outbox untuk event ke portal (laporan token /tokens/usage, dokumen /documents).
+# Request path hanya memasukkan event ke antrian (tidak pernah menunggu portal);
+# satu thread background per proses mengirimnya per batch lewat session keep-alive.
+# Jika portal tidak bisa dihubungi, event ditulis ke file JSONL (append-only) dan
+# dikirim ulang setelah portal bisa dihubungi lagi. Antrian penuh juga tumpah ke file.
+V1_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+TELEMETRY_QUEUE_MAX = int(os.getenv('TELEMETRY_QUEUE_MAX', '1000'))
+TELEMETRY_BATCH_SIZE = int(os.getenv('TELEMETRY_BATCH_SIZE', '50'))
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv('TELEMETRY_FLUSH_INTERVAL', '1.0'))
+TELEMETRY_RETRY_INTERVAL = float(os.getenv('TELEMETRY_RETRY_INTERVAL', '30'))
+TELEMETRY_TIMEOUT = float(os.getenv('TELEMETRY_TIMEOUT', '3'))
+TELEMETRY_SPILL_FILE = os.getenv('TELEMETRY_SPILL_FILE') or os.path.join(
+    os.getenv('RAG_VECTOR_DIR') or os.path.join(V1_DIR, 'vector'), 'telemetry_outbox.jsonl')
+
+_queue = queue.Queue(maxsize=max(TELEMETRY_QUEUE_MAX, 1))
+_session = requests.Session()
+_thread_lock = threading.Lock()
+_flusher = {'pid': None}
+_spill_lock = threading.Lock()
+_stats = {'queued': 0, 'sent': 0, 'failed': 0, 'spilled': 0, 'replayed': 0, 'dropped': 0}
+_state = {'portal_down_since': None, 'last_retry': 0.0, 'busy': False}
+# Event di antrian + yang sedang dikirim; naik sebelum put, turun setelah batch selesai,
+# jadi flush() tidak melihat 0 selama batch yang sudah diambil dari antrian masih jalan
+_in_flight = {'events': 0}
+_in_flight_lock = threading.Lock()
+
+
+def _portal_url():
+    return os.environ.get('PORTAL_API_URL')  # e.g. http://127.0.0.1:8000/api
+
+def enqueue(path, body):
+    """Antrikan event untuk POST {PORTAL_API_URL}{path}; tidak pernah memblokir. False jika tanpa portal."""
+    if not _portal_url():
+        return False
+    _ensure_flusher()
+    event = {'path': path, 'body': body, 'ts': time.time()}
+    _track(1)
+    try:
+        _queue.put_nowait(event)
+        _stats['queued'] += 1
+    except queue.Full:
+        _track(-1)
+        _spill([event])
+    return True
+
+def _track(n):
+    with _in_flight_lock:
+        _in_flight['events'] += n
+
+
+# --- Spill file ---
+
+class _SpillLock:
+    """Lock thread + flock pada <spill>.lock, supaya append dan replay antar worker tidak bertabrakan."""
+    def __enter__(self):
+        _spill_lock.acquire()
+        self.f = None
+        if fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(TELEMETRY_SPILL_FILE), exist_ok=True)
+                self.f = open(f'{TELEMETRY_SPILL_FILE}.lock', 'a')
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+            except OSError:
+                self.f = None
+        return self
+
+    def __exit__(self, *exc):
+        if self.f is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+            self.f.close()
+        _spill_lock.release()
+
+def _spill(events):
+    if not events:
+        return
+    try:
+        with _SpillLock():
+            os.makedirs(os.path.dirname(TELEMETRY_SPILL_FILE), exist_ok=True)
+            with open(TELEMETRY_SPILL_FILE, 'a', encoding='utf-8') as f:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        _stats['spilled'] += len(events)
+    except OSError as e:
+        _stats['dropped'] += len(events)
+        print(f"[TELEMETRY] Gagal menulis spill file, {len(events)} event dibuang: {e}", file=sys.stderr)
+
+def _pid_alive(pid):
+    if os.name == 'nt':
+        # os.kill di Windows menghentikan proses, bukan mengecek
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass
+    return True
+
+def _take_spill():
+    """Pindahkan spill file ke file replay milik proses ini; return path-nya atau None."""
+    replay = f'{TELEMETRY_SPILL_FILE}.replay{os.getpid()}'
+    with _SpillLock():
+        if os.path.exists(replay):
+            # Sisa replay proses ini yang terputus: selesaikan dulu
+            return replay
+        for path in glob.glob(f'{glob.escape(TELEMETRY_SPILL_FILE)}.replay*'):
+            # Replay milik worker yang mati di tengah jalan diambil alih
+            pid = path.rsplit('.replay', 1)[1]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                os.replace(path, replay)
+                return replay
+        if not os.path.exists(TELEMETRY_SPILL_FILE) or os.path.getsize(TELEMETRY_SPILL_FILE) == 0:
+            return None
+        os.replace(TELEMETRY_SPILL_FILE, replay)
+    return replay
+
+def _replay():
+    """Kirim ulang event di spill file; berhenti (dan simpan sisanya lagi) pada kegagalan pertama."""
+    replay = _take_spill()
+    if replay is None:
+        return
+    events = []
+    with open(replay, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # Baris terpotong (proses mati saat menulis)
+                continue
+    replayed = 0
+    for i in range(0, len(events), max(TELEMETRY_BATCH_SIZE, 1)):
+        batch = events[i:i + TELEMETRY_BATCH_SIZE]
+        sent = _send(batch)
+        replayed += sent
+        if sent < len(batch):
+            _spill(batch[sent:] + events[i + TELEMETRY_BATCH_SIZE:])
+            break
+    os.remove(replay)
+    _stats['replayed'] += replayed
+    if replayed:
+        print(f"[TELEMETRY] Replay spill file: {replayed}/{len(events)} event terkirim", file=sys.stderr)
+
+
+# --- Flusher ---
+
+def _send(batch):
+    """POST event satu per satu (urut); return jumlah yang terkirim sebelum kegagalan pertama."""
+    portal_url = _portal_url()
+    if not portal_url:
+        return 0
+    for n, event in enumerate(batch):
+        start = time.perf_counter()
+        try:
+            resp = _session.post(f"{portal_url}{event['path']}", json=event['body'], timeout=TELEMETRY_TIMEOUT)
+            # Callback ke portal berjalan di luar request, jadi dicatat sebagai kind 'telemetry'
+            tracing.observe('rag_stage_seconds', time.perf_counter() - start, kind='telemetry', stage='portal_send')
+            # 4xx: event ditolak portal, percobaan ulang tidak akan membantu
+            if resp.status_code >= 500:
+                raise requests.HTTPError(f'HTTP {resp.status_code}')
+        except requests.RequestException as e:
+            if _state['portal_down_since'] is None:
+                _state['portal_down_since'] = time.time()
+                print(f"[TELEMETRY] Portal tidak bisa dihubungi, event disimpan ke {TELEMETRY_SPILL_FILE}: {e}", file=sys.stderr)
+            _stats['failed'] += 1
+            return n
+        _stats['sent'] += 1
+    if _state['portal_down_since'] is not None:
+        print(f"[TELEMETRY] Portal kembali setelah {time.time() - _state['portal_down_since']:.0f} detik", file=sys.stderr)
+        _state['portal_down_since'] = None
+    return len(batch)
+
+def _next_batch():
+    try:
+        batch = [_queue.get(timeout=TELEMETRY_FLUSH_INTERVAL)]
+    except queue.Empty:
+        return []
+    while len(batch) < TELEMETRY_BATCH_SIZE:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def _flush_loop():
+    while True:
+        batch = []
+        try:
+            batch = _next_batch()
+            _state['busy'] = True
+            if batch:
+                if _state['portal_down_since'] is not None and time.time() - _state['last_retry'] < TELEMETRY_RETRY_INTERVAL:
+                    # Portal masih mati: langsung ke spill file, coba lagi setelah TELEMETRY_RETRY_INTERVAL
+                    _spill(batch)
+                    continue
+                _state['last_retry'] = time.time()
+                sent = _send(batch)
+                if sent < len(batch):
+                    _spill(batch[sent:])
+                    continue
+            # Portal bisa dihubungi (atau waktunya mencoba lagi): kirim ulang isi spill file
+            due = time.time() - _state['last_retry'] >= TELEMETRY_RETRY_INTERVAL
+            if (batch or due) and os.path.exists(TELEMETRY_SPILL_FILE):
+                _state['last_retry'] = time.time()
+                _replay()
+        except Exception as e:
+            print(f"[TELEMETRY] Flusher error: {e}", file=sys.stderr)
+            time.sleep(TELEMETRY_FLUSH_INTERVAL)
+        finally:
+            _state['busy'] = False
+            _track(-len(batch))
+
+def _drain_to_spill():
+    # Saat proses berhenti: event yang belum terkirim disimpan, dikirim oleh proses berikutnya
+    events = []
+    while True:
+        try:
+            events.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    _track(-len(events))
+    _spill(events)
+
+def _ensure_flusher():
+    if _flusher['pid'] == os.getpid():
+        return
+    with _thread_lock:
+        if _flusher['pid'] == os.getpid():
+            return
+        _flusher['pid'] = os.getpid()
+        threading.Thread(target=_flush_loop, name='telemetry-flusher', daemon=True).start()
+        atexit.register(_drain_to_spill)
+
+def flush(timeout=10.0):
+    """Tunggu sampai antrian kosong dan batch terakhir selesai (untuk skrip/benchmark)."""
+    deadline = time.time() + timeout
+    while (_in_flight['events'] or _state['busy']) and time.time() < deadline:
+        time.sleep(0.01)
+    return not _in_flight['events'] and not _state['busy']
+
+def stats():
+    out = dict(_stats)
+    out['pending'] = _queue.qsize()
+    out['portal_down'] = _state['portal_down_since'] is not None
+    try:
+        out['spill_bytes'] = os.path.getsize(TELEMETRY_SPILL_FILE)
+    except OSError:
+        out['spill_bytes'] = 0
+    return out
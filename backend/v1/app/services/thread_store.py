@@ -0,0 +1,351 @@
+"""Thread memory (riwayat tanya-jawab per user/thread) sebagai log JSONL append-only.
+
+Satu file per thread: threads/<user_id>_<thread_id>.jsonl, satu baris per
+giliran ({"q", "a", "rephrased"?}). Menyimpan jawaban hanya menambah satu
+baris (O(1)), di bawah lock per thread (thread lock + flock), jadi request
+bersamaan pada thread yang sama tidak saling menimpa.
+
+Membaca hanya mengambil THREAD_HISTORY_TURNS giliran terakhir dari ekor
+file; thread yang sering dipakai disimpan di LRU in-process
+(THREAD_LRU_MAX) dan hanya membaca byte baru jika worker lain menambah baris.
+File yang melewati THREAD_COMPACT_BYTES dipadatkan di background menjadi
+THREAD_MAX_TURNS giliran terakhir.
+
+File lama <user_id>_<thread_id>.json (list JSON) dimigrasi saat pertama
+dibaca lalu diganti namanya menjadi .json.migrated, atau sekaligus dengan:
+
+    python -m services.thread_store [threads_dir]
+"""
+import os
+import sys
+import json
+import glob
+import threading
+from collections import OrderedDict, deque
+
+try:
+    import fcntl
+except ImportError:  # Windows: hanya lock antar thread
+    fcntl = None
+
+V1_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+THREADS_DIR = os.getenv('RAG_THREADS_DIR') or os.path.join(V1_DIR, 'threads')
+THREAD_HISTORY_TURNS = int(os.getenv('THREAD_HISTORY_TURNS', '20'))
+THREAD_LRU_MAX = int(os.getenv('THREAD_LRU_MAX', '1000'))
+THREAD_MAX_TURNS = int(os.getenv('THREAD_MAX_TURNS', '500'))
+THREAD_COMPACT_BYTES = int(os.getenv('THREAD_COMPACT_BYTES', str(1024 * 1024)))
+_LOCK_STRIPES = 64
+_TAIL_BLOCK = 8192
+
+_locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+_hot = OrderedDict()  # key: (user_id, thread_id), value: {'turns': deque, 'size': int, 'ino': int}
+_hot_lock = threading.Lock()
+_compact_queue = set()
+_compact_event = threading.Event()
+_compactor = {'pid': None}
+_compactor_lock = threading.Lock()
+_stats = {'hot_hits': 0, 'tail_reads': 0, 'incremental_reads': 0, 'appends': 0, 'migrated': 0, 'compactions': 0}
+
+
+def thread_path(user_id, thread_id, directory=None):
+    return os.path.join(directory or THREADS_DIR, f'{user_id}_{thread_id}.jsonl')
+
+def legacy_path(user_id, thread_id, directory=None):
+    return os.path.join(directory or THREADS_DIR, f'{user_id}_{thread_id}.json')
+
+
+# --- Locking ---
+
+class _ThreadLock:
+    """Lock satu thread memory: stripe lock in-process + flock pada file JSONL-nya.
+
+    Setelah flock didapat, inode dicek ulang: jika compaction sudah mengganti
+    file, lock diambil ulang pada file yang baru. self.f adalah file terbuka (a+b).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = _locks[hash(path) % _LOCK_STRIPES]
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            while True:
+                self.f = open(self.path, 'a+b')
+                if fcntl is None:
+                    return self
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+                try:
+                    if os.fstat(self.f.fileno()).st_ino == os.stat(self.path).st_ino:
+                        return self
+                except FileNotFoundError:
+                    pass
+                self.f.close()
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+            self.f.close()
+        finally:
+            self.lock.release()
+
+
+# --- Reading ---
+
+def _parse(lines):
+    turns = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            turn = json.loads(line)
+        except ValueError:
+            # Baris terpotong (proses mati saat menulis)
+            continue
+        if isinstance(turn, dict):
+            turns.append(turn)
+    return turns
+
+def _read_tail(f, n):
+    """n giliran terakhir (None: semua) dari file terbuka; return (turns, size)."""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if n is None:
+        f.seek(0)
+        return _parse(f.read().split(b'\n')), size
+    pos, data = size, b''
+    while pos > 0 and data.count(b'\n') <= n:
+        step = min(_TAIL_BLOCK, pos)
+        pos -= step
+        f.seek(pos)
+        data = f.read(step) + data
+    lines = data.split(b'\n')
+    if pos > 0:
+        lines = lines[1:]  # baris pertama mungkin terpotong di tengah
+    return _parse(lines)[-n:] if n > 0 else [], size
+
+def _retire_legacy(legacy):
+    # Ganti nama (bukan hapus) supaya file JSONL yang kosong lagi tidak mengimpor riwayat lama
+    try:
+        os.replace(legacy, legacy + '.migrated')
+    except OSError as e:
+        print(f"[THREAD] Gagal mengganti nama thread lama {legacy}: {e}", file=sys.stderr)
+
+def _migrate_legacy(user_id, thread_id, lock):
+    """Tulis isi <thread>.json lama ke file JSONL yang masih kosong, lalu ganti namanya ke .json.migrated (di bawah lock)."""
+    legacy = legacy_path(user_id, thread_id)
+    if not os.path.exists(legacy):
+        return False
+    lock.f.seek(0, os.SEEK_END)
+    if lock.f.tell() > 0:
+        # Sudah dimigrasi sebelum file lama diganti namanya
+        _retire_legacy(legacy)
+        return False
+    try:
+        with open(legacy, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+        turns = json.loads(content) if content else []
+    except (OSError, ValueError) as e:
+        print(f"[THREAD] Gagal membaca thread lama {legacy}: {e}", file=sys.stderr)
+        return False
+    turns = [t for t in turns if isinstance(t, dict)]
+    if THREAD_MAX_TURNS > 0:
+        turns = turns[-THREAD_MAX_TURNS:]
+    lock.f.write(b''.join(_encode(t) for t in turns))
+    lock.f.flush()
+    os.fsync(lock.f.fileno())
+    _retire_legacy(legacy)
+    _stats['migrated'] += 1
+    return True
+
+def _encode(turn):
+    return (json.dumps(turn, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+def _remember(key, turns, size, ino):
+    with _hot_lock:
+        _hot[key] = {'turns': deque(turns, maxlen=max(THREAD_HISTORY_TURNS, 1)), 'size': size, 'ino': ino}
+        _hot.move_to_end(key)
+        while len(_hot) > THREAD_LRU_MAX:
+            _hot.popitem(last=False)
+
+def recent(user_id, thread_id, n=None):
+    """Giliran terakhir thread (paling banyak n, default THREAD_HISTORY_TURNS), urut lama ke baru.
+
+    Hasilnya salinan: mengubahnya tidak mengubah store (pakai append_turn).
+    """
+    n = THREAD_HISTORY_TURNS if n is None else n
+    key = (user_id, thread_id)
+    path = thread_path(user_id, thread_id)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+    if st is not None and n <= THREAD_HISTORY_TURNS:
+        with _hot_lock:
+            entry = _hot.get(key)
+            if entry is not None and entry['ino'] == st.st_ino and entry['size'] == st.st_size:
+                _hot.move_to_end(key)
+                _stats['hot_hits'] += 1
+                return [dict(t) for t in list(entry['turns'])[-n:]] if n > 0 else []
+            grown = entry is not None and entry['ino'] == st.st_ino and entry['size'] < st.st_size
+            offset = entry['size'] if grown else 0
+        if grown:
+            # Worker lain menambah giliran: baca byte barunya saja
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            if data.endswith(b'\n'):
+                with _hot_lock:
+                    entry = _hot.get(key)
+                    if entry is not None and entry['size'] == offset:
+                        entry['turns'].extend(_parse(data.split(b'\n')))
+                        entry['size'] = offset + len(data)
+                        _stats['incremental_reads'] += 1
+                        return [dict(t) for t in list(entry['turns'])[-n:]] if n > 0 else []
+    if st is None and not os.path.exists(legacy_path(user_id, thread_id)):
+        return []
+    with _ThreadLock(path) as lock:
+        _migrate_legacy(user_id, thread_id, lock)
+        turns, size = _read_tail(lock.f, max(n, THREAD_HISTORY_TURNS))
+        ino = os.fstat(lock.f.fileno()).st_ino
+    _stats['tail_reads'] += 1
+    _remember(key, turns, size, ino)
+    return [dict(t) for t in turns[-n:]] if n > 0 else []
+
+def load_all(user_id, thread_id):
+    """Seluruh riwayat thread yang tersimpan (setelah compaction: THREAD_MAX_TURNS terakhir)."""
+    path = thread_path(user_id, thread_id)
+    if not os.path.exists(path) and not os.path.exists(legacy_path(user_id, thread_id)):
+        return []
+    with _ThreadLock(path) as lock:
+        _migrate_legacy(user_id, thread_id, lock)
+        turns, _ = _read_tail(lock.f, None)
+    return turns
+
+
+# --- Writing ---
+
+def append_turn(user_id, thread_id, turn):
+    """Tambahkan satu giliran di akhir log thread (O(1))."""
+    key = (user_id, thread_id)
+    path = thread_path(user_id, thread_id)
+    data = _encode(turn)
+    with _ThreadLock(path) as lock:
+        _migrate_legacy(user_id, thread_id, lock)
+        f = lock.f
+        f.seek(0, os.SEEK_END)
+        before = f.tell()
+        if before > 0:
+            f.seek(before - 1)
+            if f.read(1) != b'\n':
+                # Baris terakhir terpotong: mulai baris baru supaya giliran ini tetap utuh
+                data = b'\n' + data
+        f.write(data)
+        f.flush()
+        after = before + len(data)
+        ino = os.fstat(f.fileno()).st_ino
+    _stats['appends'] += 1
+    with _hot_lock:
+        entry = _hot.get(key)
+        if entry is not None:
+            if entry['ino'] == ino and entry['size'] == before:
+                entry['turns'].append(dict(turn))
+                entry['size'] = after
+                _hot.move_to_end(key)
+            else:
+                _hot.pop(key, None)
+    if THREAD_COMPACT_BYTES > 0 and after > THREAD_COMPACT_BYTES:
+        _schedule_compaction(user_id, thread_id)
+
+def replace(user_id, thread_id, turns):
+    """Tulis ulang seluruh riwayat thread (kompatibilitas untuk faiss_service.save_thread)."""
+    path = thread_path(user_id, thread_id)
+    with _ThreadLock(path) as lock:
+        _rewrite(path, lock, [t for t in turns if isinstance(t, dict)])
+    with _hot_lock:
+        _hot.pop((user_id, thread_id), None)
+
+def _rewrite(path, lock, turns):
+    # Tulis ke file sementara lalu ganti; penulis lain yang menunggu flock akan melihat inode baru
+    tmp = f'{path}.tmp{os.getpid()}'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(_encode(t) for t in turns))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# --- Compaction ---
+
+def compact(user_id, thread_id):
+    """Buang baris rusak dan giliran di luar THREAD_MAX_TURNS terakhir; return jumlah giliran tersisa."""
+    path = thread_path(user_id, thread_id)
+    if not os.path.exists(path):
+        return 0
+    with _ThreadLock(path) as lock:
+        turns, _ = _read_tail(lock.f, None)
+        if THREAD_MAX_TURNS > 0:
+            turns = turns[-THREAD_MAX_TURNS:]
+        _rewrite(path, lock, turns)
+    with _hot_lock:
+        _hot.pop((user_id, thread_id), None)
+    _stats['compactions'] += 1
+    return len(turns)
+
+def _compact_loop():
+    while True:
+        _compact_event.wait()
+        with _compactor_lock:
+            keys = list(_compact_queue)
+            _compact_queue.clear()
+            _compact_event.clear()
+        for user_id, thread_id in keys:
+            try:
+                kept = compact(user_id, thread_id)
+                print(f"[THREAD] Compaction {user_id}_{thread_id}: {kept} giliran disimpan", file=sys.stderr)
+            except Exception as e:
+                print(f"[THREAD] Compaction gagal {user_id}_{thread_id}: {e}", file=sys.stderr)
+
+def _schedule_compaction(user_id, thread_id):
+    with _compactor_lock:
+        if _compactor['pid'] != os.getpid():
+            _compactor['pid'] = os.getpid()
+            threading.Thread(target=_compact_loop, name='thread-compactor', daemon=True).start()
+        _compact_queue.add((user_id, thread_id))
+        _compact_event.set()
+
+def stats():
+    out = dict(_stats)
+    out['hot_threads'] = len(_hot)
+    return out
+
+
+# --- Migrasi <thread>.json ---
+
+def migrate_all(directory=None):
+    """Buat file JSONL untuk setiap <user>_<thread>.json lama yang belum punya; return jumlahnya."""
+    global THREADS_DIR
+    if directory:
+        THREADS_DIR = directory
+    count = 0
+    for legacy in sorted(glob.glob(os.path.join(glob.escape(THREADS_DIR), '*.json'))):
+        path = legacy[:-len('.json')] + '.jsonl'
+        name = os.path.basename(legacy)[:-len('.json')]
+        user_id, _, thread_id = name.partition('_')
+        if thread_path(user_id, thread_id) != path:
+            continue
+        with _ThreadLock(path) as lock:
+            count += _migrate_legacy(user_id, thread_id, lock)
+    return count
+
+
+if __name__ == '__main__':
+    print(f"{migrate_all(sys.argv[1] if len(sys.argv) > 1 else None)} thread dimigrasi")
@@ -0,0 +1,249 @@
+"""Per-request stage timing for /answer and /upload, as JSON logs and Prometheus metrics.
+
+A trace is started per request (or per upload job) and kept in a
+contextvar, so the services mark their stages with
+
+    with tracing.span('embedding') as s:
+        s['cached'] = True
+
+without passing it around. asyncio.to_thread copies the context by itself;
+work handed to a thread pool keeps it through tracing.wrap(fn). A span
+outside any trace still feeds the metrics.
+
+When a trace finishes it is written to stderr as one JSON line
+({"event": "trace", ...}, TRACE_LOG=0 turns that off) and summary()
+returns the same data for the debug field of a response. Every span is
+observed in the rag_stage_seconds histogram and every trace in
+rag_request_seconds; render_metrics() returns those, the OpenAI token
+counters and the cache hit/miss counters in the Prometheus text format
+for /metrics. Metrics live in the process: each gunicorn worker reports
+its own numbers.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+
+TRACE_LOG = os.getenv('TRACE_LOG', '1') == '1'
+# Batas atas bucket histogram latency (detik)
+LATENCY_BUCKETS = tuple(float(b) for b in os.getenv(
+    'TRACE_BUCKETS', '0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60').split(','))
+
+_current = contextvars.ContextVar('rag_trace', default=None)
+_lock = threading.Lock()
+_histograms = {}  # key: (metric, labels tuple), value: [bucket counts..., sum, count]
+_counters = {}    # key: (metric, labels tuple), value: float
+
+HELP = {
+    'rag_request_seconds': ('histogram', 'End-to-end time of a traced request or upload job, by kind.'),
+    'rag_stage_seconds': ('histogram', 'Time spent in one stage of a request, by kind and stage.'),
+    'rag_openai_tokens_total': ('counter', 'OpenAI tokens reported in API responses, by call type and token kind.'),
+    'rag_requests_total': ('counter', 'Traced requests by kind and status.'),
+}
+
+
+# --- Metrics ---
+
+def _labels(**labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+def observe(metric, seconds, **labels):
+    """Add one observation (seconds) to a histogram."""
+    key = (metric, _labels(**labels))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                h[i] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+def inc(metric, value=1, **labels):
+    key = (metric, _labels(**labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def record_tokens(call_type, usage):
+    """Count the tokens of one OpenAI response ('usage' object) and add them to the current trace."""
+    usage = usage or {}
+    for kind in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+        if usage.get(kind):
+            inc('rag_openai_tokens_total', int(usage[kind]), type=call_type, token=kind[:-len('_tokens')])
+    trace = _current.get()
+    if trace is not None and usage.get('total_tokens'):
+        with trace._lock:
+            tokens = trace.attrs.setdefault('tokens', {})
+            tokens[call_type] = tokens.get(call_type, 0) + int(usage['total_tokens'])
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"'.replace('\n', ' ') for k, v in items) + '}'
+
+def render_metrics(caches=None):
+    """All metrics in the Prometheus text format.
+
+    caches maps a cache name to its stats() dict; its hits/misses become
+    rag_cache_requests_total and rag_cache_hit_ratio.
+    """
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+    lines = []
+    for metric in sorted({k[0] for k in histograms} | {k[0] for k in counters} | set(HELP)):
+        kind, text = HELP.get(metric, ('untyped', metric))
+        lines += [f'# HELP {metric} {text}', f'# TYPE {metric} {kind}']
+        for (name, labels), h in sorted(histograms.items()):
+            if name != metric:
+                continue
+            # Bucket Prometheus kumulatif: observe() sudah menghitung ke setiap bucket >= nilai
+            for bound, count in zip(LATENCY_BUCKETS, h):
+                lines.append(f'{metric}_bucket{_fmt_labels(labels, [("le", repr(bound))])} {count}')
+            lines.append(f'{metric}_bucket{_fmt_labels(labels, [("le", "+Inf")])} {h[-1]}')
+            lines.append(f'{metric}_sum{_fmt_labels(labels)} {h[-2]:.6f}')
+            lines.append(f'{metric}_count{_fmt_labels(labels)} {h[-1]}')
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f'{metric}{_fmt_labels(labels)} {value:g}')
+    if caches:
+        lines += ['# HELP rag_cache_requests_total Cache lookups by cache and result.',
+                  '# TYPE rag_cache_requests_total counter']
+        ratios = []
+        for name, stats in sorted(caches.items()):
+            hits = (stats.get('hits') or 0) + (stats.get('memory_hits') or 0) + (stats.get('disk_hits') or 0)
+            misses = stats.get('misses') or 0
+            lines.append(f'rag_cache_requests_total{{cache="{name}",result="hit"}} {hits}')
+            lines.append(f'rag_cache_requests_total{{cache="{name}",result="miss"}} {misses}')
+            ratios.append(f'rag_cache_hit_ratio{{cache="{name}"}} {hits / (hits + misses) if hits + misses else 0:.4f}')
+        lines += ['# HELP rag_cache_hit_ratio Cache hits / lookups since the process started.',
+                  '# TYPE rag_cache_hit_ratio gauge'] + ratios
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    """Forget all metrics (for benchmarks and tests)."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+# --- Traces and spans ---
+
+class Trace:
+    """Spans of one request; use trace() / start() instead of creating it directly."""
+
+    def __init__(self, kind, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.attrs = {k: v for k, v in attrs.items() if v is not None}
+        self.spans = []
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._total = None
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, end, **attrs):
+        """Record a stage that ran from start to end (time.perf_counter values)."""
+        entry = {'name': name, 'start_ms': round((start - self._start) * 1000, 2),
+                 'ms': round((end - start) * 1000, 2)}
+        entry.update(attrs)
+        with self._lock:
+            self.spans.append(entry)
+        observe('rag_stage_seconds', end - start, kind=self.kind, stage=name)
+
+    def annotate(self, **attrs):
+        with self._lock:
+            self.attrs.update({k: v for k, v in attrs.items() if v is not None})
+
+    @contextmanager
+    def activate(self):
+        """Make this the current trace inside the block (for generators that yield between stages)."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def finish(self, status='ok', **attrs):
+        """End the trace once: observe it, log it as JSON and return summary()."""
+        with self._lock:
+            if self._total is not None:
+                return self.summary()
+            self._total = time.perf_counter() - self._start
+            self.attrs.update({k: v for k, v in attrs.items() if v is not None})
+            self.attrs['status'] = status
+        observe('rag_request_seconds', self._total, kind=self.kind)
+        inc('rag_requests_total', kind=self.kind, status=status)
+        summary = self.summary()
+        if TRACE_LOG:
+            print(json.dumps(dict(summary, event='trace', ts=round(self.started_at, 3)), ensure_ascii=False, default=str),
+                  file=sys.stderr, flush=True)
+        return summary
+
+    def summary(self):
+        """{'trace_id', 'kind', 'total_ms', 'stages': {name: ms}, 'spans': [...], ...attrs}."""
+        with self._lock:
+            total = self._total if self._total is not None else time.perf_counter() - self._start
+            spans = [dict(s) for s in self.spans]
+            attrs = dict(self.attrs)
+        stages = {}
+        for s in spans:
+            stages[s['name']] = round(stages.get(s['name'], 0.0) + s['ms'], 2)
+        out = {'trace_id': self.id, 'kind': self.kind, 'total_ms': round(total * 1000, 2), 'stages': stages, 'spans': spans}
+        out.update(attrs)
+        return out
+
+def current():
+    """The trace of the running request, or None."""
+    return _current.get()
+
+@contextmanager
+def trace(kind, **attrs):
+    """Run the block as one traced request; finishes the trace (status 'error' on an exception)."""
+    t = Trace(kind, **attrs)
+    token = _current.set(t)
+    try:
+        yield t
+    except BaseException as e:
+        t.finish('error', error=str(e) or type(e).__name__)
+        raise
+    else:
+        t.finish(t.attrs.get('status') or 'ok')
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def span(name, **attrs):
+    """Time the block as stage `name` of the current trace; yields a dict for extra span attributes."""
+    extra = dict(attrs)
+    start = time.perf_counter()
+    try:
+        yield extra
+    finally:
+        record(name, start, **extra)
+
+def record(name, start, end=None, **attrs):
+    """Record stage `name` that started at `start` (time.perf_counter) and ends now or at `end`."""
+    end = time.perf_counter() if end is None else end
+    t = _current.get()
+    if t is not None:
+        t.add_span(name, start, end, **attrs)
+    else:
+        observe('rag_stage_seconds', end - start, kind='none', stage=name)
+
+def annotate(**attrs):
+    """Add attributes to the current trace (no-op outside a trace)."""
+    t = _current.get()
+    if t is not None:
+        t.annotate(**attrs)
+
+def wrap(fn):
+    """fn bound to a copy of the current context, for ThreadPoolExecutor.submit."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
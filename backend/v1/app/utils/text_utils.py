@@ -22,61 +22,232 @@ def chunk_text(text: str, chunk_size: int = 500):
     return chunks
 import re
 import os
+import sys
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_text(file_path):
+try:
+    import tiktoken
+except ImportError:  # opsional: tanpa tiktoken token dihitung dengan estimasi di bawah
+    tiktoken = None
+
+# Ekstraksi PDF per halaman di process pool (spawn: aman dipakai dari thread job worker).
+# Dokumen kecil (< PDF_PARALLEL_MIN_PAGES halaman) diekstrak langsung di proses ini,
+# karena biaya kirim ke pool lebih besar dari ekstraksinya.
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '8'))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '16'))
+_pool = {'pid': None, 'executor': None}
+_pool_lock = threading.Lock()
+
+
+def _pdf_pool():
+    with _pool_lock:
+        if _pool['pid'] != os.getpid():
+            _pool['executor'] = ProcessPoolExecutor(max_workers=max(PDF_WORKERS, 1),
+                                                    mp_context=multiprocessing.get_context('spawn'))
+            _pool['pid'] = os.getpid()
+        return _pool['executor']
+
+def _extract_pages(file_path, start, end):
+    """Teks halaman [start, end) sebagai list; PyMuPDF dulu, pdfplumber per halaman yang kosong/gagal."""
+    texts = [''] * (end - start)
+    try:
+        import fitz  # PyMuPDF
+        with fitz.open(file_path) as doc:
+            for i in range(start, end):
+                try:
+                    texts[i - start] = doc.load_page(i).get_text() or ''
+                except Exception as e:
+                    print(f"[extract_text] PyMuPDF gagal di halaman {i + 1}: {file_path}: {e}", file=sys.stderr)
+    except Exception as e:
+        print(f"[extract_text] Error extracting PDF with PyMuPDF: {file_path}\n{e}", file=sys.stderr)
+    missing = [i for i in range(start, end) if not texts[i - start].strip()]
+    if missing:
+        # Fallback to pdfplumber, hanya untuk halaman yang tidak menghasilkan teks
+        try:
+            import pdfplumber
+            with pdfplumber.open(file_path) as pdf:
+                for i in missing:
+                    if i < len(pdf.pages):
+                        texts[i - start] = pdf.pages[i].extract_text() or ''
+        except Exception as e:
+            print(f"[extract_text] Error extracting PDF with pdfplumber: {file_path}\n{e}", file=sys.stderr)
+    return texts
+
+def _pdf_page_count(file_path):
+    try:
+        import fitz  # PyMuPDF
+        with fitz.open(file_path) as doc:
+            return doc.page_count
+    except Exception:
+        import pdfplumber
+        with pdfplumber.open(file_path) as pdf:
+            return len(pdf.pages)
+
+def iter_pdf_pages(file_path, workers=None):
+    """Yield (page_number, text) per halaman PDF, berurutan, sambil halaman berikutnya masih diekstrak."""
+    try:
+        n_pages = _pdf_page_count(file_path)
+    except Exception as e:
+        print(f"[extract_text] Gagal membuka PDF: {file_path}\n{e}", file=sys.stderr)
+        return
+    workers = PDF_WORKERS if workers is None else workers
+    step = max(PDF_PAGES_PER_TASK, 1)
+    if workers <= 1 or n_pages < PDF_PARALLEL_MIN_PAGES:
+        for start in range(0, n_pages, step):
+            end = min(start + step, n_pages)
+            yield from zip(range(start + 1, end + 1), _extract_pages(file_path, start, end))
+        return
+    pool = _pdf_pool()
+    ranges = [(start, min(start + step, n_pages)) for start in range(0, n_pages, step)]
+    # Paling banyak 2 task per worker yang sedang berjalan/menunggu, supaya dokumen besar tidak menumpuk di memori
+    pending = []
+    next_range = 0
+    try:
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < workers * 2:
+                start, end = ranges[next_range]
+                pending.append((start, pool.submit(_extract_pages, file_path, start, end)))
+                next_range += 1
+            start, future = pending.pop(0)
+            yield from zip(range(start + 1, start + 1 + step), future.result())
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+def iter_text_pages(file_path):
+    """Yield (page_number, text) untuk .pdf (per halaman) dan .txt (satu halaman)."""
     if not os.path.exists(file_path):
-        return ''
+        return
     if file_path.lower().endswith('.txt'):
         try:
             with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                return f.read()
+                yield 1, f.read()
         except Exception:
-            return ''
+            return
     elif file_path.lower().endswith('.pdf'):
-        # Hybrid: Try PyMuPDF (fitz) first, fallback to pdfplumber if needed
-        try:
-            import fitz  # PyMuPDF
-            text = ''
-            doc = fitz.open(file_path)
-            for page in doc:
-                page_text = page.get_text()
-                if page_text:
-                    text += page_text + '\n'
-            if text.strip():
-                return text
-        except Exception as e:
-            import traceback
-            print(f"[extract_text] Error extracting PDF with PyMuPDF: {file_path}\n{e}")
-            traceback.print_exc()
-        # Fallback to pdfplumber
-        try:
-            import pdfplumber
-            text = ''
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + '\n'
-            return text
-        except Exception as e:
-            print(f"[extract_text] Error extracting PDF with pdfplumber: {file_path}\n{e}")
-            traceback.print_exc()
-            return ''
-    return ''
+        yield from iter_pdf_pages(file_path)
 
-def chunk_text(text, chunk_size=500):
-    # Potong teks per chunk_size karakter, tanpa memotong kata
-    words = text.split()
-    chunks = []
+def extract_text(file_path):
+    # Halaman digabung sekali di akhir (bukan text += per halaman)
+    return ''.join(text + '\n' for _, text in iter_text_pages(file_path) if text)
+
+def iter_chunks(texts, chunk_size=500):
+    """Potong aliran teks (misal per halaman) per chunk_size karakter tanpa memotong kata.
+
+    Hasilnya sama dengan chunk_text pada gabungan teksnya, tetapi chunk pertama
+    sudah keluar sebelum seluruh dokumen selesai diekstrak.
+    """
     chunk = []
     total = 0
-    for word in words:
-        if total + len(word) + 1 > chunk_size:
-            chunks.append(' '.join(chunk))
-            chunk = []
-            total = 0
-        chunk.append(word)
-        total += len(word) + 1
+    for text in texts:
+        for word in text.split():
+            if total + len(word) + 1 > chunk_size:
+                yield ' '.join(chunk)
+                chunk = []
+                total = 0
+            chunk.append(word)
+            total += len(word) + 1
     if chunk:
-        chunks.append(' '.join(chunk))
-    return chunks
+        yield ' '.join(chunk)
+
+def chunk_text(text, chunk_size=500):
+    # Potong teks per chunk_size karakter, tanpa memotong kata
+    return list(iter_chunks([text], chunk_size))
+
+
+# Chunker berbasis token: chunk paling banyak CHUNK_TOKENS token, dipotong di batas
+# kalimat/paragraf, dengan CHUNK_OVERLAP_TOKENS token kalimat terakhir diulang di chunk berikutnya.
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '256'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '32'))
+CHUNK_TOKENIZER = os.getenv('CHUNK_TOKENIZER', 'cl100k_base')
+# Pre-tokenizer ala cl100k_base (tanpa \p{L}, yang tidak ada di modul re)
+_PIECE_RE = re.compile(r"'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+", re.IGNORECASE)
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+# Akhir kalimat: tanda baca setelah minimal 2 karakter kata, supaya inisial ("M.") dan nomor daftar ("2.") tidak memotong
+_SENTENCE_RE = re.compile(r'(?<=\w\w[.!?])\s+')
+_encoder = {}
+
+
+def estimate_tokens(text):
+    """Perkiraan jumlah token cl100k tanpa tiktoken: potongan pre-tokenizer, kira-kira 4 karakter per token."""
+    return sum((len(piece.strip()) + 3) // 4 for piece in _PIECE_RE.findall(text))
+
+def count_tokens(text):
+    """Jumlah token text dengan tiktoken (CHUNK_TOKENIZER) jika terpasang, selain itu estimate_tokens."""
+    if tiktoken is not None and 'encoding' not in _encoder:
+        try:
+            _encoder['encoding'] = tiktoken.get_encoding(CHUNK_TOKENIZER)
+        except Exception as e:
+            print(f"[CHUNK] Tokenizer {CHUNK_TOKENIZER} tidak tersedia, pakai estimasi: {e}", file=sys.stderr)
+            _encoder['encoding'] = None
+    encoding = _encoder.get('encoding')
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def _sentences(pages, max_tokens):
+    """Yield (page, kalimat, token, awal_paragraf); kalimat yang lebih dari max_tokens dipotong per kata."""
+    for page, text in pages:
+        for paragraph in _PARAGRAPH_RE.split(text or ''):
+            paragraph_start = True
+            for sentence in _SENTENCE_RE.split(' '.join(paragraph.split())):
+                if not sentence:
+                    continue
+                tokens = count_tokens(sentence)
+                if tokens <= max_tokens:
+                    yield page, sentence, tokens, paragraph_start
+                    paragraph_start = False
+                    continue
+                part, part_tokens = [], 0
+                for word in sentence.split(' '):
+                    word_tokens = count_tokens(' ' + word)
+                    if part and part_tokens + word_tokens > max_tokens:
+                        yield page, ' '.join(part), part_tokens, paragraph_start
+                        paragraph_start = False
+                        part, part_tokens = [], 0
+                    part.append(word)
+                    part_tokens += word_tokens
+                if part:
+                    yield page, ' '.join(part), part_tokens, paragraph_start
+                    paragraph_start = False
+
+def _join_chunk(window, total):
+    text = ''
+    for i, (_, sentence, _, paragraph_start) in enumerate(window):
+        if i:
+            text += '\n' if paragraph_start else ' '
+        text += sentence
+    return {'text': text, 'page': window[0][0], 'tokens': total}
+
+def iter_token_chunks(pages, max_tokens=None, overlap=None):
+    """Chunk aliran (page_number, text) menjadi dict {'text', 'page', 'tokens'}.
+
+    Kalimat tidak pernah dipotong kecuali satu kalimat sudah melebihi max_tokens;
+    'page' adalah halaman tempat chunk dimulai. Input bisa langsung
+    iter_text_pages(), jadi chunk pertama keluar sebelum ekstraksi selesai.
+    """
+    max_tokens = max(CHUNK_TOKENS if max_tokens is None else max_tokens, 1)
+    overlap = min(CHUNK_OVERLAP_TOKENS if overlap is None else overlap, max_tokens // 2)
+    window, total, fresh = [], 0, False
+    for sentence in _sentences(pages, max_tokens):
+        tokens = sentence[2]
+        if fresh and total + tokens > max_tokens:
+            yield _join_chunk(window, total)
+            # Ekor chunk (kalimat utuh, paling banyak overlap token) mengawali chunk berikutnya
+            keep, kept = [], 0
+            for item in reversed(window):
+                if kept + item[2] > overlap:
+                    break
+                keep.insert(0, item)
+                kept += item[2]
+            window, total, fresh = keep, kept, False
+        while window and total + tokens > max_tokens:
+            total -= window.pop(0)[2]
+        window.append(sentence)
+        total += tokens
+        fresh = True
+    if fresh:
+        yield _join_chunk(window, total)
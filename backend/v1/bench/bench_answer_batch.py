@@ -0,0 +1,89 @@
+"""A regression run of --questions questions: one /answer call each versus one /answer/batch.
+
+Starts the fake OpenAI server and the Flask app on local ports and builds a
+synthetic kategori in a scratch vector dir. The same questions (answer cache
+bypassed, a new thread per question) are then sent one /answer at a time,
+the way the regression scripts do today, and as a single /answer/batch
+request. Prints wall time, embedding requests made, and the summary line of
+the batch stream.
+
+    python bench_answer_batch.py --questions 200 --latency 0.1 --token-latency 0.005 --concurrency 16
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+sys.path.insert(0, HERE)
+
+from fake_openai import add_server_args, server_kwargs, start_server  # noqa: E402
+from bench_answer_stream import build_category, start_app  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=100)
+    parser.add_argument('--chunks', type=int, default=5000)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=8)
+    add_server_args(parser)
+    parser.set_defaults(dim=256, answer_tokens=20, token_latency=0.005)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_batch_')
+    fake, fake_url = start_server(**server_kwargs(args))
+    os.environ.update({'OPENAI_BASE_URL': fake_url, 'OPENAI_API_KEY': 'fake',
+                       'RAG_VECTOR_DIR': scratch, 'EMBED_CACHE': '0', 'PORTAL_API_URL': ''})
+    try:
+        import requests
+        from services import faiss_service, thread_store
+        faiss_service.THREADS_DIR = thread_store.THREADS_DIR = os.path.join(scratch, 'threads')
+        os.makedirs(faiss_service.THREADS_DIR, exist_ok=True)
+        build_category('bench', args.dim, args.chunks)
+        app_server, url = start_app()
+        session = requests.Session()
+        questions = [f'pertanyaan regresi nomor {i} tentang pasal {i % 37}' for i in range(args.questions)]
+
+        before = dict(fake.stats)
+        start = time.perf_counter()
+        for i, q in enumerate(questions):
+            resp = session.post(f'{url}/answer', json={'question': q, 'kategori': 'bench', 'top_k': args.top_k,
+                                                       'bypass_cache': True, 'user_id': 'bench', 'thread_id': f'one{i}'})
+            assert resp.json().get('ok'), resp.text
+        single_s = time.perf_counter() - start
+        single_requests = fake.stats['requests'] - before['requests']
+
+        before = dict(fake.stats)
+        start = time.perf_counter()
+        first = None
+        records = []
+        with session.post(f'{url}/answer/batch', stream=True, json={
+                'questions': questions, 'kategori': 'bench', 'top_k': args.top_k,
+                'bypass_cache': True, 'concurrency': args.concurrency}) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if line:
+                    records.append(json.loads(line))
+                    first = first or time.perf_counter() - start
+        batch_s = time.perf_counter() - start
+        batch_requests = fake.stats['requests'] - before['requests']
+        summary = records[-1]
+        assert summary['type'] == 'summary' and summary['answered'] == len(questions), summary
+
+        print(f'{len(questions)} questions, {args.chunks} chunks, chat concurrency {args.concurrency}')
+        print(f'/answer x{len(questions):<5} {single_s:8.2f} s   {single_requests} upstream requests')
+        print(f'/answer/batch    {batch_s:8.2f} s   {batch_requests} upstream requests, first line after {first * 1000:.0f} ms')
+        print('summary', json.dumps({k: v for k, v in summary.items() if k != 'type'}))
+        app_server.shutdown()
+    finally:
+        fake.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Time-to-first-token of /answer/stream versus the blocking /answer.
+
+Starts the fake OpenAI server and the Flask app on local ports, builds a small
+synthetic kategori in a scratch vector dir, then asks --questions questions
+through both endpoints (answer cache bypassed). For the stream it records when
+the `sources` event, the first `delta` and `done` arrive; for /answer only the
+full response time exists.
+
+    python bench_answer_stream.py --questions 10 --token-latency 0.03 --answer-tokens 120
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+sys.path.insert(0, HERE)
+
+from fake_openai import add_server_args, server_kwargs, start_server  # noqa: E402
+
+
+def build_category(kategori, dim, chunks):
+    import numpy as np
+    from services import faiss_service
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((chunks, dim), dtype='float32')
+    metas = [{'source': f'doc{i // 50}.pdf', 'chunk_index': i, 'text': f'potongan teks nomor {i} ' * 20,
+              'kategori': kategori, 'regional': 'Regional 1'} for i in range(chunks)]
+    faiss_service.create_or_update_index(vectors, metas, *faiss_service.get_index_and_meta_file(kategori))
+
+
+def start_app():
+    from werkzeug.serving import make_server
+    from main import app
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def ask_blocking(session, url, body):
+    start = time.perf_counter()
+    resp = session.post(f'{url}/answer', json=body)
+    resp.raise_for_status()
+    assert resp.json().get('ok'), resp.text
+    return {'total': time.perf_counter() - start}
+
+
+def ask_stream(session, url, body):
+    start = time.perf_counter()
+    marks = {}
+    event = None
+    with session.post(f'{url}/answer/stream', json=body, stream=True) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines(chunk_size=None):
+            if line.startswith(b'event:'):
+                event = line[6:].strip().decode()
+            elif line.startswith(b'data:'):
+                if event == 'error':
+                    raise RuntimeError(json.loads(line[5:]))
+                key = {'sources': 'sources', 'delta': 'first_delta', 'done': 'total'}.get(event)
+                if key and key not in marks:
+                    marks[key] = time.perf_counter() - start
+    return marks
+
+
+def summary(rows, key):
+    values = [r[key] * 1000 for r in rows if key in r]
+    return f'p50 {statistics.median(values):8.1f} ms   max {max(values):8.1f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--top-k', type=int, default=5)
+    add_server_args(parser)
+    parser.set_defaults(dim=256)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_stream_')
+    fake, fake_url = start_server(**server_kwargs(args))
+    os.environ.update({'OPENAI_BASE_URL': fake_url, 'OPENAI_API_KEY': 'fake',
+                       'RAG_VECTOR_DIR': scratch, 'EMBED_CACHE': '0', 'PORTAL_API_URL': ''})
+    try:
+        import requests
+        from services import faiss_service, thread_store
+        faiss_service.THREADS_DIR = thread_store.THREADS_DIR = os.path.join(scratch, 'threads')
+        os.makedirs(faiss_service.THREADS_DIR, exist_ok=True)
+        build_category('bench', args.dim, args.chunks)
+        app_server, url = start_app()
+        session = requests.Session()
+
+        blocking, streamed = [], []
+        for i in range(args.questions):
+            # Setiap pertanyaan thread baru, supaya tidak ada panggilan rephrase
+            body = {'question': f'pertanyaan uji nomor {i}', 'kategori': 'bench', 'top_k': args.top_k,
+                    'bypass_cache': True, 'user_id': 'bench', 'thread_id': f'b{i}'}
+            blocking.append(ask_blocking(session, url, body))
+            streamed.append(ask_stream(session, url, dict(body, thread_id=f's{i}')))
+
+        print(f'{args.questions} questions, {args.answer_tokens} tokens/answer, {args.token_latency * 1000:.0f} ms/token')
+        print(f'/answer          full response : {summary(blocking, "total")}')
+        print(f'/answer/stream   sources event : {summary(streamed, "sources")}')
+        print(f'/answer/stream   first delta   : {summary(streamed, "first_delta")}')
+        print(f'/answer/stream   done event    : {summary(streamed, "total")}')
+        app_server.shutdown()
+    finally:
+        fake.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""BM25 inverted index: ingest cost, postings size and query latency.
+
+Builds a scratch BM25 index of --chunks synthetic chunks through
+bm25_index.add_segment, --batch chunks per call like one upload each, so
+segment merges happen as they would in production. Chunk text is drawn
+from a Zipf vocabulary of --vocab words, and about one chunk in 1000 gets a
+regulation code like "pp-45/2023".
+
+Reported:
+  build        total and per-upload add_segment time, final segment count
+  size         postings on disk against int32 doc + int32 tf postings
+  queries      p50 / p95 latency of bm25_index.search (top --top) for
+               rare-code, mixed and common-word queries, over the final
+               segments, also with an `allowed` mask (regional filter)
+
+    python bench_bm25.py --chunks 1000000 --batch 20000
+"""
+import argparse
+import glob
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+
+def make_texts(rng, words, start, n, length):
+    # Zipf rank -> word; ranks above the vocabulary fold back into it
+    ranks = (rng.zipf(1.2, size=(n, length)) - 1) % len(words)
+    texts = [' '.join(words[r] for r in row) for row in ranks]
+    for i in np.flatnonzero(rng.random(n) < 0.001):
+        texts[i] += f' pp-{(start + i) % 97}/{2000 + (start + i) % 24}'
+    return texts
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=20000, help='chunks per add_segment call (one upload)')
+    parser.add_argument('--vocab', type=int, default=50000)
+    parser.add_argument('--length', type=int, default=40, help='words per chunk')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top', type=int, default=50)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_bm25_')
+    from services import bm25_index
+    rng = np.random.default_rng(0)
+    words = [f'kata{i}' for i in range(args.vocab)]
+    try:
+        bm25, upload_s, n_postings = None, [], 0
+        for start in range(0, args.chunks, args.batch):
+            n = min(args.batch, args.chunks - start)
+            texts = make_texts(rng, words, start, n, args.length)
+            t0 = time.perf_counter()
+            bm25 = bm25_index.add_segment(scratch, 'bm25_bench', bm25, np.arange(start, start + n), texts)
+            upload_s.append(time.perf_counter() - t0)
+        bm25_index.remove_unreferenced(scratch, 'bm25_bench', {s['name'] for s in bm25['segments']})
+        for s in bm25['segments']:
+            n_postings += len(np.load(os.path.join(scratch, s['name'] + '.tfs.npy'), mmap_mode='r'))
+        disk = sum(os.path.getsize(p) for p in glob.glob(os.path.join(scratch, '*')))
+        print(f"{args.chunks} chunks, {args.length} words each, vocabulary {args.vocab}")
+        print(f"build   : {sum(upload_s):.1f} s total, {statistics.median(upload_s) * 1000:.0f} ms median / "
+              f"{max(upload_s) * 1000:.0f} ms max per {args.batch}-chunk upload, {len(bm25['segments'])} segments")
+        print(f"size    : {disk / 2**20:.1f} MiB on disk for {n_postings} postings "
+              f"(int32 doc + tf: {n_postings * 8 / 2**20:.1f} MiB)")
+
+        queries = {
+            'rare code': [f'pasal pp-{i % 97}/{2000 + i % 24}' for i in range(args.queries)],
+            'mixed': [f'{words[i % 50]} {words[1000 + i * 37 % 20000]} {words[5000 + i * 13 % 40000]}'
+                      for i in range(args.queries)],
+            'common': [f'{words[i % 5]} {words[5 + i % 10]}' for i in range(args.queries)],
+        }
+        allowed = rng.random(args.chunks) < 0.3
+        for warm in queries['mixed'][:10]:
+            bm25_index.search(scratch, bm25, warm, args.top)
+        print(f"query   : top {args.top}, {args.queries} queries each")
+        for name, qs in queries.items():
+            for label, mask in (('', None), (' (30% allowed)', allowed)):
+                samples = []
+                for q in qs:
+                    t0 = time.perf_counter()
+                    bm25_index.search(scratch, bm25, q, args.top, mask)
+                    samples.append((time.perf_counter() - t0) * 1000)
+                p50, p95 = percentiles(samples)
+                print(f"  {name + label:<26}: p50 {p50:7.2f} ms  p95 {p95:7.2f} ms")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Throughput and chunk-size spread: chunk_text versus iter_token_chunks.
+
+Extracts the PDFs in --docs (default: app/docs/hukum) once, repeats the
+pages until the corpus is about --mb megabytes, then chunks it with the old
+500-character chunk_text and with the streaming token chunker. Reports MB/s
+and the token count per chunk (min/p50/p95/max, stdev). The spread is what
+matters for sizing embedding batches and prompt budgets. Tokens are counted
+with tiktoken when it is installed, otherwise with the built-in estimate.
+
+    python bench_chunker.py --mb 5 --tokens 256 --overlap 32
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+from utils import text_utils  # noqa: E402
+
+DEFAULT_DOCS = os.path.join(HERE, '..', 'app', 'docs', 'hukum')
+
+
+def load_pages(docs, mb):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(docs, '*.pdf'))):
+        pages.extend(text for _, text in text_utils.iter_pdf_pages(path, workers=1))
+    pages = [p for p in pages if p.strip()]
+    if not pages:
+        sys.exit(f'no text extracted from {docs}')
+    size = sum(len(p.encode('utf-8')) for p in pages)
+    repeat = max(1, int(mb * 1024 * 1024 / size))
+    return [(i + 1, text) for i, text in enumerate(pages * repeat)]
+
+
+def describe(name, elapsed, mb, counts):
+    counts = sorted(counts)
+    p95 = counts[min(len(counts) - 1, int(len(counts) * 0.95))]
+    print(f'{name:<22} {mb / elapsed:7.2f} MB/s  {len(counts):7d} chunks  tokens/chunk '
+          f'min {counts[0]:4d}  p50 {statistics.median(counts):6.1f}  p95 {p95:4d}  max {counts[-1]:4d}  '
+          f'stdev {statistics.pstdev(counts):6.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', default=DEFAULT_DOCS)
+    parser.add_argument('--mb', type=float, default=2.0, help='approximate corpus size')
+    parser.add_argument('--tokens', type=int, default=text_utils.CHUNK_TOKENS)
+    parser.add_argument('--overlap', type=int, default=text_utils.CHUNK_OVERLAP_TOKENS)
+    args = parser.parse_args()
+
+    pages = load_pages(args.docs, args.mb)
+    mb = sum(len(t.encode('utf-8')) for _, t in pages) / (1024 * 1024)
+    tokenizer = 'tiktoken ' + text_utils.CHUNK_TOKENIZER if text_utils.tiktoken else 'estimate (tiktoken not installed)'
+    print(f'{len(pages)} pages, {mb:.2f} MB, tokenizer: {tokenizer}')
+
+    start = time.perf_counter()
+    old = text_utils.chunk_text('\n'.join(t for _, t in pages), 500)
+    old_elapsed = time.perf_counter() - start
+    # Token counts measured outside the timed section; chunk_text itself does not count tokens
+    describe('chunk_text (500 chars)', old_elapsed, mb, [text_utils.count_tokens(c) for c in old])
+
+    for overlap in sorted({0, args.overlap}):
+        start = time.perf_counter()
+        chunks = list(text_utils.iter_token_chunks(iter(pages), args.tokens, overlap))
+        elapsed = time.perf_counter() - start
+        describe(f'tokens={args.tokens} overlap={overlap}', elapsed, mb, [c['tokens'] for c in chunks])
+
+
+if __name__ == '__main__':
+    main()
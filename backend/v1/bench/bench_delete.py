@@ -0,0 +1,102 @@
+"""Cost of deleting one small document from a large kategori.
+
+Builds a scratch kategori of --docs documents of --chunks vectors each
+(plus one small document of --small chunks), then deletes the small
+document two ways:
+
+  rebuild    the previous delete_source: reconstruct every kept vector,
+             build a new index with the kategori's spec and rewrite the
+             metadata without the deleted rows
+  remove_ids faiss_service.delete_source: remove_ids by stable id
+             and a tombstone in the metadata header
+
+Both are run for every --types entry on a fresh copy of the kategori. The
+final row shows the background compaction that later drops the tombstones.
+
+    python bench_delete.py --docs 200 --chunks 500 --types flat ivfflat hnsw
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+
+def legacy_delete(fs, meta_store, filename, index_file, meta_file):
+    """The previous delete_source (filter, reconstruct, rebuild)."""
+    import faiss
+    with fs.write_lock(index_file):
+        snap = fs.read_snapshot(index_file, meta_file)
+        index = faiss.read_index(snap['index'])
+        metas = meta_store.open_meta(meta_file, snap['meta'])
+        drop = meta_store.rows_with_value(metas, 'source', filename)
+        keep = np.setdiff1d(np.arange(meta_store.num_rows(metas)), drop)
+        del metas
+        # storage order is not row order for IVF (ids live in the inverted lists)
+        vectors = fs.reconstruct_all(index)[np.argsort(fs.index_ids(index))][keep]
+        spec = fs.resolve_index_spec(fs.get_index_spec(fs._category_from_index_file(index_file)), len(keep), index.d,
+                                     current=fs.index_type_of(index))
+        new_index = fs.build_index(vectors, spec)
+        header = meta_store.stage_select(meta_file, snap['meta'], keep)
+        fs._publish_snapshot(index_file, meta_file, new_index, header, snap)
+    fs.invalidate_index_cache(index_file)
+    return len(drop)
+
+
+def build(fs, kategori, args):
+    index_file, meta_file = fs.get_index_and_meta_file(kategori)
+    rng = np.random.default_rng(0)
+    docs = [(f'doc{d}.pdf', args.chunks) for d in range(args.docs)] + [('small.pdf', args.small)]
+    vectors, metas = [], []
+    for source, n in docs:
+        vectors.append(rng.standard_normal((n, args.dim), dtype='float32'))
+        metas += [{'source': source, 'chunk_index': i, 'text': f'{source}#{i}', 'kategori': kategori} for i in range(n)]
+    fs.create_or_update_index(np.vstack(vectors), metas, index_file, meta_file)
+    return index_file, meta_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=200)
+    parser.add_argument('--chunks', type=int, default=500)
+    parser.add_argument('--small', type=int, default=20)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--types', nargs='+', default=['flat', 'ivfflat', 'hnsw'])
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_delete_')
+    os.environ.update(RAG_VECTOR_DIR=scratch, FAISS_COMPACT_RATIO='2')  # compaction only when asked for
+    from services import faiss_service as fs, meta_store
+    try:
+        with open(os.path.join(scratch, 'index_specs.json'), 'w') as f:
+            f.write('{' + ', '.join(f'"{t}_old": {{"type": "{t}"}}, "{t}_new": {{"type": "{t}"}}' for t in args.types) + '}')
+        fs.INDEX_SPECS_FILE = os.path.join(scratch, 'index_specs.json')
+        total = args.docs * args.chunks + args.small
+        print(f'{total} vectors of dim {args.dim}, deleting a {args.small}-chunk document')
+        print(f'{"type":<8} {"rebuild ms":>11} {"remove_ids ms":>14} {"compact ms":>11}')
+        for kind in args.types:
+            old = build(fs, f'{kind}_old', args)
+            new = build(fs, f'{kind}_new', args)
+            start = time.perf_counter()
+            legacy_delete(fs, meta_store, 'small.pdf', *old)
+            rebuild = time.perf_counter() - start
+            start = time.perf_counter()
+            removed, _ = fs.delete_source('small.pdf', *new)
+            remove = time.perf_counter() - start
+            assert removed == args.small
+            start = time.perf_counter()
+            fs.compact(*new)
+            compact = time.perf_counter() - start
+            print(f'{kind:<8} {rebuild * 1000:11.0f} {remove * 1000:14.0f} {compact * 1000:11.0f}')
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Compare per-chunk embedding (old /upload loop) with the batched pipeline.
+
+Runs against the local fake server, so timings reflect request count and
+concurrency rather than real model latency:
+
+    python bench_embedding.py --chunks 600 --latency 0.15 --per-item 0.001
+"""
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+sys.path.insert(0, HERE)
+
+from fake_openai import add_server_args, server_kwargs, start_server  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=600, help='number of ~500-char chunks')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--skip-sequential', action='store_true', help='only time the batched path')
+    add_server_args(parser)
+    args = parser.parse_args()
+
+    server, url = start_server(**server_kwargs(args))
+    os.environ['OPENAI_BASE_URL'] = url
+    os.environ.setdefault('OPENAI_API_KEY', 'fake')
+    # Both runs embed the same chunks; without this the second one is all cache hits
+    os.environ['EMBED_CACHE'] = '0'
+    from services import embedding_service
+
+    chunks = [f'chunk {i} ' + ('lorem ipsum dolor sit amet ' * 18) for i in range(args.chunks)]
+
+    if not args.skip_sequential:
+        start = time.perf_counter()
+        sequential = [embedding_service.get_embedding(c) for c in chunks]
+        seq_s = time.perf_counter() - start
+        print(f'sequential get_embedding : {seq_s:8.2f}s  ({len(chunks) / seq_s:8.1f} chunks/s, {len(chunks)} requests)')
+
+    before = server.stats['requests']
+    progress = []
+    start = time.perf_counter()
+    batched = embedding_service.get_embeddings(chunks, batch_size=args.batch_size, concurrency=args.concurrency,
+                                               progress_cb=lambda done, total: progress.append(done))
+    bat_s = time.perf_counter() - start
+    print(f'batched get_embeddings   : {bat_s:8.2f}s  ({len(chunks) / bat_s:8.1f} chunks/s, '
+          f'{server.stats["requests"] - before} requests, {server.stats["throttled"]} throttled, '
+          f'{len(progress)} progress events)')
+
+    if not args.skip_sequential:
+        assert batched == sequential, 'batched output is not in chunk order'
+        print(f'speedup                  : {seq_s / bat_s:8.1f}x')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
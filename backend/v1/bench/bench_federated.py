@@ -0,0 +1,105 @@
+"""Searching several kategori one after another versus faiss_service.search_multi.
+
+Builds --categories scratch kategori (the last one --big-factor times larger
+than the others) in a scratch vector dir, then answers --queries random
+queries over all of them:
+
+  sequential  faiss_service.search per kategori, merged by distance afterwards
+  fan-out     faiss_service.search_multi (thread pool, heap merge)
+  deadline    search_multi with --deadline seconds for the big kategori only
+
+and prints p50/p95 latency per mode, plus how often the big kategori was
+skipped under its deadline. The first query of each mode pays the index load.
+
+    python bench_federated.py --categories 6 --chunks 50000 --big-factor 8 --deadline 0.005
+"""
+import argparse
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+
+def build(fs, kategori, n, dim, seed):
+    index_file, meta_file = fs.get_index_and_meta_file(kategori)
+    vectors = np.random.default_rng(seed).standard_normal((n, dim), dtype='float32')
+    metas = [{'source': f'{kategori}.pdf', 'chunk_index': i, 'text': f'{kategori}#{i}', 'kategori': kategori}
+             for i in range(n)]
+    fs.create_or_update_index(vectors, metas, index_file, meta_file)
+
+
+def sequential(fs, vector, categories, k):
+    hits = []
+    for c in categories:
+        index_file, meta_file = fs.get_index_and_meta_file(c)
+        index, metas = fs.load_index_and_meta(index_file, meta_file)
+        D, I = index.search(np.asarray([vector], dtype='float32'), k)
+        hits += [(float(d), c, int(i)) for d, i in zip(D[0], I[0]) if i >= 0]
+    return heapq.nsmallest(k, hits)
+
+
+def percentiles(lat):
+    lat = np.asarray(lat) * 1000
+    return f'p50 {np.percentile(lat, 50):7.2f} ms  p95 {np.percentile(lat, 95):7.2f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--categories', type=int, default=6)
+    parser.add_argument('--chunks', type=int, default=50000)
+    parser.add_argument('--big-factor', type=int, default=8)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--deadline', type=float, default=0.005)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_federated_')
+    os.environ.update(RAG_VECTOR_DIR=scratch, FAISS_INDEX_TYPE='flat')
+    from services import faiss_service as fs
+    try:
+        categories = [f'cat{i}' for i in range(args.categories)]
+        for i, c in enumerate(categories):
+            n = args.chunks * (args.big_factor if i == len(categories) - 1 else 1)
+            build(fs, c, n, args.dim, i)
+        big = categories[-1]
+        print(f'{len(categories)} kategori of {args.chunks} vectors ({big}: {args.chunks * args.big_factor}), dim {args.dim}')
+        queries = np.random.default_rng(99).standard_normal((args.queries, args.dim), dtype='float32')
+
+        lat = []
+        for q in queries:
+            start = time.perf_counter()
+            sequential(fs, q, categories, args.k)
+            lat.append(time.perf_counter() - start)
+        print(f'sequential  {percentiles(lat)}')
+
+        lat = []
+        for q in queries:
+            start = time.perf_counter()
+            fs.search_multi(q, categories, args.k, deadline=60)
+            lat.append(time.perf_counter() - start)
+        print(f'fan-out     {percentiles(lat)}')
+
+        lat, skipped = [], 0
+        deadlines = {c: 60 for c in categories}
+        deadlines[big] = args.deadline
+        for q in queries:
+            timings = {}
+            start = time.perf_counter()
+            fs.search_multi(q, categories, args.k, deadline=deadlines, timings=timings)
+            lat.append(time.perf_counter() - start)
+            skipped += big in timings['skipped']
+        print(f'deadline    {percentiles(lat)}  ({big} skipped {skipped}/{args.queries})')
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Latency of new versus follow-up questions, with and without speculative retrieval.
+
+Builds a synthetic kategori in a scratch vector dir and starts the fake
+OpenAI server. Each round opens a thread with a first question, which needs
+no rephrase. It then asks a real follow-up and a topic change (the fake
+answers 'PERTANYAAN BARU' for the latter). Every question goes through
+ask_llm_with_faiss, with the answer cache off. This runs once with
+LLM_SPECULATIVE_RETRIEVAL off and once with it on, and prints a latency
+histogram per question kind.
+
+    python bench_followup.py --rounds 20 --latency 0.15 --token-latency 0.04
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+sys.path.insert(0, HERE)
+
+from fake_openai import add_server_args, server_kwargs, start_server  # noqa: E402
+from bench_answer_stream import build_category  # noqa: E402
+
+KINDS = ('new', 'follow-up', 'topic change')
+
+
+def run_round(llm_service, mode, i, top_k):
+    thread = f'{mode}-{i}'
+    questions = (('new', f'apa isi pasal {i} tentang kontrak kerja'),
+                 ('follow-up', f'lalu bagaimana sanksinya untuk pasal {i}'),
+                 ('topic change', f'topik baru: prosedur cuti tahunan nomor {i}'))
+    timings = {}
+    for kind, question in questions:
+        start = time.perf_counter()
+        out = llm_service.ask_llm_with_faiss(question, 'bench', user_id='bench', thread_id=thread,
+                                             top_k=top_k, use_cache=False)
+        timings[kind] = time.perf_counter() - start
+        if 'llm_answer' not in out:
+            raise RuntimeError(out)
+    return timings
+
+
+def histogram(values, lo, hi, bins=10, width=40):
+    step = (hi - lo) / bins or 1.0
+    counts = [0] * bins
+    for v in values:
+        counts[min(bins - 1, int((v - lo) / step))] += 1
+    top = max(counts) or 1
+    return [f'    {(lo + b * step) * 1000:7.0f} ms | {"#" * round(c * width / top)} {c}' for b, c in enumerate(counts)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--top-k', type=int, default=5)
+    add_server_args(parser)
+    parser.set_defaults(dim=256, latency=0.15, token_latency=0.04, answer_tokens=20)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_followup_')
+    fake, fake_url = start_server(**server_kwargs(args))
+    os.environ.update({'OPENAI_BASE_URL': fake_url, 'OPENAI_API_KEY': 'fake',
+                       'RAG_VECTOR_DIR': scratch, 'EMBED_CACHE': '0', 'PORTAL_API_URL': ''})
+    try:
+        from services import faiss_service, llm_service, thread_store
+        faiss_service.THREADS_DIR = thread_store.THREADS_DIR = os.path.join(scratch, 'threads')
+        os.makedirs(faiss_service.THREADS_DIR, exist_ok=True)
+        build_category('bench', args.dim, args.chunks)
+
+        results = {}
+        for mode, speculative in (('sequential', False), ('speculative', True)):
+            llm_service.LLM_SPECULATIVE_RETRIEVAL = speculative
+            results[mode] = [run_round(llm_service, mode, i, args.top_k) for i in range(args.rounds)]
+
+        values = [r[k] for rows in results.values() for r in rows for k in KINDS]
+        lo, hi = min(values), max(values)
+        print(f'{args.rounds} rounds, {args.latency * 1000:.0f} ms per API call, '
+              f'{args.token_latency * 1000:.0f} ms per chat token')
+        for kind in KINDS:
+            print(f'\n{kind}')
+            for mode, rows in results.items():
+                times = sorted(r[kind] for r in rows)
+                p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+                print(f'  {mode:<12} p50 {statistics.median(times) * 1000:7.1f} ms   p95 {p95 * 1000:7.1f} ms')
+                print('\n'.join(histogram(times, lo, hi)))
+    finally:
+        fake.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
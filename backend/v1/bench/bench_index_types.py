@@ -0,0 +1,96 @@
+"""Recall-vs-latency report for the index types supported per kategori.
+
+Builds every index type with faiss_service.build_index on the same synthetic
+clustered corpus, sweeps its search knob (nprobe for IVF, efSearch for HNSW)
+and compares single-query results against the exact Flat baseline:
+
+    python bench_index_types.py --n 200000 --dim 256 --queries 300 --k 5
+    python bench_index_types.py --json > report.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+from services import faiss_service  # noqa: E402
+
+SWEEPS = {
+    'flat': [None],
+    'ivfflat': [1, 4, 16, 64],
+    'ivfpq': [1, 4, 16, 64],
+    'hnsw': [16, 64, 256],
+}
+
+
+def synthetic_corpus(n, dim, clusters, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype('float32') * 4
+    labels = rng.integers(0, clusters, n)
+    return centers[labels] + rng.standard_normal((n, dim)).astype('float32')
+
+
+def run_queries(index, queries, k, params):
+    latencies, ids = [], []
+    for q in queries:
+        start = time.perf_counter()
+        _, I = index.search(q[None, :], k, params=params)
+        latencies.append(time.perf_counter() - start)
+        ids.append(I[0])
+    return np.array(latencies), np.array(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--types', default=','.join(SWEEPS), help='comma separated subset of index types')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    data = synthetic_corpus(args.n, args.dim, args.clusters)
+    rng = np.random.default_rng(1)
+    queries = data[rng.choice(args.n, args.queries, replace=False)] + \
+        rng.standard_normal((args.queries, args.dim)).astype('float32') * 0.5
+
+    report = []
+    truth = None
+    for kind in ['flat'] + [t for t in args.types.split(',') if t != 'flat']:
+        spec = faiss_service.resolve_index_spec({'type': kind}, args.n, args.dim)
+        start = time.perf_counter()
+        index = faiss_service.build_index(data, spec)
+        build_s = time.perf_counter() - start
+        for knob in SWEEPS[kind]:
+            params = faiss_service.search_params(index, nprobe=knob, ef_search=knob)
+            lat, ids = run_queries(index, queries, args.k, params)
+            if truth is None:
+                truth = ids
+            recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(ids, truth)])
+            report.append({
+                'type': spec['type'], 'knob': knob, 'build_s': round(build_s, 2),
+                'recall_at_k': round(float(recall), 4),
+                'mean_ms': round(float(lat.mean() * 1000), 3),
+                'p95_ms': round(float(np.percentile(lat, 95) * 1000), 3),
+                'spec': {key: v for key, v in spec.items() if key != 'type'},
+            })
+
+    if args.json:
+        print(json.dumps({'n': args.n, 'dim': args.dim, 'k': args.k, 'results': report}, indent=2))
+        return
+    print(f'n={args.n} dim={args.dim} k={args.k} queries={args.queries}')
+    print(f'{"type":8s} {"knob":>5s} {"build s":>8s} {"recall@k":>9s} {"mean ms":>8s} {"p95 ms":>8s}')
+    for row in report:
+        print(f'{row["type"]:8s} {str(row["knob"] or "-"):>5s} {row["build_s"]:8.2f} {row["recall_at_k"]:9.3f} '
+              f'{row["mean_ms"]:8.3f} {row["p95_ms"]:8.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Measure create_or_update_index cost per upload as a category grows.
+
+Each round appends one "document" of --batch vectors to a scratch category
+and reports how long the index update took. With the incremental path the
+per-upload time should stay roughly flat; --legacy replays the previous
+reconstruct-and-rebuild strategy for comparison.
+
+    python bench_ingest.py --rounds 20 --batch 500 --dim 1536
+    python bench_ingest.py --rounds 20 --batch 500 --dim 1536 --legacy
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+import faiss  # noqa: E402
+from services import faiss_service  # noqa: E402
+
+
+def legacy_create_or_update_index(vectors, metadatas, index_file, meta_file):
+    """The pre-incremental algorithm: reconstruct every stored vector, then re-add one by one."""
+    old_vectors, old_metas = [], []
+    if os.path.exists(index_file):
+        index = faiss.read_index(index_file)
+        old_metas = faiss_service.load_metadata(meta_file)
+        old_vectors = index.reconstruct_n(0, index.ntotal).tolist() if index.ntotal > 0 else []
+    all_vectors = old_vectors + vectors
+    index = faiss.IndexFlatL2(len(all_vectors[0]))
+    for v in all_vectors:
+        index.add(np.array([v]).astype('float32'))
+    faiss.write_index(index, index_file)
+    faiss_service.save_metadata(old_metas + metadatas, meta_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=500, help='vectors per simulated upload')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--legacy', action='store_true', help='benchmark the old full-rebuild path instead')
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='bench_ingest_')
+    index_file = os.path.join(work, 'index_bench.faiss')
+    meta_file = os.path.join(work, 'meta_bench.pkl')
+    update = legacy_create_or_update_index if args.legacy else faiss_service.create_or_update_index
+    rng = np.random.default_rng(0)
+    timings = []
+    try:
+        for r in range(args.rounds):
+            vectors = rng.standard_normal((args.batch, args.dim), dtype='float32').tolist()
+            metas = [{'source': f'doc{r}.pdf', 'chunk_index': i, 'text': 'x' * 500,
+                      'kategori': 'bench', 'regional': 'Regional 1'} for i in range(args.batch)]
+            start = time.perf_counter()
+            update(vectors, metas, index_file, meta_file)
+            timings.append(time.perf_counter() - start)
+            print(f'upload {r + 1:3d}: corpus {(r + 1) * args.batch:8d} vectors  {timings[-1] * 1000:9.1f} ms', flush=True)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    first, last = np.mean(timings[:3]), np.mean(timings[-3:])
+    print(f'{"legacy" if args.legacy else "incremental"}: first 3 uploads {first * 1000:.1f} ms avg, '
+          f'last 3 uploads {last * 1000:.1f} ms avg ({last / first:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Load time and resident memory: pickled metadata vs the columnar meta_store.
+
+Writes a synthetic kategori of --rows chunks in both formats, then, in a
+fresh subprocess per format, opens it and fetches --k random rows the way a
+search does. Reports open+fetch time and the RSS growth of that process.
+
+    python bench_meta_store.py --rows 500000 --k 5
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(HERE, '..', 'app')
+sys.path.insert(0, APP_DIR)
+
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def probe(fmt, path, rows, k):
+    """Runs inside the child process."""
+    import random
+    from services import faiss_service, meta_store
+    ids = random.Random(0).sample(range(rows), k)
+    base = rss_kb()
+    start = time.perf_counter()
+    if fmt == 'pickle':
+        metas = faiss_service.load_metadata(path)
+        result = [metas[i] for i in ids]
+    else:
+        handle = meta_store.open_meta(path)
+        result = meta_store.read_rows(handle, ids)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'format': fmt, 'ms': round(elapsed * 1000, 2), 'rss_delta_mb': round((rss_kb() - base) / 1024, 1),
+                      'rows_returned': len(result)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--probe', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.probe:
+        return probe(args.probe[0], args.probe[1], args.rows, args.k)
+
+    from services import faiss_service, meta_store
+    work = tempfile.mkdtemp(prefix='bench_meta_')
+    try:
+        metas = [{'source': f'dokumen_{i // 300}.pdf', 'chunk_index': i % 300, 'text': f'chunk {i} ' + 'isi pasal ' * 50,
+                  'kategori': 'hukum', 'regional': f'Regional {i % 7}'} for i in range(args.rows)]
+        pkl = os.path.join(work, 'meta_bench.pkl')
+        start = time.perf_counter()
+        faiss_service.save_metadata(metas, pkl)
+        print(f'write pickle   : {time.perf_counter() - start:6.2f}s  {os.path.getsize(pkl) / 2**20:8.1f} MB')
+        start = time.perf_counter()
+        header = meta_store.migrate_pickle(pkl)
+        size = sum(os.path.getsize(os.path.join(work, f)) for f in os.listdir(work) if not f.endswith('.pkl'))
+        print(f'migrate        : {time.perf_counter() - start:6.2f}s  {size / 2**20:8.1f} MB ({header} rows)')
+        del metas
+        for fmt, path in (('pickle', pkl), ('columnar', os.path.join(work, 'meta_bench.json'))):
+            out = subprocess.run([sys.executable, __file__, '--rows', str(args.rows), '--k', str(args.k), '--probe', fmt, path],
+                                 capture_output=True, text=True, check=True).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            print(f'{fmt:9s} open+fetch {args.k} rows: {r["ms"]:9.2f} ms   RSS +{r["rss_delta_mb"]:7.1f} MB')
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
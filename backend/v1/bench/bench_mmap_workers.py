@@ -0,0 +1,132 @@
+"""Per-worker memory with N search workers, with and without FAISS_MMAP.
+
+Builds (once) a large synthetic kategori in a scratch vector dir, then starts
+--workers processes that each load it through faiss_service (the same code
+path as /answer), run a few searches and report their memory from
+/proc/self/smaps_rollup while all workers are alive. Pss splits shared pages
+between the processes mapping them, so it is the number that adds up to the
+machine's real usage; Private is what each worker holds on its own.
+
+    python bench_mmap_workers.py --vectors 200000 --dim 768 --workers 2
+    python bench_mmap_workers.py --vectors 200000 --dim 768 --workers 4 --index-type hnsw
+    python bench_mmap_workers.py --vector-dir ../vector --kategori hukum --workers 4
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(HERE, '..', 'app')
+sys.path.insert(0, APP_DIR)
+
+
+def smaps_mb():
+    out = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+                out[parts[0][:-1]] = int(parts[1]) / 1024
+    return {'rss': out['Rss'], 'pss': out['Pss'], 'private': out['Private_Clean'] + out['Private_Dirty']}
+
+
+def worker(kategori, searches):
+    """Runs inside each child: load + search, report, then wait so all children overlap."""
+    import numpy as np
+    from services import faiss_service
+    before = smaps_mb()  # after imports, so only the index itself is counted
+    start = time.perf_counter()
+    index_file, meta_file = faiss_service.get_index_and_meta_file(kategori)
+    index, _ = faiss_service.load_index_and_meta(index_file, meta_file)
+    load_s = time.perf_counter() - start
+    rng = np.random.default_rng(os.getpid())
+    for _ in range(searches):
+        faiss_service.search(rng.standard_normal(index.d).tolist(), 5, category=kategori)
+    sys.stdout.write(json.dumps({'pid': os.getpid(), 'load_s': load_s, 'before': before}) + '\n')
+    sys.stdout.flush()
+    sys.stdin.readline()  # parent says: everyone is loaded, measure now
+    sys.stdout.write(json.dumps(smaps_mb()) + '\n')
+    sys.stdout.flush()
+    sys.stdin.readline()
+
+
+def build_category(vector_dir, kategori, n, dim, index_type):
+    import numpy as np
+    os.environ['RAG_VECTOR_DIR'] = vector_dir
+    os.environ['FAISS_INDEX_TYPE'] = index_type
+    from services import faiss_service
+    index_file, meta_file = faiss_service.get_index_and_meta_file(kategori)
+    rng = np.random.default_rng(0)
+    for start in range(0, n, 50000):
+        count = min(50000, n - start)
+        vectors = rng.standard_normal((count, dim), dtype='float32')
+        metas = [{'source': f'doc{start // 1000}.pdf', 'chunk_index': i, 'text': 'teks ' * 80,
+                  'kategori': kategori, 'regional': 'Regional 1'} for i in range(count)]
+        faiss_service.create_or_update_index(vectors, metas, index_file, meta_file)
+
+
+def run(vector_dir, kategori, workers, searches, mmap):
+    env = dict(os.environ, RAG_VECTOR_DIR=vector_dir, FAISS_MMAP='1' if mmap else '0')
+    procs = [subprocess.Popen([sys.executable, __file__, '--worker', kategori, '--searches', str(searches)],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              text=True, env=env) for _ in range(workers)]
+    loaded = [json.loads(p.stdout.readline()) for p in procs]
+    for p in procs:
+        p.stdin.write('\n')
+        p.stdin.flush()
+    after = [json.loads(p.stdout.readline()) for p in procs]
+    for p in procs:
+        p.stdin.write('\n')
+        p.stdin.flush()
+        p.wait()
+    rows = []
+    for info, mem in zip(loaded, after):
+        rows.append({'pid': info['pid'], 'load_ms': round(info['load_s'] * 1000, 1),
+                     **{k: round(mem[k] - info['before'][k], 1) for k in mem}})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--vectors', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--searches', type=int, default=20)
+    parser.add_argument('--vector-dir', help='use an existing vector dir instead of a synthetic one')
+    parser.add_argument('--kategori', default='bench')
+    parser.add_argument('--index-type', default='flat', help='index spec type for the synthetic kategori')
+    args = parser.parse_args()
+    if args.worker:
+        return worker(args.worker, args.searches)
+
+    scratch = None
+    vector_dir = args.vector_dir
+    if not vector_dir:
+        scratch = vector_dir = tempfile.mkdtemp(prefix='bench_mmap_')
+        print(f'building {args.vectors} x {args.dim} kategori in {vector_dir} ...', flush=True)
+        build_category(vector_dir, args.kategori, args.vectors, args.dim, args.index_type)
+    try:
+        os.environ['RAG_VECTOR_DIR'] = vector_dir
+        from services import faiss_service
+        snap = faiss_service.read_snapshot(*faiss_service.get_index_and_meta_file(args.kategori))
+        size = os.path.getsize(snap['index']) / 2**20
+        print(f'index size {size:.1f} MB, {args.workers} workers (MB growth per worker after load + {args.searches} searches)')
+        for mmap in (False, True):
+            rows = run(vector_dir, args.kategori, args.workers, args.searches, mmap)
+            print(f'FAISS_MMAP={int(mmap)}')
+            for r in rows:
+                print(f'  pid {r["pid"]:7d}  load {r["load_ms"]:8.1f} ms  rss {r["rss"]:8.1f}  pss {r["pss"]:8.1f}  private {r["private"]:8.1f}')
+            print(f'  total pss {sum(r["pss"] for r in rows):8.1f} MB   total private {sum(r["private"] for r in rows):8.1f} MB')
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
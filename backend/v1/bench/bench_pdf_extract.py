@@ -0,0 +1,119 @@
+"""Page-parallel PDF extraction versus the previous whole-document extractor.
+
+Extracts every PDF in --docs (default: docs/hukum) with the legacy
+sequential extractor and with utils.text_utils.iter_pdf_pages at each
+--workers count, and checks that all of them produce the same words.
+docs/hukum only holds a few short PDFs, so --repeat N also builds a scratch
+PDF that concatenates them N times, large enough for the pool to matter.
+Also reports when the first chunk is available, since ingest now chunks
+pages while later pages are still being extracted.
+
+    python bench_pdf_extract.py --repeat 50 --workers 1 2 4
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+from utils import text_utils  # noqa: E402
+
+DEFAULT_DOCS = os.path.join(HERE, '..', 'app', 'docs', 'hukum')
+
+
+def legacy_extract_text(file_path):
+    """The previous extractor: PyMuPDF with text +=, pdfplumber only if the whole document is empty."""
+    import fitz
+    text = ''
+    doc = fitz.open(file_path)
+    for page in doc:
+        page_text = page.get_text()
+        if page_text:
+            text += page_text + '\n'
+    if text.strip():
+        return text
+    import pdfplumber
+    text = ''
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages:
+            page_text = page.extract_text()
+            if page_text:
+                text += page_text + '\n'
+    return text
+
+
+def build_repeated(files, repeat, out_path):
+    import fitz
+    out = fitz.open()
+    for _ in range(repeat):
+        for path in files:
+            with fitz.open(path) as src:
+                out.insert_pdf(src)
+    out.save(out_path)
+    return out.page_count
+
+
+def run_parallel(path, workers):
+    start = time.perf_counter()
+    first_chunk = None
+    pages = 0
+
+    def texts():
+        nonlocal pages
+        for _, text in text_utils.iter_pdf_pages(path, workers=workers):
+            pages += 1
+            yield text
+    words = []
+    for chunk in text_utils.iter_chunks(texts(), 500):
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - start
+        words.extend(chunk.split())
+    return time.perf_counter() - start, first_chunk, pages, words
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', default=DEFAULT_DOCS, help='directory with the PDFs to extract')
+    parser.add_argument('--repeat', type=int, default=20, help='also bench a PDF made of the docs repeated N times (0: off)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.docs, '*.pdf')))
+    if not files:
+        sys.exit(f'no PDFs in {args.docs}')
+    scratch = tempfile.mkdtemp(prefix='bench_pdf_')
+    targets = [(os.path.basename(f), f) for f in files]
+    try:
+        if args.repeat > 0:
+            path = os.path.join(scratch, 'repeated.pdf')
+            n = build_repeated(files, args.repeat, path)
+            targets.append((f'repeated x{args.repeat} ({n} pages)', path))
+        # Pool sized for the largest worker count, warmed once so spawn start-up is not charged to a document
+        text_utils.PDF_WORKERS = max(args.workers)
+        text_utils.PDF_PARALLEL_MIN_PAGES = 2
+        if text_utils.PDF_WORKERS > 1:
+            list(text_utils.iter_pdf_pages(targets[-1][1]))
+        print(f'{os.cpu_count()} CPUs, {text_utils.PDF_PAGES_PER_TASK} pages per task')
+        for name, path in targets:
+            start = time.perf_counter()
+            legacy_words = legacy_extract_text(path).split()
+            legacy = time.perf_counter() - start
+            print(f'\n{name}')
+            print(f'  legacy             : {legacy * 1000:8.1f} ms')
+            for w in args.workers:
+                total, first, pages, words = run_parallel(path, w)
+                same = 'same text' if words == legacy_words else 'TEXT DIFFERS'
+                first_ms = f'{first * 1000:8.1f} ms' if first is not None else '       -   '
+                print(f'  workers={w:<2} pages={pages:<5}: {total * 1000:8.1f} ms  '
+                      f'(first chunk {first_ms}, {legacy / total:4.2f}x, {same})')
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+"""Retrieval quality and latency report over a vector store, as JSON, without network access.
+
+The corpus is either an existing kategori or a synthetic one:
+
+  --kategori NAME   copies index_<NAME>*.faiss, meta_<NAME>.* (a legacy
+                    meta_<NAME>.pkl is migrated in the copy), snapshot_<NAME>.json
+                    and bm25_<NAME>.* from --vector-dir to a scratch dir, so
+                    the real store is never written to
+  --synthetic N     builds N clustered vectors of --dim with synthetic chunk
+                    text (each chunk also holds a unique code such as
+                    "kode-123") through faiss_service.create_or_update_index,
+                    using --index-type, in uploads of --batch chunks
+
+Queries come from --queries FILE (JSONL, vectors embedded offline) or are
+sampled from the corpus. Each JSONL line has a "vector", optionally the
+"question" text (used by hybrid mode) and its ground truth as one of:
+
+  "relevant_ids": [12, 40]                          row ids
+  "relevant": [{"source": "a.pdf", "chunk_index": 3}]
+  "answer_text": "Pasal 12 ayat (3)"                every chunk containing it
+
+answer_text does not depend on how documents were chunked, so the same
+query file compares stores built with different chunk_text/CHUNK_TOKENS
+settings. Sampled queries are a stored vector plus --noise gaussian noise
+(MRR: rank of that chunk; question: --query-words words of its text) and
+their recall@k is measured against an exact brute-force top-k under the
+same regional/tombstone filter, which shows what the index type, nprobe or
+efSearch cost in recall.
+
+Every combination of --mode, --k, --nprobe and --ef-search is run over
+all queries, one query at a time through the same calls faiss_service.search
+and search_hybrid make (including decoding the rows). The report holds
+recall@k, MRR, p50/p95/p99 latency, the cold load time of the kategori
+(load_index_and_meta after dropping the cache, --load-repeats times), RSS
+after loading and the process's peak RSS. With --baseline an earlier report
+is compared row by row; the exit status is 1 when recall@k dropped by more
+than --max-recall-drop or p95 grew by more than --max-p95-ratio.
+
+    python bench_retrieval.py --kategori hukum --k 3,5,10 --out hukum.json
+    python bench_retrieval.py --synthetic 200000 --dim 256 --index-type ivfflat --nprobe 4,16,64 --regional "Regional 2"
+    python bench_retrieval.py --synthetic 200000 --index-type hnsw --ef-search 32,128 --baseline before.json
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+DEFAULT_VECTOR_DIR = os.path.join(HERE, '..', 'vector')
+SYNTHETIC_KATEGORI = 'bench_synthetic'
+
+
+# --- Process memory ---
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# --- Corpus ---
+
+def copy_kategori(vector_dir, kategori, scratch):
+    names = [f'index_{kategori}.', f'meta_{kategori}.', f'bm25_{kategori}.']
+    copied = 0
+    for path in glob.glob(os.path.join(vector_dir, '*')):
+        name = os.path.basename(path)
+        if os.path.isfile(path) and (any(name.startswith(p) for p in names) or name == f'snapshot_{kategori}.json'):
+            shutil.copy2(path, os.path.join(scratch, name))
+            copied += 1
+    if not copied:
+        sys.exit(f'no files of kategori {kategori!r} in {vector_dir}')
+
+def synthetic_texts(rng, labels, start):
+    # Kata per cluster (topik) ditambah satu kode unik per chunk, untuk mode hybrid
+    texts = []
+    for i, label in enumerate(labels):
+        words = [f'topik{label}kata{w}' for w in rng.integers(0, 50, 30)] + [f'umum{w}' for w in rng.integers(0, 500, 10)]
+        words.insert(int(rng.integers(0, len(words))), f'kode-{start + i}')
+        texts.append(' '.join(words))
+    return texts
+
+def build_synthetic(fs, args):
+    with open(fs.INDEX_SPECS_FILE, 'w', encoding='utf-8') as f:
+        json.dump({SYNTHETIC_KATEGORI: {'type': args.index_type}}, f)
+    index_file, meta_file = fs.get_index_and_meta_file(SYNTHETIC_KATEGORI)
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((args.clusters, args.dim)).astype('float32') * 4
+    start = time.perf_counter()
+    for offset in range(0, args.synthetic, args.batch):
+        n = min(args.batch, args.synthetic - offset)
+        labels = rng.integers(0, args.clusters, n)
+        vectors = centers[labels] + rng.standard_normal((n, args.dim)).astype('float32')
+        texts = synthetic_texts(rng, labels, offset)
+        metas = [{'source': f'doc{(offset + i) // 50}.pdf', 'chunk_index': (offset + i) % 50, 'text': texts[i],
+                  'kategori': SYNTHETIC_KATEGORI, 'regional': f'Regional {(offset + i) % args.regionals + 1}'}
+                 for i in range(n)]
+        fs.create_or_update_index(vectors, metas, index_file, meta_file)
+    return round(time.perf_counter() - start, 2)
+
+
+# --- Queries and ground truth ---
+
+def stored_vectors(fs, index):
+    """(ids, vectors) of everything in the index (lossy for IVFPQ)."""
+    return fs.index_ids(index), fs.reconstruct_all(index)
+
+def is_allowed(entry, ids):
+    ids = np.asarray(ids, dtype='int64')
+    if entry is None:
+        return np.ones(len(ids), dtype=bool)
+    if entry is False:
+        return np.zeros(len(ids), dtype=bool)
+    member = entry['member']
+    ok = ids < len(member)
+    ok[ok] = member[ids[ok]]
+    return ok
+
+def exact_top_k(ids, vectors, queries, k):
+    """Brute-force L2 top-k ids per query over (ids, vectors)."""
+    out = []
+    norms = (vectors * vectors).sum(1)[None, :]
+    for start in range(0, len(queries), 32):
+        q = queries[start:start + 32]
+        dist = (q * q).sum(1)[:, None] - 2 * q @ vectors.T + norms
+        k_eff = min(k, len(ids))
+        top = np.argpartition(dist, k_eff - 1, axis=1)[:, :k_eff]
+        order = np.take_along_axis(dist, top, 1).argsort(1)
+        out.extend(ids[np.take_along_axis(top, order, 1)].tolist())
+    return out
+
+def sample_queries(fs, index, metas, args, k_max, entry):
+    ids, vectors = stored_vectors(fs, index)
+    keep = is_allowed(entry, ids)
+    ids, vectors = ids[keep], vectors[keep]
+    if not len(ids):
+        sys.exit('no stored vectors match the filter')
+    rng = np.random.default_rng(args.seed + 1)
+    pick = rng.choice(len(ids), min(args.queries, len(ids)), replace=False)
+    noise = rng.standard_normal((len(pick), vectors.shape[1])).astype('float32')
+    queries = vectors[pick] + noise * args.noise * np.linalg.norm(vectors[pick], axis=1, keepdims=True) / np.sqrt(vectors.shape[1])
+    rows = fs.meta_store.read_rows(metas, fs.meta_store.ids_to_rows(metas, ids[pick]))
+    exact = exact_top_k(ids, vectors, queries, k_max)
+    out = []
+    for i, q in enumerate(queries):
+        words = rows[i]['text'].split()
+        chosen = sorted(rng.choice(len(words), min(args.query_words, len(words)), replace=False)) if words else []
+        out.append({'vector': q, 'question': ' '.join(words[j] for j in chosen), 'target': int(ids[pick[i]]),
+                    'exact': exact[i]})
+    return out
+
+def _id_lookup(fs, metas):
+    cols = metas['columns']
+    sources = metas['dicts']['source']
+    live = np.flatnonzero(fs.meta_store.live_mask(metas))
+    id_col = np.asarray(cols[fs.meta_store.ID_COLUMN])
+    return {(sources[int(cols['source'][r])], int(cols['chunk_index'][r])): int(id_col[r]) for r in live}
+
+def _ids_with_text(fs, metas, needles):
+    found = {n: set() for n in needles}
+    id_col = np.asarray(metas['columns'][fs.meta_store.ID_COLUMN])
+    live = np.flatnonzero(fs.meta_store.live_mask(metas))
+    for start in range(0, len(live), 4096):
+        rows = live[start:start + 4096]
+        for r, row in zip(rows, fs.meta_store.read_rows(metas, rows)):
+            for n in needles:
+                if n in row['text']:
+                    found[n].add(int(id_col[r]))
+    return found
+
+def load_query_file(fs, metas, path, dim):
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    lookup = _id_lookup(fs, metas) if any('relevant' in q for q in lines) else {}
+    texts = _ids_with_text(fs, metas, {q['answer_text'] for q in lines if 'answer_text' in q})
+    out = []
+    for n, q in enumerate(lines, start=1):
+        vector = np.asarray(q['vector'], dtype='float32')
+        if vector.shape != (dim,):
+            sys.exit(f'{path}:{n}: vector has {vector.size} dims, index has {dim}')
+        if 'relevant_ids' in q:
+            relevant = {int(i) for i in q['relevant_ids']}
+        elif 'relevant' in q:
+            relevant = {lookup[key] for key in ((r['source'], int(r['chunk_index'])) for r in q['relevant']) if key in lookup}
+        elif 'answer_text' in q:
+            relevant = texts[q['answer_text']]
+        else:
+            sys.exit(f'{path}:{n}: no relevant_ids, relevant or answer_text')
+        out.append({'vector': vector, 'question': q.get('question') or '', 'relevant': relevant,
+                    'regional': q.get('regional')})
+    return out
+
+
+# --- Measurement ---
+
+def retrieve(fs, index_file, index, metas, query, k, mode, nprobe, ef_search, regional):
+    """Ranked ids for one query, the way search / search_hybrid compute them, rows decoded like theirs."""
+    bm25 = metas['header'].get('bm25')
+    hybrid = mode == 'hybrid' and bool(bm25 and bm25['segments'] and query['question'])
+    n = max(fs.HYBRID_CANDIDATES, k) if hybrid else k
+    ids = fs._vector_ids(index, metas, query['vector'], n, nprobe, ef_search, regional)
+    if hybrid:
+        ids = fs.rrf_fuse([ids, fs._bm25_ids(index_file, metas, query['question'], n, regional)])
+    ids = ids[:k]
+    fs.meta_store.read_rows(metas, fs.meta_store.ids_to_rows(metas, ids))
+    return ids
+
+def score(queries, ranked, k):
+    recalls, rr = [], []
+    for q, ids in zip(queries, ranked):
+        if 'exact' in q:
+            truth = set(q['exact'][:k])
+            recalls.append(len(truth & set(ids)) / len(truth) if truth else 1.0)
+            relevant = {q['target']}
+        else:
+            relevant = q['relevant']
+            if relevant:
+                recalls.append(len(relevant & set(ids)) / len(relevant))
+        rank = next((i for i, idx in enumerate(ids, start=1) if idx in relevant), None)
+        rr.append(1.0 / rank if rank else 0.0)
+    return (round(float(np.mean(recalls)), 4) if recalls else None), round(float(np.mean(rr)), 4)
+
+def latency_ms(samples):
+    lat = np.asarray(samples) * 1000
+    return {'mean': round(float(lat.mean()), 3), 'p50': round(float(np.percentile(lat, 50)), 3),
+            'p95': round(float(np.percentile(lat, 95)), 3), 'p99': round(float(np.percentile(lat, 99)), 3)}
+
+def measure_load(fs, index_file, meta_file, repeats):
+    samples = []
+    for _ in range(max(repeats, 1)):
+        fs.invalidate_index_cache(index_file)
+        start = time.perf_counter()
+        fs.load_index_and_meta(index_file, meta_file)
+        samples.append(time.perf_counter() - start)
+    return {'first_ms': round(samples[0] * 1000, 2), 'min_ms': round(min(samples) * 1000, 2),
+            'repeats': len(samples), 'mmap': fs.FAISS_MMAP}
+
+def int_list(value):
+    return [None if v in ('', '-', 'none') else int(v) for v in value.split(',')] if value else [None]
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# --- Baseline comparison ---
+
+def _row_key(row):
+    return (row['mode'], row['k'], row['nprobe'], row['ef_search'], row['regional'])
+
+def compare(report, baseline, max_recall_drop, max_p95_ratio):
+    """Per-row deltas against an earlier report; returns (deltas, regressions)."""
+    before = {_row_key(r): r for r in baseline.get('results', [])}
+    deltas, regressions = [], []
+    for row in report['results']:
+        old = before.get(_row_key(row))
+        if old is None:
+            continue
+        delta = {'mode': row['mode'], 'k': row['k'], 'nprobe': row['nprobe'], 'ef_search': row['ef_search'],
+                 'regional': row['regional'],
+                 'recall_at_k': None if row['recall_at_k'] is None or old['recall_at_k'] is None
+                 else round(row['recall_at_k'] - old['recall_at_k'], 4),
+                 'mrr': round(row['mrr'] - old['mrr'], 4),
+                 'p95_ratio': round(row['latency_ms']['p95'] / old['latency_ms']['p95'], 3) if old['latency_ms']['p95'] else None}
+        deltas.append(delta)
+        if delta['recall_at_k'] is not None and -delta['recall_at_k'] > max_recall_drop:
+            regressions.append(f"recall@{row['k']} {old['recall_at_k']} -> {row['recall_at_k']} ({row['mode']})")
+        if delta['p95_ratio'] is not None and delta['p95_ratio'] > max_p95_ratio:
+            regressions.append(f"p95 {old['latency_ms']['p95']} -> {row['latency_ms']['p95']} ms (k={row['k']}, {row['mode']})")
+    return deltas, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--kategori', help='existing kategori in --vector-dir')
+    source.add_argument('--synthetic', type=int, metavar='N', help='build a synthetic corpus of N chunks')
+    parser.add_argument('--vector-dir', default=DEFAULT_VECTOR_DIR)
+    parser.add_argument('--dim', type=int, default=256, help='synthetic vector size')
+    parser.add_argument('--clusters', type=int, default=200, help='synthetic topics')
+    parser.add_argument('--regionals', type=int, default=4, help='synthetic regional values')
+    parser.add_argument('--index-type', default='auto', help='synthetic index spec type (flat, ivfflat, ivfpq, hnsw, auto)')
+    parser.add_argument('--batch', type=int, default=50000, help='synthetic chunks per upload')
+    parser.add_argument('--queries', default='200', help='JSONL query file, or the number of queries to sample')
+    parser.add_argument('--noise', type=float, default=0.3, help='sampled queries: noise relative to the vector norm')
+    parser.add_argument('--query-words', type=int, default=6, help='sampled queries: words of the chunk used as question')
+    parser.add_argument('--k', default='5', help='comma separated top_k values')
+    parser.add_argument('--mode', default='vector', help='comma separated: vector, hybrid')
+    parser.add_argument('--nprobe', default='', help='comma separated IVF nprobe values (default: the index\'s own)')
+    parser.add_argument('--ef-search', default='', help='comma separated HNSW efSearch values (default: the index\'s own)')
+    parser.add_argument('--regional', help='only search chunks whose regional contains this')
+    parser.add_argument('--load-repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--max-recall-drop', type=float, default=0.01)
+    parser.add_argument('--max-p95-ratio', type=float, default=1.25)
+    args = parser.parse_args()
+    ks = [k for k in int_list(args.k) if k]
+    modes = [m.strip() for m in args.mode.split(',') if m.strip()]
+
+    scratch = tempfile.mkdtemp(prefix='bench_retrieval_')
+    os.environ['RAG_VECTOR_DIR'] = scratch
+    from services import faiss_service as fs
+    try:
+        fs.INDEX_SPECS_FILE = os.path.join(scratch, 'index_specs.json')
+        corpus = {}
+        if args.kategori:
+            copy_kategori(os.path.abspath(args.vector_dir), args.kategori, scratch)
+            kategori = args.kategori
+            corpus.update(source='kategori', kategori=kategori)
+        else:
+            kategori = SYNTHETIC_KATEGORI
+            corpus.update(source='synthetic', n=args.synthetic, dim=args.dim, clusters=args.clusters,
+                          regionals=args.regionals, build_s=build_synthetic(fs, args))
+        index_file, meta_file = fs.get_index_and_meta_file(kategori)  # migrates a legacy .pkl in the copy
+        load = measure_load(fs, index_file, meta_file, args.load_repeats)
+        load['rss_after_load_mb'] = current_rss_mb()
+        index, metas = fs.load_index_and_meta(index_file, meta_file)
+        corpus.update(rows=fs.meta_store.num_live(metas), dim=index.d, index_type=fs.index_type_of(index),
+                      bm25=bool((metas['header'].get('bm25') or {}).get('segments')))
+
+        if args.queries.isdigit():
+            args.queries = int(args.queries)
+            queries = sample_queries(fs, index, metas, args, max(ks), fs.allowed_ids(metas, args.regional, True))
+            query_source = 'sampled'
+        else:
+            queries = load_query_file(fs, metas, args.queries, index.d)
+            query_source = os.path.basename(args.queries)
+
+        results = []
+        for mode in modes:
+            for k in ks:
+                for nprobe in int_list(args.nprobe):
+                    for ef_search in int_list(args.ef_search):
+                        samples, ranked = [], []
+                        for q in queries:
+                            regional = q.get('regional') or args.regional
+                            start = time.perf_counter()
+                            ranked.append(retrieve(fs, index_file, index, metas, q, k, mode, nprobe, ef_search, regional))
+                            samples.append(time.perf_counter() - start)
+                        recall, mrr = score(queries, ranked, k)
+                        results.append({'mode': mode, 'k': k, 'nprobe': nprobe, 'ef_search': ef_search,
+                                        'regional': args.regional, 'recall_at_k': recall, 'mrr': mrr,
+                                        'latency_ms': latency_ms(samples)})
+
+        report = {
+            'commit': git_commit(),
+            'corpus': corpus,
+            'queries': {'source': query_source, 'n': len(queries)},
+            'load': load,
+            'results': results,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        regressions = []
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            report['baseline'] = {'commit': baseline.get('commit')}
+            report['baseline']['deltas'], regressions = compare(report, baseline, args.max_recall_drop, args.max_p95_ratio)
+            report['baseline']['regressions'] = regressions
+        text = json.dumps(report, indent=2)
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+        for line in regressions:
+            print(f'REGRESSION: {line}', file=sys.stderr)
+        return 1 if regressions else 0
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Request-path cost of portal usage reports, and outbox delivery through a portal outage.
+
+Part 1 times --events usage reports made the old way, with a blocking
+requests.post and a 3 s timeout, against a portal that takes
+--portal-latency seconds per call. It then times the same reports through
+telemetry_outbox.enqueue.
+
+Part 2 points PORTAL_API_URL at a closed port (the outbox reads it at send
+time) and keeps reporting, so events spill to the JSONL file. It then
+points it at a fresh portal and checks that every event is delivered
+exactly once after replay.
+
+    python bench_telemetry.py --events 20 --portal-latency 0.5
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+sys.path.insert(0, HERE)
+
+from fake_openai import start_server  # noqa: E402
+from load_answer import free_port  # noqa: E402
+
+
+def legacy_report(portal_url, body):
+    """The previous inline report from llm_service._report_usage."""
+    import requests
+    try:
+        requests.post(f'{portal_url}/tokens/usage', json=body, timeout=3)
+    except Exception:
+        pass
+
+
+def usage(i):
+    return {'model': 'gpt-4', 'tokens': 100 + i, 'user_id': 'bench', 'thread_id': f't{i}', 'meta': {'type': 'answer'}}
+
+
+def wait_for(predicate, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return predicate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--portal-latency', type=float, default=0.5)
+    parser.add_argument('--outage-events', type=int, default=200)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_telemetry_')
+    portal, portal_url = start_server(latency=args.portal_latency)
+    os.environ.update(PORTAL_API_URL=f'{portal_url}/api',
+                      TELEMETRY_SPILL_FILE=os.path.join(scratch, 'outbox.jsonl'),
+                      TELEMETRY_RETRY_INTERVAL='1', TELEMETRY_FLUSH_INTERVAL='0.1', TELEMETRY_TIMEOUT='1')
+    from services import telemetry_outbox
+    try:
+        start = time.perf_counter()
+        for i in range(args.events):
+            legacy_report(f'{portal_url}/api', usage(i))
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(args.events):
+            telemetry_outbox.enqueue('/tokens/usage', usage(i))
+        queued = time.perf_counter() - start
+        telemetry_outbox.flush(timeout=args.events * args.portal_latency + 10)
+        print(f'{args.events} reports, portal {args.portal_latency * 1000:.0f} ms/call')
+        print(f'  blocking requests.post : {legacy * 1000 / args.events:9.2f} ms per report on the request path')
+        print(f'  telemetry_outbox       : {queued * 1000 / args.events:9.3f} ms per report '
+              f'(all delivered in background: {portal.stats["usage_reports"] == 2 * args.events})')
+
+        # Portal down: events spill, then replay once it is reachable again
+        portal.shutdown()
+        os.environ['PORTAL_API_URL'] = f'http://127.0.0.1:{free_port()}/api'
+        before = telemetry_outbox.stats()
+        start = time.perf_counter()
+        for i in range(args.outage_events):
+            telemetry_outbox.enqueue('/tokens/usage', usage(10000 + i))
+        queued = time.perf_counter() - start
+        wait_for(lambda: telemetry_outbox.stats()['spilled'] - before['spilled'] >= args.outage_events, 30)
+        spilled = telemetry_outbox.stats()
+        print(f'\noutage: {args.outage_events} reports queued in {queued * 1000:.1f} ms, '
+              f'{spilled["spilled"] - before["spilled"]} spilled ({spilled["spill_bytes"]} bytes)')
+
+        portal, portal_url = start_server(latency=0.0)
+        os.environ['PORTAL_API_URL'] = f'{portal_url}/api'
+        start = time.time()
+        delivered = wait_for(lambda: portal.stats['usage_reports'] >= args.outage_events, 60)
+        time.sleep(0.5)
+        after = telemetry_outbox.stats()
+        print(f'portal back: {portal.stats["usage_reports"]}/{args.outage_events} delivered after '
+              f'{time.time() - start:.1f} s, spill file {after["spill_bytes"]} bytes, stats {after}')
+        ok = delivered and portal.stats['usage_reports'] == args.outage_events and after['spill_bytes'] == 0
+        print('OK' if ok else 'FAILED')
+        sys.exit(0 if ok else 1)
+    finally:
+        portal.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
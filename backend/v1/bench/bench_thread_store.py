@@ -0,0 +1,169 @@
+"""Thread memory: legacy whole-file JSON versus thread_store's JSONL log.
+
+Part 1 builds one thread per store with --turns turns, then times one
+/answer worth of memory work: load the history, add a turn and save it. The
+legacy store re-reads and rewrites the whole indent=2 JSON file, while
+thread_store reads the tail (or its LRU) and appends one line.
+
+Part 2 starts --procs processes with --threads threads each, all appending
+to the same thread. It counts the turns that survive with each store. The
+legacy load+save loses the turns that race; the log should keep all of them.
+
+Part 3 lowers THREAD_COMPACT_BYTES below the size of the long thread and
+checks that the background compactor trims it to THREAD_MAX_TURNS turns.
+
+    python bench_thread_store.py --turns 2000 --procs 4 --threads 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+
+ANSWER = 'Jawaban contoh yang cukup panjang untuk menyerupai keluaran GPT-4. ' * 8
+
+
+def legacy_load(directory, user_id, thread_id):
+    """The previous faiss_service.load_thread."""
+    path = os.path.join(directory, f'{user_id}_{thread_id}.json')
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+        return json.loads(content) if content else []
+    except ValueError:
+        # Torn read of a file another writer is rewriting; the old code also returned []
+        return []
+
+
+def legacy_save(directory, user_id, thread_id, memory):
+    """The previous faiss_service.save_thread."""
+    with open(os.path.join(directory, f'{user_id}_{thread_id}.json'), 'w', encoding='utf-8') as f:
+        json.dump(memory, f, ensure_ascii=False, indent=2)
+
+
+def turn(i):
+    return {'q': f'pertanyaan nomor {i}', 'a': ANSWER}
+
+
+def time_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def writer(kind, directory, threads, per_thread, tag):
+    os.environ.update(RAG_THREADS_DIR=directory, THREAD_COMPACT_BYTES='0')
+    from services import thread_store
+
+    def run(t):
+        for i in range(per_thread):
+            entry = turn(f'{tag}-{t}-{i}')
+            if kind == 'legacy':
+                memory = legacy_load(directory, 'race', 'shared')
+                memory.append(entry)
+                legacy_save(directory, 'race', 'shared', memory)
+            else:
+                thread_store.recent('race', 'shared')
+                thread_store.append_turn('race', 'shared', entry)
+
+    workers = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--procs', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--per-thread', type=int, default=25)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_threads_')
+    os.environ.update(RAG_THREADS_DIR=scratch, THREAD_MAX_TURNS='100', THREAD_COMPACT_BYTES='0')
+    from services import thread_store
+    try:
+        # Part 1: per-request cost on a long thread
+        history = [turn(i) for i in range(args.turns)]
+        legacy_save(scratch, 'u', 'legacy', history)
+        for t in history:
+            thread_store.append_turn('u', 'log', t)
+        n = [args.turns]
+
+        def legacy_request():
+            memory = legacy_load(scratch, 'u', 'legacy')
+            memory.append(turn(n[0]))
+            legacy_save(scratch, 'u', 'legacy', memory)
+            n[0] += 1
+
+        def log_request():
+            thread_store.recent('u', 'log')
+            thread_store.append_turn('u', 'log', turn(n[0]))
+            n[0] += 1
+
+        def log_cold():
+            thread_store._hot.clear()
+            thread_store.recent('u', 'log')
+
+        print(f'thread with {args.turns} turns, median of {args.repeat}')
+        print(f'  legacy load + rewrite       : {time_ms(legacy_request, args.repeat):8.2f} ms per request')
+        print(f'  thread_store recent + append: {time_ms(log_request, args.repeat):8.3f} ms per request (LRU hot)')
+        print(f'  thread_store cold tail read : {time_ms(log_cold, args.repeat):8.3f} ms '
+              f'({thread_store.THREAD_HISTORY_TURNS} turns)')
+
+        # Part 2: concurrent writers on one thread
+        expected = args.procs * args.threads * args.per_thread
+        ctx = multiprocessing.get_context('spawn')
+        for kind in ('legacy', 'log'):
+            directory = os.path.join(scratch, f'race_{kind}')
+            os.makedirs(directory)
+            procs = [ctx.Process(target=writer, args=(kind, directory, args.threads, args.per_thread, p))
+                     for p in range(args.procs)]
+            start = time.perf_counter()
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join()
+            elapsed = time.perf_counter() - start
+            if kind == 'legacy':
+                kept = len(legacy_load(directory, 'race', 'shared'))
+            else:
+                thread_store.THREADS_DIR = directory
+                kept = len(thread_store.load_all('race', 'shared'))
+                thread_store.THREADS_DIR = scratch
+            print(f'\n{kind:<6}: {args.procs} procs x {args.threads} threads, {kept}/{expected} turns kept '
+                  f'({elapsed:.1f} s)')
+
+        # Part 3: background compaction
+        thread_store.THREAD_COMPACT_BYTES = 256 * 1024
+        before = os.path.getsize(thread_store.thread_path('u', 'log'))
+        thread_store.append_turn('u', 'log', turn('compact'))
+        deadline = time.time() + 10
+        while thread_store.stats()['compactions'] == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        kept = thread_store.load_all('u', 'log')
+        print(f'\ncompaction: {before} bytes -> {os.path.getsize(thread_store.thread_path("u", "log"))} bytes, '
+              f'{len(kept)} turns kept, last turn {kept[-1]["q"]!r}')
+        print(f'stats: {thread_store.stats()}')
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
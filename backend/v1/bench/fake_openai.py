@@ -0,0 +1,168 @@
+"""Local stand-in for the OpenAI HTTP API, used by the benchmarks in this folder.
+
+Serves POST /v1/embeddings with deterministic vectors (same text -> same
+vector) and POST /v1/chat/completions (plain or `stream: true` SSE, one
+token every --token-latency seconds), with a configurable latency / failure
+profile, so ingestion and query paths can be timed without network access
+or an API key. POST .../tokens/usage stands in for the portal's token
+usage endpoint (PORTAL_API_URL=<url>/api). Follow-up detection prompts get a short rephrase, or
+'PERTANYAAN BARU' when the new question starts with "topik baru".
+
+    python fake_openai.py --port 8900 --latency 0.2 --per-item 0.002
+    OPENAI_BASE_URL=http://127.0.0.1:8900 OPENAI_API_KEY=fake ...
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Follow-up detection prompt sent by llm_service._rephrase
+REPHRASE_MARKER = 'Pertanyaan baru:'
+REPHRASE_TOKENS = 12
+
+def fake_vector(text, dim):
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vec = np.random.default_rng(seed).standard_normal(dim).astype('float32')
+    vec /= np.linalg.norm(vec) or 1.0
+    return vec.tolist()
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    opts = {}
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        stats = self.server.stats
+        with self.server.stats_lock:
+            stats['requests'] += 1
+        if random.random() < self.opts['fail_rate']:
+            with self.server.stats_lock:
+                stats['throttled'] += 1
+            return self._send_json(429, {'error': {'message': 'Rate limit reached (fake)'}}, {'Retry-After': '0.05'})
+        if self.path == '/v1/embeddings':
+            return self._embeddings(body)
+        if self.path == '/v1/chat/completions':
+            return self._chat(body)
+        if self.path.endswith('/tokens/usage'):
+            time.sleep(self.opts['latency'])
+            with self.server.stats_lock:
+                stats['usage_reports'] += 1
+            return self._send_json(200, {'ok': True})
+        self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+
+    def _embeddings(self, body):
+        inputs = body.get('input')
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(self.opts['latency'] + self.opts['per_item'] * len(inputs))
+        data = [{'object': 'embedding', 'index': i, 'embedding': fake_vector(t, self.opts['dim'])} for i, t in enumerate(inputs)]
+        tokens = sum(len(t.split()) for t in inputs)
+        with self.server.stats_lock:
+            self.server.stats['inputs'] += len(inputs)
+        self._send_json(200, {'object': 'list', 'data': data, 'model': body.get('model'),
+                              'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}})
+
+    def _chat(self, body):
+        question = (body.get('messages') or [{}])[-1].get('content') or ''
+        if REPHRASE_MARKER in question:
+            new_question = question.rsplit(REPHRASE_MARKER, 1)[1].rsplit('Output:', 1)[0].strip()
+            if new_question.lower().startswith('topik baru'):
+                tokens = ['PERTANYAAN', ' BARU']
+            else:
+                tokens = ['Jelaskan'] + [f' {w}' for w in new_question.split()[:REPHRASE_TOKENS - 1]]
+        else:
+            words = question.split()[-8:] or ['kosong']
+            tokens = [f' {words[i % len(words)]}' for i in range(self.opts['answer_tokens'])]
+            tokens[0] = 'Jawaban'
+        usage = {'prompt_tokens': len(question.split()), 'completion_tokens': len(tokens),
+                 'total_tokens': len(question.split()) + len(tokens)}
+        model = body.get('model') or 'gpt-4'
+        time.sleep(self.opts['latency'])
+        if not body.get('stream'):
+            time.sleep(self.opts['token_latency'] * len(tokens))
+            return self._send_json(200, {'object': 'chat.completion', 'model': model, 'usage': usage, 'choices': [
+                {'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': ''.join(tokens)}}]})
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            time.sleep(self.opts['token_latency'])
+            self._send_event({'object': 'chat.completion.chunk', 'model': model, 'choices': [
+                {'index': 0, 'delta': {'content': token}, 'finish_reason': 'stop' if i == len(tokens) - 1 else None}]})
+        if (body.get('stream_options') or {}).get('include_usage'):
+            self._send_event({'object': 'chat.completion.chunk', 'model': model, 'choices': [], 'usage': usage})
+        self._send_chunk(b'data: [DONE]\n\n')
+        self._send_chunk(b'')
+
+    def _send_event(self, obj):
+        self._send_chunk(f'data: {json.dumps(obj)}\n\n'.encode('utf-8'))
+
+    def _send_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+
+def start_server(host='127.0.0.1', port=0, dim=1536, latency=0.05, per_item=0.0, fail_rate=0.0,
+                 token_latency=0.02, answer_tokens=60):
+    """Start the fake server on a daemon thread; returns (server, base_url)."""
+    handler = type('Handler', (FakeOpenAIHandler,), {'opts': {
+        'dim': dim, 'latency': latency, 'per_item': per_item, 'fail_rate': fail_rate,
+        'token_latency': token_latency, 'answer_tokens': answer_tokens,
+    }})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.stats = {'requests': 0, 'inputs': 0, 'throttled': 0, 'usage_reports': 0}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+def add_server_args(parser):
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every request')
+    parser.add_argument('--per-item', type=float, default=0.0, help='seconds added per embedded input')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--token-latency', type=float, default=0.02, help='seconds per generated chat token')
+    parser.add_argument('--answer-tokens', type=int, default=60, help='tokens in every chat answer')
+
+
+def server_kwargs(args):
+    return {'dim': args.dim, 'latency': args.latency, 'per_item': args.per_item, 'fail_rate': args.fail_rate,
+            'token_latency': args.token_latency, 'answer_tokens': args.answer_tokens}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_server_args(parser)
+    args = parser.parse_args()
+    server, url = start_server(args.host, args.port, **server_kwargs(args))
+    print(f'fake OpenAI API listening on {url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,147 @@
+"""Load test /answer: gunicorn gthread (main:app) versus uvicorn (asgi:app).
+
+Starts the fake OpenAI + portal server in this process and builds a synthetic
+kategori in a scratch dir. Then, for each --servers entry, launches the
+backend as a subprocess with the same worker count and drives POST /answer
+from closed-loop client threads at every --concurrency level for --duration
+seconds. Every request uses a fresh thread id and bypasses the answer
+cache, so each one does an embedding call, a FAISS search, a chat call and
+a usage report.
+
+    python load_answer.py --concurrency 1 4 16 64 --duration 10 --latency 0.3
+    python load_answer.py --servers gunicorn --threads 8   # gthread with more threads per worker
+"""
+import argparse
+import itertools
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.abspath(os.path.join(HERE, '..', 'app'))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, HERE)
+
+from fake_openai import add_server_args, server_kwargs, start_server  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def launch(kind, args, env):
+    port = free_port()
+    if kind == 'gunicorn':
+        cmd = [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-k', 'gthread',
+               '--threads', str(args.threads), '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'main:app']
+    else:
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--workers', str(args.workers),
+               '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    log = open(os.path.join(env['RAG_VECTOR_DIR'], f'{kind}.log'), 'wb')
+    proc = subprocess.Popen(cmd, cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}'
+    import requests
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'{kind} exited with {proc.returncode}, see {log.name}')
+        try:
+            requests.get(f'{url}/health', timeout=1)
+            return proc, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'{kind} did not start within 60 s')
+
+
+def drive(url, concurrency, duration, top_k, run_id):
+    import requests
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = itertools.count()
+    stop_at = time.time() + duration
+
+    def client():
+        session = requests.Session()
+        while time.time() < stop_at:
+            n = next(counter)
+            body = {'question': f'pertanyaan beban nomor {n}', 'kategori': 'bench', 'top_k': top_k,
+                    'bypass_cache': True, 'user_id': 'load', 'thread_id': f'{run_id}-{n}'}
+            start = time.perf_counter()
+            try:
+                resp = session.post(f'{url}/answer', json=body, timeout=120)
+                ok = resp.status_code == 200 and resp.json().get('ok')
+                error = None if ok else f'{resp.status_code} {resp.text[:120]}'
+            except Exception as e:
+                error = str(e)
+            with lock:
+                if error:
+                    errors.append(error)
+                else:
+                    latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', default=['gunicorn', 'uvicorn'], choices=['gunicorn', 'uvicorn'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn --threads (ecosystem.config.js uses the default, 1)')
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--top-k', type=int, default=5)
+    add_server_args(parser)
+    parser.set_defaults(dim=256, latency=0.3, token_latency=0.005, answer_tokens=60)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='load_answer_')
+    fake, fake_url = start_server(**server_kwargs(args))
+    env = dict(os.environ, OPENAI_BASE_URL=fake_url, OPENAI_API_KEY='fake', PORTAL_API_URL=f'{fake_url}/api',
+               RAG_VECTOR_DIR=scratch, RAG_THREADS_DIR=os.path.join(scratch, 'threads'),
+               JOBS_DB=os.path.join(scratch, 'jobs.sqlite'), EMBED_CACHE='0', PYTHONUNBUFFERED='1')
+    os.environ.update(RAG_VECTOR_DIR=scratch, RAG_THREADS_DIR=env['RAG_THREADS_DIR'])
+    try:
+        from bench_answer_stream import build_category
+        build_category('bench', args.dim, args.chunks)
+        chat_s = args.latency + args.token_latency * args.answer_tokens
+        print(f'fake API: {args.latency * 1000:.0f} ms per call, chat {chat_s * 1000:.0f} ms; '
+              f'{args.workers} workers, gunicorn threads {args.threads}')
+        print(f'{"server":<10} {"conc":>5} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} {"max ms":>9} {"errors":>7}')
+        for kind in args.servers:
+            proc, url = launch(kind, args, env)
+            try:
+                for c in args.concurrency:
+                    latencies, errors, elapsed = drive(url, c, args.duration, args.top_k, f'{kind}{c}')
+                    lat = sorted(x * 1000 for x in latencies) or [0.0]
+                    p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+                    print(f'{kind:<10} {c:>5} {len(latencies) / elapsed:8.1f} {statistics.median(lat):9.0f} '
+                          f'{p95:9.0f} {lat[-1]:9.0f} {len(errors):7d}')
+                    for e in errors[:3]:
+                        print(f'    error: {e}')
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+        print(f'fake server stats: {fake.stats}')
+    finally:
+        fake.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
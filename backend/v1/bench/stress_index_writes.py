@@ -0,0 +1,271 @@
+"""Stress the per-kategori writer lock and snapshot swap with parallel processes.
+
+Runs, for --duration seconds and against one scratch kategori:
+  --uploaders  processes appending documents of --chunks vectors each,
+  --deleters   processes deleting random documents that are currently indexed,
+  --searchers  processes loading the current snapshot and searching it.
+
+Every chunk's vector is derived from its text, so consistency is checkable:
+searchers verify that the index and metadata they loaded have the same live
+row count and that sampled rows hold the vector their text implies, and that an
+exact-vector search returns that chunk. At the end the kategori must contain
+exactly the documents uploaded and not deleted, each with all its chunks.
+
+Before that, for each --migrate-types entry, a sequential scenario runs in its
+own kategori with FAISS_INDEX_TYPE=auto: two uploads cross
+--migrate-threshold (Flat -> ANN), a small one is appended, the large document
+is deleted (remove_ids, no compaction) and the next upload migrates back to
+Flat, the kategori now being under FAISS_ANN_DOWNGRADE_RATIO x the threshold. After every step each live chunk must be in the index under its id and
+be found by searching for its vector.
+
+    python stress_index_writes.py --duration 20 --uploaders 3 --deleters 1 --searchers 2
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(HERE, '..', 'app')
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, HERE)
+
+KATEGORI = 'stress'
+
+
+def chunk_vector(text, dim):
+    from fake_openai import fake_vector
+    return fake_vector(text, dim)
+
+
+def _setup(vector_dir, **env):
+    os.environ['RAG_VECTOR_DIR'] = vector_dir
+    os.environ['FAISS_INDEX_TYPE'] = 'flat'
+    os.environ.update(env)
+    from services import faiss_service
+    return faiss_service
+
+
+def uploader(vector_dir, wid, args, deadline, out):
+    fs = _setup(vector_dir)
+    index_file, meta_file = fs.get_index_and_meta_file(KATEGORI)
+    n = 0
+    while time.time() < deadline:
+        source = f'u{wid}_{n}.pdf'
+        texts = [f'{source}#{i}' for i in range(args.chunks)]
+        metas = [{'source': source, 'chunk_index': i, 'text': t, 'kategori': KATEGORI, 'regional': f'Regional {wid}'}
+                 for i, t in enumerate(texts)]
+        fs.create_or_update_index([chunk_vector(t, args.dim) for t in texts], metas, index_file, meta_file)
+        out.put(('uploaded', source))
+        n += 1
+
+
+def deleter(vector_dir, wid, args, deadline, out):
+    from services import meta_store
+    fs = _setup(vector_dir)
+    index_file, meta_file = fs.get_index_and_meta_file(KATEGORI)
+    rng = random.Random(wid)
+    while time.time() < deadline:
+        time.sleep(args.delete_interval)
+        sources = meta_store.sources(meta_file)
+        if len(sources) < 2:
+            continue
+        source = rng.choice(sources)
+        removed, _ = fs.delete_source(source, index_file, meta_file)
+        if removed:
+            if removed != args.chunks:
+                out.put(('error', f'delete {source}: removed {removed} rows, expected {args.chunks}'))
+            out.put(('deleted', source))
+
+
+def searcher(vector_dir, wid, args, deadline, out):
+    import numpy as np
+    from services import meta_store
+    fs = _setup(vector_dir)
+    index_file, meta_file = fs.get_index_and_meta_file(KATEGORI)
+    rng = random.Random(1000 + wid)
+    checks = 0
+    while time.time() < deadline:
+        try:
+            index, metas = fs.load_index_and_meta(index_file, meta_file)
+        except FileNotFoundError:
+            time.sleep(0.01)
+            continue
+        n = meta_store.num_live(metas)
+        if index.ntotal != n and not (n == 0 and index.ntotal == 0):
+            out.put(('error', f'snapshot mismatch: index {index.ntotal} rows, metadata {n} live rows'))
+        if n == 0:
+            continue
+        live = np.flatnonzero(meta_store.live_mask(metas))
+        ids = metas['columns'][meta_store.ID_COLUMN]
+        for i in rng.sample(list(live), min(5, n)):
+            row = meta_store.read_rows(metas, [i])[0]
+            if not np.allclose(index.reconstruct(int(ids[i])), chunk_vector(row['text'], args.dim), atol=1e-5):
+                out.put(('error', f'row {i} ({row["text"]}) does not hold its vector'))
+            found = fs.search(chunk_vector(row['text'], args.dim), 1, category=KATEGORI)
+            # The snapshot may have moved on (row deleted) between load and search; only flag live rows
+            if found and found[0]['text'] != row['text'] and row['source'] in meta_store.sources(meta_file):
+                out.put(('error', f'search for {row["text"]} returned {found[0]["text"]}'))
+            checks += 1
+    out.put(('checks', checks))
+
+
+def migrate_check(vector_dir, args, kind, out):
+    """Upload past the ANN threshold, delete, and upload again back under it."""
+    import faiss
+    import numpy as np
+    from services import meta_store
+    threshold = args.migrate_threshold
+    fs = _setup(vector_dir, FAISS_INDEX_TYPE='auto', FAISS_AUTO_INDEX_TYPE=kind,
+                FAISS_ANN_THRESHOLD=str(threshold), FAISS_ANN_DOWNGRADE_RATIO='0.5',
+                FAISS_COMPACT_RATIO='2')
+    kategori = f'migrate_{kind}'
+    index_file, meta_file = fs.get_index_and_meta_file(kategori)
+
+    def upload(source, n):
+        texts = [f'{source}#{i}' for i in range(n)]
+        metas = [{'source': source, 'chunk_index': i, 'text': t, 'kategori': kategori} for i, t in enumerate(texts)]
+        fs.create_or_update_index([chunk_vector(t, args.dim) for t in texts], metas, index_file, meta_file)
+
+    def check(step, expect_flat):
+        snap = fs.read_snapshot(index_file, meta_file)
+        index = faiss.read_index(snap['index'])
+        metas = meta_store.open_meta(meta_file, snap['meta'])
+        live = np.flatnonzero(meta_store.live_mask(metas))
+        ids = metas['columns'][meta_store.ID_COLUMN][live]
+        got = fs.index_type_of(index)
+        if (got == 'flat') != expect_flat:
+            out.put(('error', f'migrate {kind} {step}: index is {got}'))
+        if set(fs.index_ids(index).tolist()) != set(ids.tolist()):
+            out.put(('error', f'migrate {kind} {step}: index ids differ from the live metadata ids'))
+            return
+        # Probe every list, so IVFFlat is exact; IVFPQ codes are lossy (and stay
+        # so after migrating back to Flat), so only ask for top-10 there
+        nprobe = getattr(faiss.try_extract_index_ivf(index), 'nlist', None)
+        lossy = kind == 'ivfpq' and step != 'upload a'
+        top_k = 10 if lossy else 1
+        for i in random.Random(step).sample(list(range(len(live))), min(20, len(live))):
+            row = meta_store.read_rows(metas, [live[i]])[0]
+            vector = chunk_vector(row['text'], args.dim)
+            if not lossy and not np.allclose(index.reconstruct(int(ids[i])), vector, atol=1e-5):
+                out.put(('error', f'migrate {kind} {step}: {row["text"]} does not hold its vector'))
+            found = fs.search(vector, top_k, category=kategori, nprobe=nprobe)
+            if row['text'] not in [f['text'] for f in found]:
+                out.put(('error', f'migrate {kind} {step}: search for {row["text"]} returned {[f["text"] for f in found[:3]]}'))
+        out.put(('checks', min(20, len(live))))
+
+    # a alone stays under half the threshold, so deleting b takes the kategori back to Flat
+    small, large = int(threshold * 0.4), int(threshold * 0.8)
+    upload('a.pdf', small)
+    check('upload a', True)
+    upload('b.pdf', large)
+    check('upload b', False)
+    upload('c.pdf', args.chunks)
+    check('upload c', False)
+    fs.delete_source('b.pdf', index_file, meta_file)
+    check('delete b', False)
+    upload('d.pdf', args.chunks)
+    check('upload d', True)
+    upload('e.pdf', args.chunks)
+    check('upload e', True)
+
+
+def final_check(vector_dir, args, uploaded, deleted):
+    from services import meta_store
+    fs = _setup(vector_dir)
+    index_file, meta_file = fs.get_index_and_meta_file(KATEGORI)
+    index, metas = fs.load_index_and_meta(index_file, meta_file)
+    rows = list(meta_store.iter_rows(metas))
+    errors = []
+    if index.ntotal != len(rows) and rows:
+        errors.append(f'final index has {index.ntotal} vectors for {len(rows)} metadata rows')
+    per_source = Counter(r['source'] for r in rows)
+    expected = set(uploaded) - set(deleted)
+    if set(per_source) != expected:
+        missing, extra = expected - set(per_source), set(per_source) - expected
+        errors.append(f'final sources differ: {len(missing)} missing {sorted(missing)[:5]}, {len(extra)} unexpected {sorted(extra)[:5]}')
+    partial = {s: c for s, c in per_source.items() if c != args.chunks}
+    if partial:
+        errors.append(f'{len(partial)} documents with a partial chunk set, e.g. {list(partial.items())[:3]}')
+    return errors, len(rows), len(per_source)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--uploaders', type=int, default=3)
+    parser.add_argument('--deleters', type=int, default=1)
+    parser.add_argument('--searchers', type=int, default=2)
+    parser.add_argument('--chunks', type=int, default=40, help='chunks per uploaded document')
+    parser.add_argument('--dim', type=int, default=64)
+    parser.add_argument('--delete-interval', type=float, default=0.2)
+    parser.add_argument('--migrate-types', nargs='*', default=['ivfflat', 'ivfpq'],
+                        help='ANN types for the delete-then-migrate scenario (none to skip)')
+    parser.add_argument('--migrate-threshold', type=int, default=12500,
+                        help='FAISS_ANN_THRESHOLD for that scenario (IVFPQ needs ~10k vectors to train)')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch vector dir')
+    args = parser.parse_args()
+
+    vector_dir = tempfile.mkdtemp(prefix='stress_index_')
+    ctx = mp.get_context('spawn')
+    out = ctx.Queue()
+    procs = []
+    for kind in args.migrate_types:
+        p = ctx.Process(target=migrate_check, args=(vector_dir, args, kind, out), daemon=True)
+        p.start()
+        p.join()
+        procs.append(p)
+    deadline = time.time() + args.duration
+    for role, count in ((uploader, args.uploaders), (deleter, args.deleters), (searcher, args.searchers)):
+        for wid in range(count):
+            p = ctx.Process(target=role, args=(vector_dir, wid, args, deadline, out), daemon=True)
+            p.start()
+            procs.append(p)
+
+    uploaded, deleted, errors, checks = [], [], [], 0
+    while any(p.is_alive() for p in procs) or not out.empty():
+        try:
+            kind, value = out.get(timeout=0.5)
+        except Exception:
+            continue
+        if kind == 'uploaded':
+            uploaded.append(value)
+        elif kind == 'deleted':
+            deleted.append(value)
+        elif kind == 'checks':
+            checks += value
+        else:
+            errors.append(value)
+    crashed = [p.exitcode for p in procs if p.exitcode]
+    if crashed:
+        errors.append(f'{len(crashed)} worker processes exited with errors: {crashed}')
+
+    final_errors, n_rows, n_docs = final_check(vector_dir, args, uploaded, deleted)
+    errors += final_errors
+    print(json.dumps({
+        'duration_s': args.duration,
+        'migrate_types': args.migrate_types,
+        'uploads': len(uploaded),
+        'deletes': len(deleted),
+        'search_checks': checks,
+        'final_rows': n_rows,
+        'final_documents': n_docs,
+        'errors': len(errors),
+    }, indent=2))
+    for e in errors[:20]:
+        print(f'ERROR: {e}')
+    if args.keep:
+        print(f'vector dir kept at {vector_dir}')
+    else:
+        shutil.rmtree(vector_dir, ignore_errors=True)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
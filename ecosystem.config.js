@@ -8,6 +8,8 @@ module.exports = {
       //   script: '/var/www/staging/stg-ai/RAG/venv/bin/gunicorn',
       //   args: 'main:app -b 127.0.0.1:5001 -k gthread -w 2',
       //   interpreter: 'none',
+      // ASGI alternative (async /answer, needs httpx + uvicorn, see requirements.txt):
+      //   args: ['-lc', 'uvicorn asgi:app --workers 2 --host 127.0.0.1 --port 5001'],
       // Generic approach (requires /bin/bash and gunicorn on PATH):
       script: '/bin/bash',
       args: ['-lc', 'gunicorn -w 2 -k gthread -b 127.0.0.1:5001 main:app'],
@@ -17,7 +19,9 @@ module.exports = {
       watch: false,
       env: {
         NODE_ENV: 'production',
-        PYTHONUNBUFFERED: '1'
+        PYTHONUNBUFFERED: '1',
+        // Share FAISS index pages between gunicorn workers (read-only mmap)
+        FAISS_MMAP: '1'
       },
       out_file: './logs/backend_out.log',
       error_file: './logs/backend_err.log',